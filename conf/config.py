@@ -258,6 +258,8 @@ class TestConfiguration(BaseConfiguration):
     AUTH_LDAP_SERVER = "ldap://ldap.example.com"
     AUTH_LDAP_USER_BASE = "ou=users,dc=example,dc=com"
     MAX_THREAD_WORKERS = 1
+    # The Pyxis GraphQL client is mocked per test, do not share it between tests.
+    PYXIS_GQL_POOL_ENABLED = False
 
     HANDLER_BUILD_ALLOWLIST: dict[str, Any] = {}
 
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sqlite3
+import threading
+import time
+
+import dogpile.cache
+from dogpile.cache.api import NO_VALUE, BytesBackend
+
+from freshmaker import conf, log
+
+
+class SQLiteBackend(BytesBackend):
+    """
+    dogpile.cache backend storing the values in a SQLite database file, so
+    they survive Freshmaker restarts.
+
+    The backend is registered as "freshmaker.sqlite" and accepts following
+    arguments:
+
+    - ``filename``: path to the SQLite database file.
+    - ``max_size``: maximum size of all the stored values in bytes. When
+      exceeded, the least recently used values are evicted. 0 means no limit.
+    - ``eviction_interval``: number of writes after which the size of the
+      stored values is checked.
+    """
+
+    def __init__(self, arguments):
+        self.filename = arguments["filename"]
+        self.max_size = int(arguments.get("max_size", 0))
+        self.eviction_interval = int(arguments.get("eviction_interval", 100))
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = None
+        self._pid = None
+
+        dirname = os.path.dirname(self.filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    @property
+    def _connection(self):
+        # SQLite connections can't be shared with forked processes.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self.filename, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, "
+                "value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_serialized(self, key):
+        return self.get_serialized_multi([key])[0]
+
+    def get_serialized_multi(self, keys):
+        if not keys:
+            return []
+        placeholders = ", ".join("?" * len(keys))
+        with self._lock:
+            conn = self._connection
+            rows = conn.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({placeholders})", list(keys)
+            ).fetchall()
+            if rows:
+                found = [key for key, _ in rows]
+                conn.execute(
+                    f"UPDATE cache SET accessed_at = ? WHERE key IN ({', '.join('?' * len(found))})",
+                    [time.time()] + found,
+                )
+        values = dict(rows)
+        return [values.get(key, NO_VALUE) for key in keys]
+
+    def set_serialized(self, key, value):
+        self.set_serialized_multi({key: value})
+
+    def set_serialized_multi(self, mapping):
+        now = time.time()
+        with self._lock:
+            conn = self._connection
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in mapping.items()],
+            )
+            self._writes += len(mapping)
+            if self.max_size and self._writes >= self.eviction_interval:
+                self._writes = 0
+                self._evict(conn)
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        with self._lock:
+            self._connection.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k in keys])
+
+    def delete_by_argument(self, argument):
+        """
+        Deletes the values cached for functions called with the single
+        `argument`, for example all the values cached for a build NVR.
+
+        :param str argument: argument of the cached functions.
+        """
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM cache WHERE substr(key, -?) = ?", (len(argument) + 1, f"|{argument}")
+            )
+
+    def clear(self):
+        """Deletes all the cached values"""
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+
+    def _evict(self, conn):
+        """
+        Evicts the least recently used values until the size of the stored
+        values drops below 90% of `max_size`.
+        """
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()
+        if total <= self.max_size:
+            return
+
+        to_free = total - int(self.max_size * 0.9)
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at"):
+            evicted.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        log.debug("Evicted %d values from the cache %s", len(evicted), self.filename)
+
+
+dogpile.cache.register_backend("freshmaker.sqlite", "freshmaker.cache", "SQLiteBackend")
+
+# Region for the data which never change once they exist, like the Koji
+# build of a NVR. The values never expire, so this region should be backed
+# by a persistent backend like "freshmaker.sqlite".
+immutable_region = dogpile.cache.make_region().configure(
+    conf.immutable_cache_backend, arguments=conf.immutable_cache_arguments
+)
+
+
+def invalidate_immutable_cache(argument=None):
+    """
+    Invalidates the values in the immutable cache region.
+
+    The values are matched by the argument only, so the values cached for
+    the data related to it under another argument are kept. For example
+    invalidating a build NVR keeps the Koji task request of the build, which
+    is cached by its task ID, so the task ID must be invalidated too.
+
+    :param str argument: when set, only the values cached for functions
+        called with this single argument (for example a build NVR or a task
+        ID) are invalidated, otherwise all the values are.
+    """
+    backend = immutable_region.backend
+    if argument is None:
+        if hasattr(backend, "clear"):
+            backend.clear()
+    elif hasattr(backend, "delete_by_argument"):
+        backend.delete_by_argument(str(argument))
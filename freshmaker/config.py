@@ -354,6 +354,20 @@ class Config(object):
             "default": "dogpile.cache.memory",
             "desc": "Name of dogpile.cache backend to use.",
         },
+        "immutable_cache_backend": {
+            "type": str,
+            "default": "dogpile.cache.null",
+            "desc": "Name of dogpile.cache backend to use for the data which never change "
+            "once they exist, like Koji builds and task requests. The values never "
+            'expire, so use a persistent backend like "freshmaker.sqlite".',
+        },
+        "immutable_cache_arguments": {
+            "type": dict,
+            "default": {},
+            "desc": "Arguments of the IMMUTABLE_CACHE_BACKEND. For the "
+            '"freshmaker.sqlite" backend, these are "filename", "max_size" in bytes '
+            'and "eviction_interval".',
+        },
         "messaging_backends": {
             "type": dict,
             "default": {},
@@ -429,6 +443,251 @@ class Config(object):
             "default": 50,
             "desc": "Small page size to be used in Pyxis requests",
         },
+        "pyxis_page_fetch_concurrency": {
+            "type": int,
+            "default": 4,
+            "desc": "Maximum number of pages of a paginated Pyxis GraphQL query fetched "
+            "concurrently. When 1, the pages are fetched one after another.",
+        },
+        "pyxis_adaptive_page_size": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the page size of each type of paginated Pyxis query is "
+            "learned from the observed latency and timeouts. PYXIS_DEFAULT_PAGE_SIZE "
+            "and PYXIS_SMALL_PAGE_SIZE are then only the initial page sizes.",
+        },
+        "pyxis_min_page_size": {
+            "type": int,
+            "default": 10,
+            "desc": "Minimum page size learned with PYXIS_ADAPTIVE_PAGE_SIZE.",
+        },
+        "pyxis_max_page_size": {
+            "type": int,
+            "default": 500,
+            "desc": "Maximum page size learned with PYXIS_ADAPTIVE_PAGE_SIZE.",
+        },
+        "pyxis_page_size_target_latency": {
+            "type": int,
+            "default": 5,
+            "desc": "Number of seconds under which a full page must be returned by Pyxis "
+            "for the page size to grow, with PYXIS_ADAPTIVE_PAGE_SIZE.",
+        },
+        "pyxis_page_size_state_file": {
+            "type": str,
+            "default": "",
+            "desc": "Path to the JSON file storing the page sizes learned with "
+            "PYXIS_ADAPTIVE_PAGE_SIZE, so they survive restarts. When empty, the "
+            "learned page sizes are not stored.",
+        },
+        "repository_catalog_file": {
+            "type": str,
+            "default": "",
+            "desc": "Path to the JSON file with the local catalog of the Red Hat "
+            "container repositories, shared by all the Freshmaker processes on the "
+            "host and refreshed in the background. The host of the Pyxis GraphQL "
+            "URL is added to the file name, e.g. repositories.pyxis.example.com.json, "
+            "so each Pyxis instance has its own catalog. When empty, the repositories "
+            "are queried from Pyxis.",
+        },
+        "repository_catalog_refresh_interval": {
+            "type": int,
+            "default": 600,
+            "desc": "Number of seconds after which the repository catalog is refreshed.",
+        },
+        "repository_catalog_max_age": {
+            "type": int,
+            "default": 3600,
+            "desc": "Number of seconds after which the repository catalog is considered "
+            "outdated and the repositories are queried from Pyxis again.",
+        },
+        "rpm_index_file": {
+            "type": str,
+            "default": "",
+            "desc": "Path to the SQLite database with the local index from RPM name to the "
+            "images with the RPM installed, shared by all the Freshmaker processes on the "
+            "host and synced from Pyxis in the background. When empty, the images are "
+            "searched by their RPMs in Pyxis.",
+        },
+        "rpm_index_sync_interval": {
+            "type": int,
+            "default": 300,
+            "desc": "Number of seconds after which the images updated in Pyxis are synced "
+            "to the RPM image index.",
+        },
+        "rpm_index_max_age": {
+            "type": int,
+            "default": 3600,
+            "desc": "Number of seconds after which the RPM image index is considered "
+            "outdated and the images are searched by their RPMs in Pyxis again.",
+        },
+        "rpm_index_confirm_chunk_size": {
+            "type": int,
+            "default": 50,
+            "desc": "Number of candidate image NVRs from the RPM image index confirmed "
+            "in one Pyxis query.",
+        },
+        "koji_multicall_batching": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the Koji builds, task requests and archives of the "
+            "container images found for a rebuild are fetched with Koji multicall "
+            "requests for a batch of images at once, instead of one image at a time.",
+        },
+        "koji_multicall_batch_size": {
+            "type": int,
+            "default": 100,
+            "desc": "Maximum number of calls sent to Koji in one multicall request, and "
+            "number of images whose Koji data is fetched at once.",
+        },
+        "koji_session_pool_size": {
+            "type": int,
+            "default": 0,
+            "desc": "Maximum number of Koji sessions kept logged in and shared by the "
+            "handlers, to avoid a Kerberos login and logout around every Koji call "
+            "which needs authentication. When 0, every call logs in and out.",
+        },
+        "koji_session_max_age": {
+            "type": int,
+            "default": 3600,
+            "desc": "Number of seconds after which a pooled Koji session is logged in again.",
+        },
+        "koji_session_health_check_interval": {
+            "type": int,
+            "default": 300,
+            "desc": "Number of seconds a pooled Koji session can be idle before its login "
+            "is checked with Koji again before use.",
+        },
+        "koji_task_poll_max_interval": {
+            "type": int,
+            "default": 0,
+            "desc": "Maximum number of seconds between two checks of a running Koji "
+            "build task by the poller. The running tasks are checked less and less "
+            "often, up to this interval. When 0, the tasks are checked on every poll.",
+        },
+        "build_submission_workers": {
+            "type": int,
+            "default": 1,
+            "desc": "Number of threads which check the ODCS composes and submit the "
+            "container image builds of a handler to Koji concurrently. The state of "
+            "the builds is still recorded one build after another by the handler. "
+            "When 1, the builds are submitted one by one.",
+        },
+        "build_submission_max_in_flight": {
+            "type": int,
+            "default": 0,
+            "desc": "Maximum number of container image builds running in Koji at once, "
+            "for all the events. When set, the handlers queue the builds in the database "
+            "and submit them by the priority of their advisory, taking turns between the "
+            "events with the same priority. When 0, the builds are submitted right away.",
+        },
+        "build_submission_claim_timeout": {
+            "type": int,
+            "default": 900,
+            "desc": "Number of seconds after which the queued container image build, picked "
+            "for the submission but still not submitted, is picked again. This happens "
+            "when Freshmaker stops in the middle of the submission, or when the build waits "
+            "for its ODCS composes.",
+        },
+        "critical_path_build_ordering": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the container image builds which start the longest "
+            "chains of builds, by the durations of the past builds of the same images, "
+            "are submitted first, and the completion time of the events is predicted.",
+        },
+        "build_duration_default": {
+            "type": int,
+            "default": 3600,
+            "desc": "Expected duration in seconds of the container image builds "
+            "without any past successful build of the same image.",
+        },
+        "persist_image_lineage": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the parents of the container images are stored in the "
+            "database once resolved, and the image trees are built from the stored "
+            "lineage instead of Pyxis and Koji lookups for every ancestor.",
+        },
+        "pyxis_nvr_batching": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the concurrent Pyxis image lookups by NVR are "
+            "sent to Pyxis in one GraphQL query.",
+        },
+        "pyxis_nvr_batch_size": {
+            "type": int,
+            "default": 20,
+            "desc": "Maximum number of NVRs looked up in one batched Pyxis query.",
+        },
+        "pyxis_nvr_batch_window": {
+            "type": int,
+            "default": 20,
+            "desc": "Maximum time in milliseconds a NVR lookup waits for the batched "
+            "Pyxis query in flight, before the lookups collected meanwhile are sent. The "
+            "lookups done when no batched query is in flight are sent right away.",
+        },
+        "pyxis_repository_chunk_concurrency": {
+            "type": int,
+            "default": 4,
+            "desc": "Maximum number of chunks of repositories queried concurrently when "
+            "looking for the images with the RPMs from an advisory.",
+        },
+        "pyxis_repository_chunk_size": {
+            "type": int,
+            "default": 20,
+            "desc": "Initial number of repositories in a chunk queried at once when "
+            "looking for the images with the RPMs from an advisory.",
+        },
+        "pyxis_repository_max_chunk_size": {
+            "type": int,
+            "default": 80,
+            "desc": "Maximum number of repositories in a chunk. The chunk size doubles, "
+            "up to this value, when a chunk is queried faster than "
+            "PYXIS_REPOSITORY_CHUNK_FAST_TIME, and halves when the query times out.",
+        },
+        "pyxis_repository_chunk_fast_time": {
+            "type": int,
+            "default": 10,
+            "desc": "Number of seconds under which a query for a chunk of repositories "
+            "is considered fast enough to grow the chunk size.",
+        },
+        "pyxis_stream_images": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the published images with the RPMs from an advisory "
+            "are filtered and resolved page by page as the pages arrive from Pyxis, "
+            "instead of after all the pages are fetched.",
+        },
+        "pyxis_gql_pool_enabled": {
+            "type": bool,
+            "default": True,
+            "desc": "When True, the worker threads finding the images to rebuild share "
+            "a pool of keep-alive Pyxis GraphQL clients.",
+        },
+        "pyxis_gql_pool_size": {
+            "type": int,
+            "default": 0,
+            "desc": "Maximum number of clients in the Pyxis GraphQL client pool. "
+            "When 0, MAX_THREAD_WORKERS is used.",
+        },
+        "batch_parent_images_lookup": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the parent images of the images to rebuild are looked up "
+            "level by level, with a single Pyxis query per level of the image hierarchy.",
+        },
+        "pyxis_async_discovery": {
+            "type": bool,
+            "default": False,
+            "desc": "When True, the images to rebuild for RPM advisories are found using "
+            "the asyncio-based Pyxis GraphQL client with concurrent queries.",
+        },
+        "pyxis_async_max_concurrency": {
+            "type": int,
+            "default": 20,
+            "desc": "Maximum number of concurrent Pyxis queries and Koji/ODCS lookups "
+            "when PYXIS_ASYNC_DISCOVERY is enabled.",
+        },
         "product_pages_api_url": {
             "type": str,
             "default": "",
@@ -27,7 +27,7 @@ from typing import Any, Optional, Union
 from freshmaker import conf, log
 from freshmaker.kojiservice import KojiService, KojiLookupError
 from freshmaker.odcsclient import create_odcs_client
-from freshmaker.pyxis_gql import PyxisGQL
+from freshmaker.pyxis_gql import PyxisGQL, get_repository_catalog
 
 
 class ExtraRepoNotConfiguredError(ValueError):
@@ -309,9 +309,16 @@ class ContainerAPI:
         :param bool published: Published attribution of container
         :param list release_categories: List of image release categories
         """
-        repositories = self.pyxis.find_repositories(
-            published=True, release_categories=release_categories
-        )
+        catalog = get_repository_catalog(self.pyxis.url, self.pyxis.cert)
+        repositories = None
+        if catalog:
+            repositories = catalog.find_repositories(
+                published=True, release_categories=release_categories
+            )
+        if repositories is None:
+            repositories = self.pyxis.find_repositories(
+                published=True, release_categories=release_categories
+            )
 
         # Exclude repositories which don't have any auto-rebuild tag
         repositories = [r for r in repositories if r["auto_rebuild_tags"]]
@@ -70,6 +70,19 @@ class ErrataAdvisory(object):
         self._reporter = ""
         self._builds = None
 
+    @property
+    def priority(self):
+        """
+        Returns the priority of the rebuilds for this advisory. The rebuilds
+        for major incidents go first, then the rebuilds for contract priority
+        advisories and then all the others.
+        """
+        if self.is_major_incident:
+            return 2
+        if self.is_contract_priority:
+            return 1
+        return 0
+
     @property
     def affected_rpm_nvrs(self):
         if self._affected_rpm_nvrs is not None:
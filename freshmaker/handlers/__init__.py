@@ -25,13 +25,17 @@ import abc
 import json
 import re
 import copy
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from functools import wraps
 
 from freshmaker import conf, log, db, models, events
 from freshmaker.kojiservice import koji_service, parse_NVR
 from freshmaker.models import ArtifactBuildState
-from freshmaker.types import EventState
-from freshmaker.models import ArtifactBuild, Event
+from freshmaker.types import ArtifactType, EventState
+from freshmaker.models import ArtifactBuild, BuildSubmission, Event
+from freshmaker.monitor import build_submission_queue_wait_time
 from freshmaker.utils import get_rebuilt_nvr, is_valid_ocp_versions_range
 from freshmaker.errors import UnprocessableEntity, ProgrammingError
 from freshmaker.odcsclient import create_odcs_client, FreshmakerODCSClient
@@ -562,6 +566,32 @@ class ContainerBuildHandler(BaseHandler):
         :return: Koji build id.
         :rtype: int
         """
+        container_kwargs = self._prepare_image_artifact_build(build, repo_urls)
+        if container_kwargs is None:
+            return
+
+        try:
+            self._check_odcs_composes_ready(container_kwargs["compose_ids"])
+        except ODCSComposeNotReady as e:
+            self.log_info(str(e))
+            raise
+
+        self._set_rebuilt_nvr(build, container_kwargs)
+        return self._submit_container_build(container_kwargs)
+
+    @fail_artifact_build_on_handler_exception(allowlist=[ODCSComposeNotReady])
+    def _prepare_image_artifact_build(self, build, repo_urls=None):
+        """
+        Validates the ArtifactBuild of 'image' type and returns the keyword
+        arguments of ``build_container`` to submit it with, except the
+        release, which is set by ``_set_rebuilt_nvr``.
+
+        :param build: ArtifactBuild of 'image' type.
+        :param list[str] repo_urls: list of YUM repository URLs.
+        :return: keyword arguments of ``build_container``, or None when
+            the build has been moved to the FAILED state.
+        :rtype: dict or None
+        """
         if build.state != ArtifactBuildState.PLANNED.value:
             build.transition(
                 ArtifactBuildState.FAILED.value, "Container image build is not in PLANNED state."
@@ -629,19 +659,44 @@ class ContainerBuildHandler(BaseHandler):
         if args.get("renewed_odcs_compose_ids"):
             compose_ids += args["renewed_odcs_compose_ids"]
 
+        return {
+            "scm_url": scm_url,
+            "branch": branch,
+            "target": target,
+            "repo_urls": repo_urls,
+            "flatpak": flatpak,
+            "isolated": isolated,
+            "koji_parent_build": parent,
+            "arch_override": arches,
+            "compose_ids": compose_ids,
+            "operator_csv_modifications_url": args.get("operator_csv_modifications_url"),
+        }
+
+    def _check_odcs_composes_ready(self, compose_ids):
+        """
+        Raises ODCSComposeNotReady in case any of the ODCS composes is
+        still generating.
+
+        This method does not touch the database, so it can be called from
+        the build submission worker threads.
+
+        :param list[int] compose_ids: ODCS compose ids.
+        """
         for compose_id in compose_ids:
             odcs_compose = self.odcs_get_compose(compose_id)
             if odcs_compose["state"] in [COMPOSE_STATES["wait"], COMPOSE_STATES["generating"]]:
-                # In case the ODCS compose is still generating, raise an
-                # exception.
-                msg = "Compose %s has not been generated yet. Waiting with " "rebuild." % (
-                    str(compose_id)
+                raise ODCSComposeNotReady(
+                    "Compose %s has not been generated yet. Waiting with rebuild." % compose_id
                 )
-                self.log_info(msg)
-                raise ODCSComposeNotReady(msg)
             # OSBS can renew a compose if it needs to, so we can just pass
             # it along without further verification for other states.
 
+    @fail_artifact_build_on_handler_exception(allowlist=[ODCSComposeNotReady])
+    def _set_rebuilt_nvr(self, build, container_kwargs):
+        """
+        Sets a new rebuilt_nvr of the `build` and the matching release in
+        the `container_kwargs`.
+        """
         rebuilt_nvr = get_rebuilt_nvr(build.type, build.original_nvr)
         if build.rebuilt_nvr is not None:
             self.log_debug(
@@ -655,20 +710,32 @@ class ContainerBuildHandler(BaseHandler):
         build.rebuilt_nvr = rebuilt_nvr
         db.session.commit()
 
+        container_kwargs["release"] = parse_NVR(build.rebuilt_nvr)["release"]
+
+    def _submit_container_build(self, container_kwargs):
+        """
+        Submits the container build described by the `container_kwargs`
+        returned by ``_prepare_image_artifact_build`` to Koji.
+
+        This method does not touch the database, so it can be called from
+        the build submission worker threads.
+
+        :return: Koji build id.
+        :rtype: int
+        """
+        kwargs = dict(container_kwargs)
         return self.build_container(
-            scm_url,
-            branch,
-            target,
-            repo_urls=repo_urls,
-            flatpak=flatpak,
-            isolated=isolated,
-            release=parse_NVR(build.rebuilt_nvr)["release"],
-            koji_parent_build=parent,
-            arch_override=arches,
-            compose_ids=compose_ids,
-            operator_csv_modifications_url=args.get("operator_csv_modifications_url"),
+            kwargs.pop("scm_url"), kwargs.pop("branch"), kwargs.pop("target"), **kwargs
         )
 
+    @fail_artifact_build_on_handler_exception(allowlist=[ODCSComposeNotReady])
+    def _get_worker_result(self, future):
+        """
+        Returns the result of the build submission worker `future`, its
+        exception is handled as if it was raised in this thread.
+        """
+        return future.result()
+
     def odcs_get_compose(self, compose_id):
         """
         Returns the information from the ODCS server about compose with id
@@ -707,15 +774,167 @@ class ContainerBuildHandler(BaseHandler):
     def start_to_build_images(self, builds):
         """Start to build images
 
+        When CRITICAL_PATH_BUILD_ORDERING is set, the builds are submitted
+        in the order of ``_sort_by_critical_path``. When
+        BUILD_SUBMISSION_MAX_IN_FLIGHT is set, the builds are queued and
+        submitted by ``submit_queued_builds`` instead. When
+        BUILD_SUBMISSION_WORKERS is greater than 1, the builds are submitted
+        concurrently, see ``_start_to_build_images_concurrently``.
+
         :param builds: list of ArtifactBuild, each of them represents a
             container image to be rebuilt.
         :type builds: list or tuple
         """
+        builds = list(builds)
+        if conf.critical_path_build_ordering and builds:
+            builds = self._sort_by_critical_path(builds)
+        if conf.build_submission_max_in_flight:
+            for build in builds:
+                BuildSubmission.enqueue(db.session, build)
+            db.session.commit()
+            self.submit_queued_builds()
+            return
+
+        self._submit_image_builds(builds)
+
+    def _sort_by_critical_path(self, builds):
+        """
+        Returns the `builds` sorted by the expected duration of the longest
+        chain of PLANNED builds they start, the longest first, so the builds
+        holding up the completion of their event the most are submitted
+        first. The expected durations come from
+        ``ArtifactBuild.get_expected_durations``.
+
+        Also records the predicted completion time of the events of the
+        `builds`, unless it has been recorded already.
+
+        :param list builds: list of ArtifactBuild.
+        :rtype: list
+        """
+        events = {build.event_id: build.event for build in builds}
+        planned = set(builds)
+        planned.update(
+            db.session.query(ArtifactBuild).filter(
+                ArtifactBuild.event_id.in_(list(events)),
+                ArtifactBuild.state == ArtifactBuildState.PLANNED.value,
+            )
+        )
+        durations = ArtifactBuild.get_expected_durations(
+            db.session, planned, conf.build_duration_default
+        )
+        children = defaultdict(list)
+        for build in planned:
+            if build.dep_on_id:
+                children[build.dep_on_id].append(build)
+
+        critical_paths = {}
+
+        def critical_path(build):
+            if build.id not in critical_paths:
+                critical_paths[build.id] = durations[build.id] + max(
+                    (critical_path(child) for child in children[build.id]), default=0
+                )
+            return critical_paths[build.id]
+
+        now = datetime.utcnow()
+        for event_id, event in events.items():
+            if event.predicted_time_done is None:
+                remaining = max(critical_path(b) for b in builds if b.event_id == event_id)
+                event.predicted_time_done = now + timedelta(seconds=remaining)
+        db.session.commit()
+
+        return sorted(builds, key=critical_path, reverse=True)
+
+    def submit_queued_builds(self):
+        """
+        Submits the queued builds of all the events, as long as fewer than
+        BUILD_SUBMISSION_MAX_IN_FLIGHT container image builds of the events
+        in progress run in Koji.
+
+        The builds are claimed by ``BuildSubmission.claim_next`` and stay in
+        the queue until they are submitted, so the builds claimed by the
+        submission which did not finish are claimed again once their claim
+        expires. The queued builds which are no longer PLANNED, because they
+        have been submitted, canceled or their dependency failed, are dropped
+        from the queue.
+
+        The producer and the handlers submit the queued builds concurrently,
+        so the builds are counted and claimed with the queue locked, and the
+        builds claimed but not submitted yet count as in flight.
+        """
+        if not conf.build_submission_max_in_flight:
+            return
+
+        BuildSubmission.lock_queue(db.session)
+        # The builds of the events older than a week are not tracked by the
+        # producer anymore, so they are not counted either.
+        stale_date = datetime.utcnow() - timedelta(days=7)
+        in_flight = (
+            db.session.query(ArtifactBuild)
+            .join(Event, ArtifactBuild.event_id == Event.id)
+            .filter(
+                Event.state.in_([EventState.INITIALIZED.value, EventState.BUILDING.value]),
+                Event.time_created >= stale_date,
+                ArtifactBuild.type == ArtifactType.IMAGE.value,
+                ArtifactBuild.state == ArtifactBuildState.BUILD.value,
+            )
+            .count()
+        )
+        in_flight += BuildSubmission.count_claimed(db.session, conf.build_submission_claim_timeout)
+        limit = conf.build_submission_max_in_flight - in_flight
+        submissions = []
+        if limit > 0:
+            submissions = BuildSubmission.claim_next(
+                db.session, limit, conf.build_submission_claim_timeout
+            )
+        # Releases the lock of the queue.
+        db.session.commit()
+        if not submissions:
+            return
+        now = datetime.utcnow()
+        builds = []
+        for submission in submissions:
+            if submission.build.state == ArtifactBuildState.PLANNED.value:
+                build_submission_queue_wait_time.labels(priority=submission.priority).observe(
+                    (now - submission.time_queued).total_seconds()
+                )
+                builds.append(submission.build)
+
+        # The queued builds can belong to other events than the one handled
+        # now, so submit them in the DRY_RUN mode of their own event and
+        # restore the context of this handler afterwards.
+        context = (self._db_event_id, self._db_artifact_build_id, self._log_prefix)
+        force_dry_run = self._force_dry_run
+        try:
+            for dry_run in (False, True):
+                self._force_dry_run = dry_run
+                self._submit_image_builds(
+                    [build for build in builds if bool(build.event.dry_run) == dry_run]
+                )
+        finally:
+            self._db_event_id, self._db_artifact_build_id, self._log_prefix = context
+            self._force_dry_run = force_dry_run
+
+        # The builds still PLANNED wait for their ODCS composes. They stay
+        # claimed until they are queued again once the composes are done.
+        for submission in submissions:
+            if submission.build.state != ArtifactBuildState.PLANNED.value:
+                db.session.delete(submission)
+        db.session.commit()
+
+    def _submit_image_builds(self, builds):
+        """
+        Submits the `builds` to Koji right away.
+
+        :param list builds: list of ArtifactBuild to build.
+        """
+        if conf.build_submission_workers > 1 and len(builds) > 1:
+            self._start_to_build_images_concurrently(builds)
+            return
 
         def build_image(build):
             self.set_context(build)
             repo_urls = self.get_repo_urls(build)
-            unknown_exception_occurred = False
             try:
                 build.build_id = self.build_image_artifact_build(build, repo_urls)
             except ODCSComposeNotReady:
@@ -723,27 +942,90 @@ class ContainerBuildHandler(BaseHandler):
                 # compose is finished.
                 return
             except Exception:
-                self.log_except(
-                    "While processing the event with id {} exception occurred".format(
-                        self._db_event_id
-                    )
-                )
-                unknown_exception_occurred = True
-
-            if unknown_exception_occurred:
-                build.transition(ArtifactBuildState.FAILED.value, "An unknown error occurred.")
-            elif build.state == ArtifactBuildState.FAILED.value:
-                log.debug(f"Build {build.id} failed: {build.state_reason}")
-            elif not build.build_id:
-                build.transition(
-                    ArtifactBuildState.FAILED.value, "Error while building container image in Koji."
-                )
-            else:
-                build.transition(
-                    ArtifactBuildState.BUILD.value, "Building container image in Koji."
-                )
-
-            db.session.add(build)
-            db.session.commit()
+                self._record_image_build_submission(build, unknown_exception_occurred=True)
+                return
+            self._record_image_build_submission(build)
 
         list(map(build_image, builds))
+
+    def _start_to_build_images_concurrently(self, builds):
+        """
+        Starts to build the images like ``start_to_build_images``, but the
+        ODCS compose checks and the Koji build submissions are done by
+        BUILD_SUBMISSION_WORKERS threads.
+
+        The worker threads do not touch the database nor the handler context.
+        The builds are validated and their state changes are recorded in this
+        thread, one build after another in the order of `builds`, so they end
+        up in the same state as when submitted one by one.
+
+        :param list builds: list of ArtifactBuild to build.
+        """
+        with ThreadPoolExecutor(
+            max_workers=conf.build_submission_workers, thread_name_prefix="build-submission"
+        ) as executor:
+            checks = []
+            for build in builds:
+                self.set_context(build)
+                repo_urls = self.get_repo_urls(build)
+                try:
+                    container_kwargs = self._prepare_image_artifact_build(build, repo_urls)
+                except Exception:
+                    self._record_image_build_submission(build, unknown_exception_occurred=True)
+                    continue
+                if container_kwargs is None:
+                    self._record_image_build_submission(build)
+                    continue
+                future = executor.submit(
+                    self._check_odcs_composes_ready, container_kwargs["compose_ids"]
+                )
+                checks.append((build, container_kwargs, future))
+
+            submissions = []
+            for build, container_kwargs, future in checks:
+                self.set_context(build)
+                try:
+                    self._get_worker_result(future)
+                    self._set_rebuilt_nvr(build, container_kwargs)
+                except ODCSComposeNotReady as e:
+                    # We skip this image for now. It will be built once the
+                    # ODCS compose is finished.
+                    self.log_info(str(e))
+                    continue
+                except Exception:
+                    self._record_image_build_submission(build, unknown_exception_occurred=True)
+                    continue
+                future = executor.submit(self._submit_container_build, container_kwargs)
+                submissions.append((build, future))
+
+            for build, future in submissions:
+                self.set_context(build)
+                try:
+                    build.build_id = self._get_worker_result(future)
+                except Exception:
+                    self._record_image_build_submission(build, unknown_exception_occurred=True)
+                    continue
+                self._record_image_build_submission(build)
+
+    def _record_image_build_submission(self, build, unknown_exception_occurred=False):
+        """
+        Moves the `build` to the state matching the result of its submission
+        to Koji and commits it. Must be called from the except block when
+        `unknown_exception_occurred` is True.
+        """
+        if unknown_exception_occurred:
+            self.log_except(
+                "While processing the event with id {} exception occurred".format(self._db_event_id)
+            )
+            build.transition(ArtifactBuildState.FAILED.value, "An unknown error occurred.")
+        elif build.state == ArtifactBuildState.FAILED.value:
+            log.debug(f"Build {build.id} failed: {build.state_reason}")
+        elif not build.build_id:
+            build.transition(
+                ArtifactBuildState.FAILED.value, "Error while building container image in Koji."
+            )
+        else:
+            build.transition(ArtifactBuildState.BUILD.value, "Building container image in Koji.")
+
+        db.session.add(build)
+        db.session.commit()
@@ -19,6 +19,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import copy
 import koji
 import json
 
@@ -174,7 +175,7 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
 
         return pyxis.get_images_by_brew_package(self.event.container_images)
 
-    def get_image_tree(self, pyxis, image, tree):
+    def get_image_tree(self, pyxis, image, tree, recorded_ancestors=None, resolved_ancestors=None):
         """
         This method recursively finds the tree for given image, up to the base image.
         At every recursive call it will add one element of the tree.
@@ -183,9 +184,33 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
         :param pyxis PyxisAPI: PyxisAPI instance
         :param image ContainerImage: image of which we want the tree.
         :param tree list: the list of images that we found until now.
+        :param recorded_ancestors dict: ancestors recorded in the image lineage, see
+            PyxisAPI.get_recorded_ancestors. They are fetched for the image when not set.
+        :param resolved_ancestors dict: images of the recorded_ancestors by their NVR,
+            see `resolve_recorded_ancestors`.
         :return: list of images, in this order: [parent, grandparent, ..., baseimage]
         :rtype: list
         """
+        if conf.persist_image_lineage and not tree:
+            if recorded_ancestors is None:
+                recorded_ancestors = pyxis.get_recorded_ancestors([image.nvr])
+                resolved_ancestors = self.resolve_recorded_ancestors(pyxis, recorded_ancestors)
+            # Take the ancestors with recorded lineage at once and continue
+            # the lookup one by one from the oldest of them.
+            for nvr in recorded_ancestors.get(image.nvr, []):
+                # The base image has been reached
+                if nvr is None:
+                    return tree
+                parent = resolved_ancestors.get(nvr)
+                if not parent:
+                    return tree
+                # The ancestors can be shared by multiple trees, copy them so
+                # the trees stay independent.
+                parent = copy.copy(parent)
+                image["parent"] = parent
+                tree.append(parent)
+                image = parent
+
         parent_nvr = pyxis.find_parent_brew_build_nvr_from_child(image)
         if parent_nvr:
             parent = pyxis.get_images_by_nvrs([parent_nvr], published=None)
@@ -197,6 +222,31 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
                 return self.get_image_tree(pyxis, parent, tree)
         return tree
 
+    def resolve_recorded_ancestors(self, pyxis, recorded_ancestors):
+        """
+        Queries Pyxis for all the `recorded_ancestors` at once and resolves
+        each of them only once, even when they are ancestors of multiple
+        images.
+
+        :param pyxis PyxisAPI: PyxisAPI instance
+        :param recorded_ancestors dict: output of PyxisAPI.get_recorded_ancestors.
+        :return: resolved images by their NVR.
+        :rtype: dict
+        """
+        nvrs = list(
+            dict.fromkeys(
+                nvr for ancestors in recorded_ancestors.values() for nvr in ancestors if nvr
+            )
+        )
+        if not nvrs:
+            return {}
+        parents = {}
+        for parent in pyxis.get_images_by_nvrs(nvrs, published=None):
+            parents.setdefault(parent.nvr, parent)
+        for parent, koji_data in PyxisAPI._iter_with_koji_data(parents.values()):
+            parent.resolve(pyxis, None, koji_data)
+        return parents
+
     def filter_images_based_on_dist_git_branch(self, images, db_event):
         """
         Filter images based on the dist-git branch requested by the user. If the images were never
@@ -298,8 +348,15 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
         # the requested images and the following elements are the elements in the tree up to the
         # base image.
         images_trees = []
+        recorded_ancestors = resolved_ancestors = None
+        if conf.persist_image_lineage:
+            recorded_ancestors = pyxis.get_recorded_ancestors(
+                [image.nvr for image in images_to_rebuild]
+            )
+            resolved_ancestors = self.resolve_recorded_ancestors(pyxis, recorded_ancestors)
         for image in images_to_rebuild:
-            images_trees.append([image] + self.get_image_tree(pyxis, image, []))
+            tree = self.get_image_tree(pyxis, image, [], recorded_ancestors, resolved_ancestors)
+            images_trees.append([image] + tree)
 
         # Let's remove duplicated images which share the same name and version, but different
         # release.
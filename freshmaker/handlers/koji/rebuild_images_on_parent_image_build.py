@@ -82,10 +82,12 @@ class RebuildImagesOnParentImageBuild(ContainerBuildHandler):
         )
 
         self.set_context(found_build)
-        if found_build.event.state not in [EventState.INITIALIZED.value, EventState.BUILDING.value]:
-            return
-        self.update_db_build_state(build_id, found_build, event)
-        self.rebuild_dependent_containers(found_build)
+        if found_build.event.state in [EventState.INITIALIZED.value, EventState.BUILDING.value]:
+            self.update_db_build_state(build_id, found_build, event)
+            self.rebuild_dependent_containers(found_build)
+
+        # The finished build makes room for the queued builds of any event.
+        self.submit_queued_builds()
 
     @fail_artifact_build_on_handler_exception()
     def update_db_build_state(self, build_id, found_build, event):
@@ -30,6 +30,7 @@ from freshmaker import conf, db
 from freshmaker.events import ErrataRPMAdvisoryShippedEvent, ManualRebuildWithAdvisoryEvent
 from freshmaker.handlers import ContainerBuildHandler, fail_event_on_handler_exception
 from freshmaker.image import PyxisAPI
+from freshmaker.image_async import PyxisAsyncAPI
 from freshmaker.pulp import Pulp
 from freshmaker.errata import Errata
 from freshmaker.types import ArtifactType, ArtifactBuildState, EventState, RebuildReason
@@ -425,7 +426,10 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
 
         # Query images from Pyxis by signed RPM's srpm name and found
         # content sets
-        pyxis = PyxisAPI(server_url=conf.pyxis_graphql_url)
+        if conf.pyxis_async_discovery:
+            pyxis = PyxisAsyncAPI(server_url=conf.pyxis_graphql_url)
+        else:
+            pyxis = PyxisAPI(server_url=conf.pyxis_graphql_url)
         # Check if we are allowed to rebuild unpublished images and clear
         # published and release_categories if so.
         if self.event.is_allowed(self, published=True):
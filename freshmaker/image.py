@@ -23,19 +23,40 @@
 #            Jan Kaluza <jkaluza@redhat.com>
 #            Ralph Bean <rbean@redhat.com>
 
-import copy
+import bisect
 import re
 import requests
+import time
 import dogpile.cache
 import kobo.rpmlib
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from itertools import groupby, islice
+from sqlalchemy.exc import SQLAlchemyError
 
 from freshmaker import log, conf
 from freshmaker.kojiservice import koji_service
+from freshmaker.models import ImageLineage
 from freshmaker.odcsclient import create_odcs_client
-from freshmaker.pyxis_gql import PyxisGQL
-from freshmaker.utils import sorted_by_nvr, is_pkg_modular
+from freshmaker.pyxis_gql import (
+    IMAGE_PROJECTION_FULL,
+    IMAGE_PROJECTION_MINIMAL,
+    IMAGE_PROJECTION_REPOS,
+    IMAGE_PROJECTION_RPM_NAMES,
+    PyxisGQL,
+    PyxisGQLRequestTimeout,
+    get_repository_catalog,
+    pyxis_gql_client,
+    timeout_retries,
+)
+from freshmaker.rpm_index import get_rpm_index
+from freshmaker.utils import (
+    compare_parsed_rpms,
+    kahn_layers,
+    parse_rpm_nvra,
+    nvr_sort_key,
+    parse_rpm_nvrs,
+    sorted_by_nvr,
+)
 from freshmaker.utils import retry
 import koji
 
@@ -170,91 +191,137 @@ class ContainerImage(dict):
 
         In case of lookup error, the "error" will be set to error string.
         """
-        data = cls._get_default_additional_data()
-
         with koji_service(conf.koji_profile, log, dry_run=conf.dry_run, login=False) as session:
             build = session.get_build(nvr)
-            if not build:
-                raise KojiLookupError("Cannot find Koji build with nvr %s in Koji" % nvr)
-
-            if "task_id" not in build or not build["task_id"]:
-                if (
-                    "extra" in build
-                    and "container_koji_task_id" in build["extra"]
-                    and build["extra"]["container_koji_task_id"]
-                ):
-                    build["task_id"] = build["extra"]["container_koji_task_id"]
-                else:
-                    raise KojiLookupError(
-                        "Cannot find task_id or container_koji_task_id "
-                        "in the Koji build %r" % build
-                    )
-
-            fs_koji_task_id = build.get("extra", {}).get("filesystem_koji_task_id")
-            if fs_koji_task_id:
-                data["filesystem_koji_task_id"] = fs_koji_task_id
-                parsed_nvr = koji.parse_NVR(nvr)
-                name_version = f'{parsed_nvr["name"]}-{parsed_nvr["version"]}'
-                if name_version not in conf.image_extra_repo:
-                    msg = (
-                        f"{name_version} is a base image, but extra image repo for it "
-                        f"is not specified in the Freshmaker configuration."
-                    )
-                    raise ExtraRepoNotConfiguredError(msg)
-
-            extra_image = build.get("extra", {}).get("image", {})
-            # Get the list of ODCS composes used to build the image.
-            if extra_image.get("odcs", {}).get("compose_ids"):
-                data["odcs_compose_ids"] = extra_image["odcs"]["compose_ids"]
-
-            data["parent_build_id"] = extra_image.get("parent_build_id")
-            data["parent_image_builds"] = extra_image.get("parent_image_builds")
-
-            flatpak = extra_image.get("flatpak", False)
-            if flatpak:
-                data["flatpak"] = flatpak
-
-            brew_task = session.get_task_request(build["task_id"])
-            source = brew_task[0]
-            data["target"] = brew_task[1]
-            extra_data = brew_task[2]
-            if "git_branch" in extra_data:
-                data["git_branch"] = extra_data["git_branch"]
+            task_id = cls._get_build_task_id(nvr, build)
+            brew_task = session.get_task_request(task_id)
+            if not conf.supply_arch_overrides:
+                arches = None
             else:
-                data["git_branch"] = "unknown"
-
-            # Some builds do not have "source" attribute filled in, so try
-            # both build["source"] and task_request[0] sources.
-            sources = [source]
-            if "source" in build:
-                sources.insert(0, build["source"])
-            for src in sources:
-                m = re.match(r".*/(?P<namespace>.*)/(?P<container>.*)#(?P<commit>.*)", src)
-                if m:
-                    namespace = m.group("namespace")
-                    # For some Koji tasks, the container part ends with "?" in
-                    # source URL. This is just because some custom scripts for
-                    # submitting those builds include this character in source URL
-                    # to mark the query part of URL. We need to handle that by
-                    # stripping that character.
-                    container = m.group("container").rstrip("?")
-                    data["repository"] = namespace + "/" + container
-
-                    # There might be tasks which have branch name in
-                    # "origin/branch_name" format, so detect it set commit
-                    # hash only if this is not true.
-                    if "/" not in m.group("commit"):
-                        data["commit"] = m.group("commit")
-                        break
+                arches = cls._get_arches_from_koji(session, build["build_id"])
 
-            if not data["commit"]:
-                raise KojiLookupError("Cannot find valid source of Koji build %r" % build)
+        return cls._get_additional_data_from_build(nvr, build, brew_task, arches)
 
-            if not conf.supply_arch_overrides:
-                data["arches"] = None
-            else:
-                data["arches"] = cls._get_arches_from_koji(session, build["build_id"])
+    @classmethod
+    def get_additional_data_from_koji_by_nvrs(cls, nvrs):
+        """
+        Batch version of `get_additional_data_from_koji`, which finds all the
+        builds defined by `nvrs` in Koji with a few multicall requests.
+
+        :param list nvrs: NVRs of the container builds.
+        :return: dict with the NVR as a key and the additional data as a
+            value. The NVRs with lookup errors are missing in the dict, the
+            callers look them up with `get_additional_data_from_koji` to
+            report the error.
+        :rtype: dict
+        """
+        with koji_service(conf.koji_profile, log, dry_run=conf.dry_run, login=False) as session:
+            builds = session.get_container_builds(nvrs, with_arches=conf.supply_arch_overrides)
 
+        additional_data = {}
+        for nvr, build_data in builds.items():
+            if not build_data["task_request"]:
+                continue
+            if conf.supply_arch_overrides and build_data["arches"] is None:
+                continue
+            try:
+                additional_data[nvr] = cls._get_additional_data_from_build(
+                    nvr, build_data["build"], build_data["task_request"], build_data["arches"]
+                )
+            except (KojiLookupError, ExtraRepoNotConfiguredError):
+                continue
+        return additional_data
+
+    @staticmethod
+    def _get_build_task_id(nvr, build):
+        """
+        Returns the ID of the task which built the Koji `build`.
+
+        :raises KojiLookupError: when the build or its task ID is not found.
+        """
+        if not build:
+            raise KojiLookupError("Cannot find Koji build with nvr %s in Koji" % nvr)
+
+        if "task_id" not in build or not build["task_id"]:
+            if (
+                "extra" in build
+                and "container_koji_task_id" in build["extra"]
+                and build["extra"]["container_koji_task_id"]
+            ):
+                return build["extra"]["container_koji_task_id"]
+            raise KojiLookupError(
+                "Cannot find task_id or container_koji_task_id in the Koji build %r" % build
+            )
+        return build["task_id"]
+
+    @classmethod
+    def _get_additional_data_from_build(cls, nvr, build, brew_task, arches):
+        """
+        Returns the additional data of the image `nvr` from its Koji `build`,
+        the request of the task which built it and the image arches.
+        """
+        data = cls._get_default_additional_data()
+
+        fs_koji_task_id = build.get("extra", {}).get("filesystem_koji_task_id")
+        if fs_koji_task_id:
+            data["filesystem_koji_task_id"] = fs_koji_task_id
+            parsed_nvr = koji.parse_NVR(nvr)
+            name_version = f'{parsed_nvr["name"]}-{parsed_nvr["version"]}'
+            if name_version not in conf.image_extra_repo:
+                msg = (
+                    f"{name_version} is a base image, but extra image repo for it "
+                    f"is not specified in the Freshmaker configuration."
+                )
+                raise ExtraRepoNotConfiguredError(msg)
+
+        extra_image = build.get("extra", {}).get("image", {})
+        # Get the list of ODCS composes used to build the image.
+        if extra_image.get("odcs", {}).get("compose_ids"):
+            data["odcs_compose_ids"] = extra_image["odcs"]["compose_ids"]
+
+        data["parent_build_id"] = extra_image.get("parent_build_id")
+        data["parent_image_builds"] = extra_image.get("parent_image_builds")
+
+        flatpak = extra_image.get("flatpak", False)
+        if flatpak:
+            data["flatpak"] = flatpak
+
+        source = brew_task[0]
+        data["target"] = brew_task[1]
+        extra_data = brew_task[2]
+        if "git_branch" in extra_data:
+            data["git_branch"] = extra_data["git_branch"]
+        else:
+            data["git_branch"] = "unknown"
+
+        # Some builds do not have "source" attribute filled in, so try
+        # both build["source"] and task_request[0] sources.
+        sources = [source]
+        if "source" in build:
+            sources.insert(0, build["source"])
+        for src in sources:
+            m = re.match(r".*/(?P<namespace>.*)/(?P<container>.*)#(?P<commit>.*)", src)
+            if m:
+                namespace = m.group("namespace")
+                # For some Koji tasks, the container part ends with "?" in
+                # source URL. This is just because some custom scripts for
+                # submitting those builds include this character in source URL
+                # to mark the query part of URL. We need to handle that by
+                # stripping that character.
+                container = m.group("container").rstrip("?")
+                data["repository"] = namespace + "/" + container
+
+                # There might be tasks which have branch name in
+                # "origin/branch_name" format, so detect it set commit
+                # hash only if this is not true.
+                if "/" not in m.group("commit"):
+                    data["commit"] = m.group("commit")
+                    break
+
+        if not data["commit"]:
+            raise KojiLookupError("Cannot find valid source of Koji build %r" % build)
+
+        data["arches"] = arches
         return data
 
     @staticmethod
@@ -265,13 +332,20 @@ class ContainerImage(dict):
         ]
         return " ".join(sorted(arches))
 
-    def resolve_commit(self):
+    def resolve_commit(self, koji_data=None):
         """
         Uses the ContainerImage data to resolve the information about
         commit from which the Docker image has been built.
 
         Sets the "repository and "commit" keys/values if available.
+
+        :param dict koji_data: additional data of the image already fetched
+            by `get_additional_data_from_koji_by_nvrs`, if any.
         """
+        if koji_data is not None:
+            self.update(koji_data)
+            return
+
         # Find the additional data for Container build in Koji.
         try:
             data = self.get_additional_data_from_koji(self.nvr)
@@ -377,10 +451,46 @@ class ContainerImage(dict):
         )
         self.update({"content_sets": []})
 
-    def resolve_published(self, pyxis_api_instance):
+    def resolve_published(self, pyxis_api_instance, pyxis_images=None):
+        """
+        Finds out if the image was actually published.
+
+        :param list pyxis_images: Pyxis image data with this image NVR and the
+            complete RPM manifest already fetched by the caller, if any. When
+            set, Pyxis is not queried again.
+        """
+        if pyxis_images is not None:
+            self.set_published(pyxis_images)
+            return
+
         # Get the published version of this image to find out if the image
         # was actually published.
-        images = pyxis_api_instance.find_images_by_nvr(self.nvr)
+        images = pyxis_api_instance.find_images_by_nvr(self.nvr, IMAGE_PROJECTION_REPOS)
+        if self.is_unpublished(images):
+            # The complete RPM manifest is needed only for unpublished images
+            images = pyxis_api_instance.find_images_by_nvr(self.nvr, IMAGE_PROJECTION_FULL)
+        self.set_published(images)
+
+    @staticmethod
+    def is_unpublished(images):
+        """
+        Returns True when the Pyxis `images` with the same NVR are found, but
+        none of them is published.
+
+        :param list images: Pyxis image data returned for an image NVR.
+        :rtype: bool
+        """
+        return bool(images) and not any(
+            r["published"] for img in images for r in img["repositories"]
+        )
+
+    def set_published(self, images):
+        """
+        Sets the "published" key (and the complete "rpm_manifest" for
+        unpublished images) based on the Pyxis images with this image NVR.
+
+        :param list images: Pyxis image data returned for this image NVR.
+        """
         if not images:
             log.warning("No image %s found in Pyxis.", self.nvr)
             return
@@ -398,17 +508,22 @@ class ContainerImage(dict):
             # image, because it is relatively big, so fetch it only when needed.
             self["rpm_manifest"] = [{"rpms": images[0]["edges"]["rpm_manifest"]["data"]["rpms"]}]
 
-    def resolve(self, pyxis_api_instance, children=None):
+    def resolve(self, pyxis_api_instance, children=None, koji_data=None, pyxis_images=None):
         """
         Resolves the Container image - populates additional metadata by
         querying Koji and Pyxis.
+
+        :param dict koji_data: additional data of the image already fetched
+            from Koji, see `resolve_commit`.
+        :param list pyxis_images: Pyxis image data with this image NVR already
+            fetched, see `resolve_published`.
         """
         try:
             log.debug("Resolving image: %s", self.nvr)
-            self.resolve_commit()
+            self.resolve_commit(koji_data)
             self.resolve_compose_sources()
             self.resolve_content_sets(pyxis_api_instance, children)
-            self.resolve_published(pyxis_api_instance)
+            self.resolve_published(pyxis_api_instance, pyxis_images)
         except Exception as e:
             err = "Cannot resolve the container image: %s" % e
             self.log_error(err)
@@ -435,6 +550,38 @@ class ContainerImage(dict):
             return
         return rpm_manifest["rpms"]
 
+    def get_parsed_rpms(self, rpm_names):
+        """
+        Returns the RPMs with the `rpm_names` from the Container image parsed
+        by ``freshmaker.utils.parse_rpm_nvra``.
+
+        The RPMs are parsed lazily only once and cached until the RPM manifest
+        of the image changes, so the RPMs which are not compared are never
+        parsed.
+
+        :param Iterable rpm_names: Names of the RPMs to return.
+        :rtype: dict or None
+        :return: Dict with RPM name as a key and list of parsed RPMs as a
+            value, or None when it is not known what RPMs are in the image.
+        """
+        rpms = self.get_rpms()
+        if rpms is None:
+            return None
+        cached = getattr(self, "_parsed_rpms", None)
+        if cached is None or cached[0] is not rpms:
+            cached = (rpms, {})
+            self._parsed_rpms = cached
+
+        parsed_rpms = cached[1]
+        missing = {name for name in rpm_names if name not in parsed_rpms}
+        if missing:
+            for name in missing:
+                parsed_rpms[name] = []
+            for rpm in rpms:
+                if rpm.get("name") in missing:
+                    parsed_rpms[rpm["name"]].append(parse_rpm_nvra(rpm["nvra"]))
+        return {name: parsed_rpms[name] for name in rpm_names if parsed_rpms[name]}
+
     def get_registry_repositories(self, pyxis_api_instance):
         if self["repositories"]:
             return self["repositories"]
@@ -460,6 +607,423 @@ class ContainerImage(dict):
         return previous_images[0].get_registry_repositories(pyxis_api_instance)
 
 
+class ImagesToRebuildDeduplicator(object):
+    """
+    Deduplicates the images in the rebuild lists built by
+    ``PyxisAPI.find_images_to_rebuild``, see
+    ``PyxisAPI._deduplicate_images_to_rebuild`` for the details.
+
+    The rebuild lists are added one by one and the temporary dicts needed
+    for the deduplication are kept up to date as the lists arrive, so the
+    lists can be deduplicated repeatedly without constructing the dicts and
+    sorting the NVRs of every image group again. Only the image groups which
+    changed since the last deduplication are deduplicated, unless
+    CONTAINER_RELEASED_DEPENDENCIES_ONLY is set, but the content sets are
+    copied in all of them on every deduplication, as before. The replaced
+    images are not referenced by the temporary dicts, so they can be freed.
+    """
+
+    def __init__(self, pyxis_api, to_rebuild=None):
+        """
+        :param PyxisAPI pyxis_api: PyxisAPI instance used to describe the
+            image groups.
+        :param list to_rebuild: rebuild lists to deduplicate in-place. More
+            lists can be added later using the `add` method.
+        """
+        self.pyxis_api = pyxis_api
+        self.to_rebuild = to_rebuild if to_rebuild is not None else []
+        # NVR of image to its image group.
+        self._nvr_to_image_group = {}
+        # NVR of image to set of (image_id, parent_id) coordinates of the
+        # image in the `to_rebuild` list.
+        self._nvr_to_coordinates = {}
+        # NVR of image to the last coordinates of that NVR and the image at
+        # these coordinates.
+        self._nvr_to_image = {}
+        # Image group to list of NVRs in that image group sorted ascending.
+        self._image_group_to_nvrs = {}
+        # Image group to dict mapping the coordinates of latest released
+        # images in that image group to their NVRs.
+        self._image_group_to_latest_released = {}
+        # NVRs of images indexed at every coordinates of the `to_rebuild` list.
+        self._indexed_nvrs = []
+        # Image groups changed since the last deduplication, the dict is used
+        # as an ordered set.
+        self._changed_image_groups = {}
+
+        for image_id in range(len(self.to_rebuild)):
+            self._indexed_nvrs.append([])
+            self._index(image_id)
+
+    def add(self, rebuild_list):
+        """
+        Adds the rebuild list to the lists to deduplicate.
+
+        :param list rebuild_list: list in the [child_image,
+            parent_of_child_image, parent_of_parent, ...] format.
+        """
+        self.to_rebuild.append(rebuild_list)
+        self._indexed_nvrs.append([])
+        self._index(len(self.to_rebuild) - 1)
+
+    def __len__(self):
+        return len(self.to_rebuild)
+
+    def _index(self, image_id, start=0):
+        """
+        Adds the images from the `to_rebuild[image_id]` list starting at
+        the `start` index to the temporary dicts.
+        """
+        indexed_nvrs = self._indexed_nvrs[image_id]
+        for parent_id, image in enumerate(self.to_rebuild[image_id][start:], start=start):
+            nvr = image.nvr
+            coordinates = (image_id, parent_id)
+            image_group = self._nvr_to_image_group.get(nvr)
+            if image_group is None:
+                image_group = str(self.pyxis_api.describe_image_group(image))
+                self._nvr_to_image_group[nvr] = image_group
+
+            if nvr not in self._nvr_to_coordinates:
+                self._nvr_to_coordinates[nvr] = set()
+                nvrs = self._image_group_to_nvrs.setdefault(image_group, [])
+                bisect.insort(nvrs, nvr, key=nvr_sort_key)
+            self._nvr_to_coordinates[nvr].add(coordinates)
+
+            last = self._nvr_to_image.get(nvr)
+            if last is None or coordinates > last[0]:
+                self._nvr_to_image[nvr] = (coordinates, image)
+
+            if image.get("latest_released"):
+                latest_released = self._image_group_to_latest_released.setdefault(image_group, {})
+                latest_released[coordinates] = nvr
+
+            indexed_nvrs.append(nvr)
+            self._changed_image_groups[image_group] = None
+
+    def _unindex(self, image_id, start, outdated_nvrs):
+        """
+        Removes the images indexed for the `to_rebuild[image_id]` list
+        starting at the `start` index from the temporary dicts.
+
+        The NVRs which have been removed from their last coordinates are
+        added to `outdated_nvrs`, so their image can be updated.
+        """
+        indexed_nvrs = self._indexed_nvrs[image_id]
+        for parent_id, nvr in enumerate(indexed_nvrs[start:], start=start):
+            self._remove_coordinates(nvr, (image_id, parent_id), outdated_nvrs)
+            self._changed_image_groups[self._nvr_to_image_group[nvr]] = None
+        del indexed_nvrs[start:]
+
+    def _remove_coordinates(self, nvr, coordinates, outdated_nvrs):
+        image_group = self._nvr_to_image_group[nvr]
+        coordinates_set = self._nvr_to_coordinates[nvr]
+        coordinates_set.discard(coordinates)
+        self._image_group_to_latest_released.get(image_group, {}).pop(coordinates, None)
+
+        if not coordinates_set:
+            del self._nvr_to_coordinates[nvr]
+            del self._nvr_to_image[nvr]
+            self._image_group_to_nvrs[image_group].remove(nvr)
+            outdated_nvrs.discard(nvr)
+        elif self._nvr_to_image[nvr][0] == coordinates:
+            outdated_nvrs.add(nvr)
+
+    def _update_images(self, nvrs):
+        """Updates the images of `nvrs` to the images at their last coordinates."""
+        for nvr in nvrs:
+            image_id, parent_id = max(self._nvr_to_coordinates[nvr])
+            self._nvr_to_image[nvr] = (
+                (image_id, parent_id),
+                self.to_rebuild[image_id][parent_id],
+            )
+
+    def _get_first_coordinates(self, image_group):
+        return min(
+            min(self._nvr_to_coordinates[nvr]) for nvr in self._image_group_to_nvrs[image_group]
+        )
+
+    def _get_image(self, nvr):
+        return self._nvr_to_image[nvr][1]
+
+    def _copy_content_sets(self, image_group):
+        """
+        There might be container image NVRs which are not released yet,
+        but some released image is already built on top of them.
+        The issue is that such unreleased container image won't be in
+        its containerRepository and therefore won't have proper
+        content_sets set.
+        In this case, we copy the content_sets from the released image.
+        This might bring issue in case the content_sets changed
+        dramatically between released and unreleased release of such
+        image, but it's still the best guess we can do.
+        This is also used only as fallback in case "content_sets.yml"
+        does not exists in the dist-git repo, which should be rare
+        situation.
+        """
+        latest_content_sets = []
+        for nvr in self._image_group_to_nvrs[image_group]:
+            image = self._get_image(nvr)
+            if not image.get("content_sets") or "content_sets_source" not in image:
+                image["content_sets"] = latest_content_sets
+            elif image["content_sets_source"] == "child_image":
+                if latest_content_sets:
+                    image["content_sets"] = latest_content_sets
+            else:
+                latest_content_sets = image["content_sets"]
+
+    def _get_nvrs_to_replace(self, image_group):
+        """
+        Returns the latest released NVR of the `image_group` and the list of
+        NVRs to replace with it.
+
+        :rtype: tuple
+        """
+        # The NVRs sorted descending.
+        nvrs = self._image_group_to_nvrs[image_group][::-1]
+        # We want to replace NVRs which are lower than the latest released
+        # NVR with latest released NVR. If there are some higher NVRs, we
+        # want to keep them, because we don't want to rebuild the image
+        # against older NVR than the one it is currently built against.
+        latest_released = self._image_group_to_latest_released.get(image_group)
+        if latest_released:
+            latest_released_nvr = latest_released[max(latest_released)]
+        else:
+            latest_released_nvr = nvrs[0]
+
+        # The latest_released_nvr_index points to the latest released NVR
+        # in the `nvrs` list. Because `nvrs` list is desc sorted, every NVR
+        # with higher index is lower and therefore we need to replace it.
+        if not conf.container_released_dependencies_only:
+            latest_released_nvr_index = nvrs.index(latest_released_nvr)
+        else:
+            # In case we want to use only released versions of images,
+            # replace all the images with the latest released one.
+            latest_released_nvr_index = -1
+        return latest_released_nvr, nvrs[latest_released_nvr_index + 1 :]
+
+    def _handle_parent_change(self, image_groups):
+        """
+        Finds out if update to latest image changes also the parent images.
+
+        For example, foo-1-1 can be built against x-1-1, but foo-1-2 can
+        be built against y-1-1. If we simply replace "foo-1-1" by "foo-1-2"
+        while keeping the original parent image, the "foo-1-2" will be built
+        against x-1-1 instead of y-1-1. This would be wrong.
+
+        To fix that, we therefore find out that the parent image changed in
+        the latest release of foo-1-2 and we replace also the parent images
+        according to latest release foo-1-2.
+        """
+        # The image_id of changed rebuild lists mapped to the first changed
+        # parent_id. The temporary dicts are updated once all the image groups
+        # are handled.
+        changed = {}
+        for image_group in image_groups:
+            latest_released_nvr, nvrs_to_replace = self._get_nvrs_to_replace(image_group)
+            # Find out the name of parent image of latest release image.
+            latest_image = self._get_image(latest_released_nvr)
+            if not latest_image.get("parent"):
+                continue
+            latest_parent_nvr_dict = koji.parse_NVR(latest_image["parent"].nvr)
+            latest_parent_name = latest_parent_nvr_dict["name"]
+            latest_parent_version = latest_parent_nvr_dict["version"]
+
+            # Go through the older images and in case the parent image differs,
+            # update its parents according to latest image parents.
+            for nvr in nvrs_to_replace:
+                image = self._get_image(nvr)
+                if not image.get("parent"):
+                    continue
+                parent_nvr_dict = koji.parse_NVR(image["parent"].nvr)
+                if (parent_nvr_dict["name"], parent_nvr_dict["version"]) != (
+                    latest_parent_name,
+                    latest_parent_version,
+                ):
+                    latest_image_id, latest_parent_id = min(
+                        self._nvr_to_coordinates[latest_released_nvr]
+                    )
+                    for image_id, parent_id in sorted(self._nvr_to_coordinates[nvr]):
+                        self.to_rebuild[image_id][parent_id:] = self.to_rebuild[latest_image_id][
+                            latest_parent_id:
+                        ]
+                        changed[image_id] = min(changed.get(image_id, parent_id), parent_id)
+
+        outdated_nvrs = set()
+        for image_id, parent_id in changed.items():
+            self._unindex(image_id, parent_id, outdated_nvrs)
+        for image_id, parent_id in changed.items():
+            self._index(image_id, parent_id)
+        self._update_images(outdated_nvrs)
+
+    def _update_to_latest(self, image_groups):
+        """
+        Finds out old releases of images and updates them to latest
+        released NVR.
+        """
+        for image_group in image_groups:
+            latest_released_nvr, nvrs_to_replace = self._get_nvrs_to_replace(image_group)
+            latest_image = self._get_image(latest_released_nvr)
+            for nvr in nvrs_to_replace:
+                coordinates_list = sorted(self._nvr_to_coordinates[nvr])
+                for image_id, parent_id in coordinates_list:
+                    images = self.to_rebuild[image_id]
+                    # At first replace the image in to_rebuild based
+                    # on the coordinates from temp dict.
+                    images[parent_id] = latest_image
+
+                    # And in case this image is not the the leaf image, also replace
+                    # the ["parent"] record for the child image to point to the image
+                    # with highest NVR.
+                    if parent_id != 0:
+                        images[parent_id - 1]["parent"] = latest_image
+
+                if nvr == latest_released_nvr:
+                    continue
+                # Move the coordinates of replaced images to the latest released NVR.
+                for coordinates in coordinates_list:
+                    self._remove_coordinates(nvr, coordinates, set())
+                    self._nvr_to_coordinates[latest_released_nvr].add(coordinates)
+                    if coordinates > self._nvr_to_image[latest_released_nvr][0]:
+                        self._nvr_to_image[latest_released_nvr] = (coordinates, latest_image)
+                    if latest_image.get("latest_released"):
+                        self._image_group_to_latest_released[image_group][
+                            coordinates
+                        ] = latest_released_nvr
+                    self._indexed_nvrs[coordinates[0]][coordinates[1]] = latest_released_nvr
+
+    def deduplicate(self):
+        """
+        Deduplicates the images in the rebuild lists in-place.
+
+        :rtype: list
+        :return: the deduplicated rebuild lists.
+        """
+        # We need to deduplicate images in two phases, "handle_parent_change"
+        # and "update_to_latest". The "update_to_latest" phase also handles
+        # the image groups changed in the "handle_parent_change" phase.
+        if conf.container_released_dependencies_only:
+            # All the images are replaced by the latest released ones in this
+            # case, which changes the ["parent"] of the images shared with
+            # the image groups which did not change, so handle all of them.
+            self._changed_image_groups = dict.fromkeys(self._image_group_to_nvrs)
+        for phase in ["handle_parent_change", "update_to_latest"]:
+            # The content sets are copied in all the image groups, not only
+            # in the changed ones. The images without their own content sets
+            # get them from the lower NVRs currently in their image group, so
+            # they are copied again once these NVRs have been replaced.
+            for image_group, nvrs in self._image_group_to_nvrs.items():
+                if nvrs:
+                    self._copy_content_sets(image_group)
+            # Handle the image groups in the order of their first occurrence
+            # in the `to_rebuild` list.
+            image_groups = sorted(
+                (
+                    image_group
+                    for image_group in self._changed_image_groups
+                    if self._image_group_to_nvrs[image_group]
+                ),
+                key=self._get_first_coordinates,
+            )
+            if phase == "handle_parent_change":
+                # Keep the image groups marked as changed, so they are handled
+                # also in the "update_to_latest" phase together with the
+                # image groups changed by this phase.
+                self._handle_parent_change(image_groups)
+            else:
+                self._changed_image_groups = {}
+                self._update_to_latest(image_groups)
+
+        return self.to_rebuild
+
+
+class RepositoryChunks(object):
+    """
+    Splits the repositories queried by
+    ``PyxisAPI._find_images_in_repository_chunks`` into chunks and collects
+    the images found in them.
+
+    The chunk size starts at PYXIS_REPOSITORY_CHUNK_SIZE. It doubles, up to
+    PYXIS_REPOSITORY_MAX_CHUNK_SIZE, when a chunk is queried faster than
+    PYXIS_REPOSITORY_CHUNK_FAST_TIME. When the query of a chunk times out,
+    the chunk is split in half and the halves are queried instead.
+
+    The chunks are (index of the first repository, repository names) tuples,
+    the index is used to return the images in the order of the repositories.
+    """
+
+    def __init__(self, repos):
+        """
+        :param dict repos: Dict with repository name as key and
+            ContainerRepository as value.
+        """
+        self.names = list(repos)
+        self.max_chunk_size = max(1, conf.pyxis_repository_max_chunk_size)
+        self.chunk_size = min(max(1, conf.pyxis_repository_chunk_size), self.max_chunk_size)
+        self._split_chunks = []
+        self._next_index = 0
+        self._results = {}
+
+    def next_chunk(self):
+        """
+        Returns the next chunk to query, or None when all the chunks are
+        being queried or have been queried already.
+
+        :rtype: tuple or None
+        """
+        if self._split_chunks:
+            return self._split_chunks.pop()
+        if self._next_index >= len(self.names):
+            return None
+        index = self._next_index
+        chunk = self.names[index : index + self.chunk_size]
+        self._next_index += len(chunk)
+        return index, chunk
+
+    def add_images(self, chunk, images, duration):
+        """
+        Stores the `images` found in the `chunk` and adapts the chunk size
+        to the `duration` of its query.
+
+        :param tuple chunk: the queried chunk.
+        :param list images: images found in the chunk.
+        :param float duration: duration of the query in seconds.
+        """
+        index, names = chunk
+        self._results[index] = images or []
+        if duration < conf.pyxis_repository_chunk_fast_time:
+            self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+
+    def split(self, chunk):
+        """
+        Splits the `chunk` whose query timed out in half, so the halves are
+        queried instead.
+
+        :param tuple chunk: the chunk whose query timed out.
+        :return: False when the chunk has a single repository and cannot be
+            split, otherwise True.
+        :rtype: bool
+        """
+        index, names = chunk
+        if len(names) == 1:
+            return False
+        half = len(names) // 2
+        log.info("Query for %d repositories timed out, splitting it in half.", len(names))
+        self.chunk_size = max(1, min(self.chunk_size, half))
+        # The first half is popped first
+        self._split_chunks.append((index + half, names[half:]))
+        self._split_chunks.append((index, names[:half]))
+        return True
+
+    def images(self):
+        """
+        Returns the images found in all the chunks, in the order of the
+        repositories.
+
+        :rtype: list
+        """
+        return [image for index in sorted(self._results) for image in self._results[index]]
+
+
 class PyxisAPI(object):
     """Interface to query Pyxis"""
 
@@ -472,6 +1036,66 @@ class PyxisAPI(object):
         """
         self.server_url = server_url
         self.pyxis = PyxisGQL(url=server_url, cert=(conf.pyxis_certificate, conf.pyxis_private_key))
+        # NVRs with the parent already recorded in the image lineage
+        self._recorded_lineage = set()
+
+    def _get_recorded_parent(self, nvr):
+        """
+        Returns the parent of the image `nvr` recorded in the image lineage.
+
+        :param str nvr: image NVR.
+        :return: tuple with True and the parent NVR (None for base images)
+            when the parent is recorded, otherwise (False, None).
+        :rtype: tuple
+        """
+        if not conf.persist_image_lineage:
+            return False, None
+        try:
+            known, parent_nvr = ImageLineage.get_parent(nvr)
+        except SQLAlchemyError as e:
+            log.warning("Cannot query the image lineage of %s: %s", nvr, e)
+            return False, None
+        if known:
+            self._recorded_lineage.add(nvr)
+        return known, parent_nvr
+
+    def _record_parent(self, nvr, parent_nvr):
+        """
+        Records the parent of the image `nvr` in the image lineage.
+
+        :param str nvr: image NVR.
+        :param str parent_nvr: parent image NVR, None for base images.
+        """
+        if not conf.persist_image_lineage or not nvr or nvr in self._recorded_lineage:
+            return
+        try:
+            ImageLineage.record(nvr, parent_nvr)
+        except SQLAlchemyError as e:
+            log.warning("Cannot record the image lineage of %s: %s", nvr, e)
+            return
+        self._recorded_lineage.add(nvr)
+
+    def get_recorded_ancestors(self, nvrs):
+        """
+        Returns the ancestors of the images `nvrs` recorded in the image
+        lineage.
+
+        :param list nvrs: image NVRs.
+        :return: dict with the image NVR as a key and the list of its
+            ancestor NVRs as a value, see `ImageLineage.get_ancestors`.
+        :rtype: dict
+        """
+        if not conf.persist_image_lineage:
+            return {}
+        try:
+            ancestors = ImageLineage.get_ancestors(nvrs)
+        except SQLAlchemyError as e:
+            log.warning("Cannot query the image lineage of %s: %s", nvrs, e)
+            return {}
+        for nvr, parents in ancestors.items():
+            self._recorded_lineage.add(nvr)
+            self._recorded_lineage.update(parent for parent in parents if parent)
+        return ancestors
 
     def _dicts_to_images(self, image_dicts):
         """Convert image dictionaries to list of ContainerImage"""
@@ -536,17 +1160,31 @@ class PyxisAPI(object):
         :return: Dict with repository name as key and ContainerRepository as
             value.
         """
-        repositories = self.pyxis.find_repositories(
-            published=published, release_categories=release_categories, names=names
-        )
+        catalog = get_repository_catalog(self.pyxis.url, self.pyxis.cert)
+        repositories = None
+        if catalog:
+            repositories = catalog.find_repositories(
+                published=published, release_categories=release_categories, names=names
+            )
+        if repositories is None:
+            repositories = self.pyxis.find_repositories(
+                published=published, release_categories=release_categories, names=names
+            )
 
         # If the query is for published images, add configurable repos for
         # unpublished images(like EUS) too because they shouldn't be ignored
         if published is True and conf.unpublished_exceptions:
-            unpublished_repositories = self.pyxis.find_repositories_by_registry_paths(
-                conf.unpublished_exceptions
-            )
-            repositories.extend(unpublished_repositories)
+            unpublished_repositories = None
+            if catalog:
+                unpublished_repositories = catalog.find_repositories_by_registry_paths(
+                    conf.unpublished_exceptions
+                )
+            if unpublished_repositories is None:
+                unpublished_repositories = self.pyxis.find_repositories_by_registry_paths(
+                    conf.unpublished_exceptions
+                )
+            # The repositories may be shared with the cache, do not extend them
+            repositories = list(repositories) + list(unpublished_repositories)
 
         repos = []
         for repo_data in repositories:
@@ -583,36 +1221,27 @@ class PyxisAPI(object):
         :rtype: list
         :return: List of ContainerImage instances without the filtered images.
         """
+        input_rpms = parse_rpm_nvrs(rpm_name_to_nvrs)
         ret = []
         for image in images:
-            rpms = image.get_rpms()
-            if rpms is None:
+            image_rpms = image.get_parsed_rpms(input_rpms)
+            if image_rpms is None:
+                ret.append(image)
+                continue
+            # compare_parsed_rpms return values:
+            #   - image RPM newer than input RPM: 1
+            #   - same RPMs: 0
+            #   - image RPM older: -1
+            # We want to rebuild only images with RPM NVR lower than
+            # input RPM NVR, therefore we check for -1.
+            if any(
+                compare_parsed_rpms(image_rpm, input_rpm) == -1
+                for name, parsed_image_rpms in image_rpms.items()
+                for image_rpm in parsed_image_rpms
+                for input_rpm in input_rpms[name]
+            ):
                 ret.append(image)
-            image_included = False
-            for rpm in rpms or []:
-                image_rpm_nvra = kobo.rpmlib.parse_nvra(rpm["nvra"])
-                for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), []):
-                    input_rpm_nvr = kobo.rpmlib.parse_nvr(rpm_nvr)
-                    # compare_nvr return values:
-                    #   - nvr1 newer than nvr2: 1
-                    #   - same nvrs: 0
-                    #   - nvr1 older: -1
-                    # We want to rebuild only images with RPM NVR lower than
-                    # input RPM NVR, therefore we check for -1.
-                    if (
-                        kobo.rpmlib.compare_nvr(image_rpm_nvra, input_rpm_nvr, ignore_epoch=True)
-                        == -1
-                    ):
-                        ret.append(image)
-                        image_included = True
-                        break
-                if image_included:
-                    break
             else:
-                # Oh-no, the mighty for/else block!
-                # The else clause executes after the loop completes normally.
-                # This means that the loop did not encounter a break statement.
-                # In our case, this means that we filtered out the image.
                 log.info(
                     "Will not rebuild %s, because it does not contain "
                     "older version of any input package: %r"
@@ -634,22 +1263,22 @@ class PyxisAPI(object):
         :rtype: list
         :return: List of ContainerImage instances without the filtered images.
         """
+        input_rpms = parse_rpm_nvrs(rpm_name_to_nvrs)
         ret = []
         for image in images:
-            rpms = image.get_rpms()
-            if rpms is None:
+            image_rpms = image.get_parsed_rpms(input_rpms)
+            if image_rpms is None:
                 ret.append(image)
-            image_included = False
+                continue
             # Include the image if the RPM from the advisory is modular, and the RPM of the same
             # name in the image is also modular. Also, include the image if the opposite is true.
-            for rpm in rpms or []:
-                for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), []):
-                    if is_pkg_modular(rpm_nvr) == is_pkg_modular(rpm["nvra"]):
-                        ret.append(image)
-                        image_included = True
-                        break
-                if image_included:
-                    break
+            if any(
+                image_rpm[1] == input_rpm[1]
+                for name, parsed_image_rpms in image_rpms.items()
+                for image_rpm in parsed_image_rpms
+                for input_rpm in input_rpms[name]
+            ):
+                ret.append(image)
             else:
                 log.info(
                     "Filtered out %s because there is a modularity mismatch between the RPMs "
@@ -689,7 +1318,13 @@ class PyxisAPI(object):
 
     @retry(wait_on=requests.exceptions.ConnectionError, logger=log)
     def find_images_with_included_rpms(
-        self, content_sets, rpm_nvrs, repositories, published=True, include_rpm_manifest=True
+        self,
+        content_sets,
+        rpm_nvrs,
+        repositories,
+        published=True,
+        include_rpm_manifest=True,
+        pyxis_api_instance=None,
     ):
         """
         Query Pyxis and find the containerImages in the given containerRepositories.
@@ -707,11 +1342,245 @@ class PyxisAPI(object):
         :param bool published: whether to limit queries to published
             repositories
         :param bool include_rpm_manifest: whether to include the RPMs in the result.
+        :param PyxisGQL pyxis_api_instance: an instance of PyxisGQL
+        """
+        if pyxis_api_instance is None:
+            pyxis_api_instance = self.pyxis
+
+        auto_rebuild_tags = self._get_auto_rebuild_tags(repositories)
+        rpm_name_to_nvrs = self._get_rpm_name_to_nvrs(rpm_nvrs)
+
+        images = self._find_indexed_images_with_included_rpms(
+            rpm_name_to_nvrs,
+            content_sets,
+            repositories,
+            published,
+            auto_rebuild_tags,
+            pyxis_api_instance,
+        )
+        if images is None:
+            images = pyxis_api_instance.find_images_by_installed_rpms(
+                rpm_name_to_nvrs, content_sets, repositories, published, auto_rebuild_tags
+            )
+        if not images:
+            return []
+
+        return self._filter_images_with_included_rpms(
+            images, rpm_name_to_nvrs, repositories, content_sets
+        )
+
+    def _find_rpm_index_candidates(
+        self, rpm_names, content_sets, repositories, published, tags, pyxis_api_instance
+    ):
+        """
+        Looks up the candidate images with the RPMs in the RPM image index.
+
+        :param list rpm_names: List of rpm names
+        :param list content_sets: List of content sets
+        :param list repositories: List of repository paths
+        :param bool published: The published attribution of image
+        :param list tags: List of image tags
+        :param PyxisGQL pyxis_api_instance: an instance of PyxisGQL
+        :return: sorted list of candidate image NVRs, or None when
+            RPM_INDEX_FILE is not set or the index is outdated and Pyxis must
+            be queried instead.
+        :rtype: list or None
+        """
+        rpm_index = get_rpm_index(pyxis_api_instance.url, pyxis_api_instance.cert)
+        if not rpm_index:
+            return None
+        candidate_nvrs = rpm_index.find_image_nvrs(
+            rpm_names, content_sets, repositories, published, tags
+        )
+        if candidate_nvrs is None:
+            return None
+        return sorted(candidate_nvrs)
+
+    def _find_indexed_images_with_included_rpms(
+        self, rpm_names, content_sets, repositories, published, tags, pyxis_api_instance
+    ):
+        """
+        Finds the images with the RPMs in the RPM image index and confirms
+        them against Pyxis, see `_confirm_images_with_included_rpms`.
+
+        The arguments are the same as for `_find_rpm_index_candidates`.
+
+        :return: image data, or None when the index can't be used and the
+            images must be found by `PyxisGQL.find_images_by_installed_rpms`.
+        :rtype: list of dict or None
+        """
+        candidate_nvrs = self._find_rpm_index_candidates(
+            rpm_names, content_sets, repositories, published, tags, pyxis_api_instance
+        )
+        if candidate_nvrs is None:
+            return None
+        return self._confirm_images_with_included_rpms(
+            candidate_nvrs,
+            rpm_names,
+            content_sets,
+            repositories,
+            published,
+            tags,
+            pyxis_api_instance,
+        )
+
+    def _confirm_images_with_included_rpms(
+        self,
+        nvrs,
+        rpm_names,
+        content_sets,
+        repositories,
+        published,
+        tags,
+        pyxis_api_instance,
+    ):
+        """
+        Queries Pyxis for the current data of the candidate images found in
+        the RPM image index and keeps the images matching the same criteria
+        as `PyxisGQL.find_images_by_installed_rpms`.
+
+        :param list nvrs: candidate image NVRs.
+        :param list rpm_names: List of rpm names
+        :param list content_sets: List of content sets
+        :param list repositories: List of repository paths
+        :param bool published: The published attribution of image
+        :param list tags: List of image tags
+        :param PyxisGQL pyxis_api_instance: an instance of PyxisGQL
+        :rtype: list of dict
+        """
+        chunk_size = conf.rpm_index_confirm_chunk_size
+        images = []
+        for i in range(0, len(nvrs), chunk_size):
+            images.extend(
+                pyxis_api_instance.find_images_by_nvrs(
+                    nvrs[i : i + chunk_size], IMAGE_PROJECTION_FULL
+                )
+            )
+
+        def _repo_matches(repo):
+            if isinstance(published, bool) and repo["published"] != published:
+                return False
+            if repositories and repo["repository"] not in repositories:
+                return False
+            return not tags or any(tag["name"] in tags for tag in repo["tags"] or [])
+
+        return [
+            image
+            for image in images
+            if image["brew"]
+            and (not content_sets or not set(content_sets).isdisjoint(image["content_sets"] or []))
+            and any(_repo_matches(repo) for repo in image["repositories"] or [])
+            and any(
+                rpm["name"] in rpm_names
+                for rpm in image["edges"]["rpm_manifest"]["data"]["rpms"] or []
+            )
+        ]
+
+    def iter_images_with_included_rpms(self, content_sets, rpm_nvrs, repositories, published=True):
+        """
+        Streaming version of `find_images_with_included_rpms`, the images are
+        filtered and yielded page by page as the pages arrive from Pyxis.
+
+        The images rejected by the filters are dropped together with their
+        page. Only the images with the last NVR of a page are kept until the
+        next page, because other architectures of the same image can follow
+        there.
+
+        When the RPM image index is usable, the candidate images found in it
+        are confirmed against Pyxis in chunks of RPM_INDEX_CONFIRM_CHUNK_SIZE
+        NVRs instead, each chunk filtered and yielded as it arrives.
+
+        :param list content_sets: List of content_sets the image includes RPMs
+            from.
+        :param list rpm_nvrs: list of binary RPM NVRs to look for
+        :param dict repositories: List of repository names to look for.
+        :param bool published: whether to limit queries to published
+            repositories
+        :rtype: generator of ContainerImages
+        """
+        auto_rebuild_tags = self._get_auto_rebuild_tags(repositories)
+        rpm_name_to_nvrs = self._get_rpm_name_to_nvrs(rpm_nvrs)
+
+        candidate_nvrs = self._find_rpm_index_candidates(
+            rpm_name_to_nvrs, content_sets, repositories, published, auto_rebuild_tags, self.pyxis
+        )
+        if candidate_nvrs is not None:
+            chunk_size = conf.rpm_index_confirm_chunk_size
+            for i in range(0, len(candidate_nvrs), chunk_size):
+                # All the architectures of an image share its NVR, so they
+                # are confirmed in the same chunk.
+                image_dicts = self._confirm_images_with_included_rpms(
+                    candidate_nvrs[i : i + chunk_size],
+                    rpm_name_to_nvrs,
+                    content_sets,
+                    repositories,
+                    published,
+                    auto_rebuild_tags,
+                    self.pyxis,
+                )
+                if image_dicts:
+                    yield from self._filter_images_with_included_rpms(
+                        image_dicts, rpm_name_to_nvrs, repositories, content_sets
+                    )
+            return
+
+        pages = self.pyxis.iter_images_by_installed_rpms(
+            rpm_name_to_nvrs, content_sets, repositories, published, auto_rebuild_tags
+        )
+        for image_dicts in self._complete_nvr_pages(pages):
+            yield from self._filter_images_with_included_rpms(
+                image_dicts, rpm_name_to_nvrs, repositories, content_sets
+            )
+
+    @staticmethod
+    def _complete_nvr_pages(pages):
+        """
+        Regroups the pages of image data sorted by NVR, so all the
+        architectures of the same image NVR are in the same page.
+
+        :param Iterable pages: Lists of Pyxis image data sorted by NVR.
+        :rtype: generator of lists
+        """
+
+        def _get_nvr(image):
+            # Images built by Konflux do not have Brew metadata
+            return (image["brew"] or {}).get("build")
+
+        pending = []
+        for page in pages:
+            page = pending + page
+            last_nvr = _get_nvr(page[-1])
+            split = len(page) - 1
+            while split > 0 and _get_nvr(page[split - 1]) == last_nvr:
+                split -= 1
+            pending = page[split:]
+            if split:
+                yield page[:split]
+        if pending:
+            yield pending
+
+    @staticmethod
+    def _get_auto_rebuild_tags(repositories):
+        """
+        Returns the set of auto-rebuild tags of all the `repositories`.
+
+        :param dict repositories: Dict with repository name as key and
+            ContainerRepository as value.
+        :rtype: set
         """
         auto_rebuild_tags = set()
         for repo in repositories.values():
             auto_rebuild_tags |= set(repo["auto_rebuild_tags"])
+        return auto_rebuild_tags
 
+    @staticmethod
+    def _get_rpm_name_to_nvrs(rpm_nvrs):
+        """
+        Returns dict with binary RPM name as a key and list of NVRs as a value.
+
+        :param list rpm_nvrs: list of binary RPM NVRs.
+        :rtype: dict
+        """
         # Pyxis cannot compare NVRs, so just ask for all the container
         # images with any version/release of RPM we are interested in and
         # compare it on client side.
@@ -719,30 +1588,63 @@ class PyxisAPI(object):
         for rpm_nvr in rpm_nvrs:
             name = koji.parse_NVR(rpm_nvr)["name"]
             rpm_name_to_nvrs.setdefault(name, []).append(rpm_nvr)
+        return rpm_name_to_nvrs
 
-        images = self.pyxis.find_images_by_installed_rpms(
-            rpm_name_to_nvrs, content_sets, repositories, published, auto_rebuild_tags
-        )
-        if not images:
-            return []
+    @staticmethod
+    def _reshape_image_data(image, rpm_names=None):
+        """
+        Returns the Pyxis image data with the ``edges.rpm_manifest`` moved to
+        ``rpm_manifest`` to simulate the data structure returned from
+        LightBlue.
+
+        Only the top-level dict is copied, the nested data are shared with
+        `image`, so the data returned by Pyxis, which may be shared with the
+        cache, are not modified.
+
+        :param dict image: Pyxis image data.
+        :param set rpm_names: When set, only the RPMs with these names are
+            kept in the rpm_manifest.
+        :rtype: dict
+        """
+        data = {key: value for key, value in image.items() if key != "edges"}
+        if "edges" not in image:
+            # The image was queried with a projection without the RPMs
+            return data
+        rpm_manifest = image["edges"]["rpm_manifest"]["data"]
+        if rpm_names is not None:
+            rpm_manifest = {
+                "rpms": [rpm for rpm in rpm_manifest["rpms"] if rpm["name"] in rpm_names]
+            }
+        data["rpm_manifest"] = [rpm_manifest]
+        return data
 
+    def _filter_images_with_included_rpms(
+        self, image_dicts, rpm_name_to_nvrs, repositories, content_sets
+    ):
+        """
+        Converts the image data returned by `find_images_by_installed_rpms`
+        to ContainerImages and filters out those which should not be rebuilt.
+
+        The `image_dicts` are not modified, so they can be shared with the
+        cache.
+
+        :param list image_dicts: Pyxis image data.
+        :param dict rpm_name_to_nvrs: Dict with binary RPM name as a key and
+            list of NVRs as a value.
+        :param dict repositories: Dict with repository name as key and
+            ContainerRepository as value.
+        :param list content_sets: List of content_sets the image includes RPMs
+            from.
+        :rtype: list
+        :return: List of ContainerImage instances.
+        """
         # Skip images without Brew metadata. Images built and released by Konflux
         # lack Brew metadata. We don't support rebuilding such images.
-        images = [x for x in images if x["brew"]]
-
-        # Avoid manipulating the images directly, use a copy instead
-        image_dicts = copy.deepcopy(images)
-        del images
-
-        for image in image_dicts:
-            # modify Pyxis image data to simulate the data structure returned from LightBlue
-            rpms = [
-                rpm
-                for rpm in image["edges"]["rpm_manifest"]["data"]["rpms"]
-                if rpm["name"] in rpm_name_to_nvrs
-            ]
-            image["rpm_manifest"] = [{"rpms": rpms}]
-            del image["edges"]
+        image_dicts = [
+            self._reshape_image_data(x, rpm_names=rpm_name_to_nvrs)
+            for x in image_dicts
+            if x["brew"]
+        ]
 
         # convert the dicts to list of ContainerImage
         images = self._dicts_to_images(image_dicts)
@@ -820,26 +1722,46 @@ class PyxisAPI(object):
         :return: List of containerImages.
         :rtype: list of ContainerImages.
         """
+        images = self._query_images_by_nvrs(nvrs, include_rpm_manifest, pyxis_api_instance)
+        if not images:
+            return []
+
+        return self._filter_images_by_nvrs(images, published, content_sets, rpm_nvrs, rpm_names)
+
+    def _query_images_by_nvrs(self, nvrs, include_rpm_manifest=True, pyxis_api_instance=None):
+        """
+        Query Pyxis for the image data of `nvrs`.
+
+        The returned data are shared with the cache, they must not be
+        modified.
+
+        :param list nvrs: List of image NVRs.
+        :param bool include_rpm_manifest: When True, the rpm_manifest is
+            included in the image data.
+        :param PyxisGQL pyxis_api_instance: an instance of PyxisGQL
+        :rtype: list of dict
+        """
         if pyxis_api_instance is None:
             pyxis_api_instance = self.pyxis
 
+        projection = IMAGE_PROJECTION_FULL if include_rpm_manifest else IMAGE_PROJECTION_REPOS
         if len(nvrs) == 1:
-            images = pyxis_api_instance.find_images_by_nvr(
-                nvrs[0], include_rpms=include_rpm_manifest
-            )
-        else:
-            images = pyxis_api_instance.find_images_by_nvrs(nvrs, include_rpms=include_rpm_manifest)
-        if not images:
-            return []
+            return pyxis_api_instance.find_images_by_nvr(nvrs[0], projection)
+        return pyxis_api_instance.find_images_by_nvrs(nvrs, projection)
 
-        # Avoid manipulating the images directly, uses a copy instead.
-        image_dicts = copy.deepcopy(images)
-        del images
+    def _filter_images_by_nvrs(
+        self, image_dicts, published=True, content_sets=None, rpm_nvrs=None, rpm_names=None
+    ):
+        """
+        Converts the image data returned by Pyxis NVR queries to
+        ContainerImages and filters them as described in `get_images_by_nvrs`.
+
+        The `image_dicts` are not modified, so they can be shared with the
+        cache.
 
-        for image in image_dicts:
-            # modify Pyxis image data to simulate the data structure returned from LightBlue
-            image["rpm_manifest"] = [copy.deepcopy(image["edges"]["rpm_manifest"]["data"])]
-            del image["edges"]
+        :rtype: list of ContainerImages.
+        """
+        image_dicts = [self._reshape_image_data(image) for image in image_dicts]
 
         if content_sets is not None:
             # Filter out images that don't have any of the content sets
@@ -863,14 +1785,7 @@ class PyxisAPI(object):
             return not set(rpms).isdisjoint(set(rpm_names))
 
         if rpm_nvrs is not None:
-            # Pyxis cannot compare rpm NVRs, so just ask for all the container
-            # images with any version/release of RPM we are interested in and
-            # compare it on client side.
-            rpm_name_to_nvrs = {}
-            for rpm_nvr in rpm_nvrs:
-                name = koji.parse_NVR(rpm_nvr)["name"]
-                rpm_name_to_nvrs.setdefault(name, []).append(rpm_nvr)
-
+            rpm_name_to_nvrs = self._get_rpm_name_to_nvrs(rpm_nvrs)
             image_dicts = list(
                 filter(lambda x: _image_has_rpm(x, rpm_name_to_nvrs.keys()), image_dicts)
             )
@@ -907,15 +1822,16 @@ class PyxisAPI(object):
         images = self.pyxis.find_images_by_names(names)
         return self._dicts_to_images(images)
 
-    def find_images_by_nvr(self, nvr):
+    def find_images_by_nvr(self, nvr, projection=IMAGE_PROJECTION_FULL):
         """
         Query Pyxis to get images of NVR
 
         :param str nvr: image NVR
+        :param str projection: image projection profile, see IMAGE_PROJECTIONS
         :rtype: list of dict
         :return: list of images returned by Pyxis
         """
-        return self.pyxis.find_images_by_nvr(nvr)
+        return self.pyxis.find_images_by_nvr(nvr, projection)
 
     def find_parent_brew_build_nvr_from_child(self, child_image, pyxis_api_instance=None):
         """
@@ -931,17 +1847,48 @@ class PyxisAPI(object):
         if pyxis_api_instance is None:
             pyxis_api_instance = self.pyxis
 
-        parent_brew_build = child_image.get("parent_brew_build")
-        if parent_brew_build:
+        known, parent_brew_build = self._get_known_parent_nvr(child_image)
+        if known:
             return parent_brew_build
+
         # We need to resolve the image in here because "parent_image_builds" needs to be there
         # and it gets populated when the image gets resolved.
         child_image.resolve(pyxis_api_instance)
+        return self._get_resolved_parent_nvr(child_image)
+
+    def _get_known_parent_nvr(self, child_image):
+        """
+        Returns the parent brew build NVR of the image when it is known
+        without resolving the image, from its "parent_brew_build" field in
+        Pyxis or from the image lineage.
+
+        :param ContainerImage child_image: image to find the parent of.
+        :return: tuple with True and the parent NVR (None for base images)
+            when the parent is known, otherwise (False, None).
+        :rtype: tuple
+        """
+        parent_brew_build = child_image.get("parent_brew_build")
+        if parent_brew_build:
+            self._record_parent(child_image.nvr, parent_brew_build)
+            return True, parent_brew_build
+
+        return self._get_recorded_parent(child_image.nvr)
 
+    def _get_resolved_parent_nvr(self, child_image):
+        """
+        Returns the parent brew build NVR of the resolved image from its
+        "parent_image_builds" and records it in the image lineage.
+
+        :param ContainerImage child_image: resolved image to find the parent of.
+        :return: parent brew build NVR, None for base images.
+        :rtype: str
+        """
         # Some images have `parent_image_builds` but are built in a multi-stage way and don't have
         # `parent_build_id`, in this situation FM doesn't try to find the parent image and skip.
         if not child_image.get("parent_build_id"):
+            self._record_parent(child_image.nvr, None)
             return None
+        parent_brew_build = None
         # If the parent is not in `parent_brew_build` we can try to look for the parent in Brew,
         # using the field `parent_image_builds` (searching for the nvr), which should always be there.
         # In case parent_brew_build is None and child_image["parent_image_builds"] == {},
@@ -953,6 +1900,7 @@ class PyxisAPI(object):
                 if i["id"] == child_image["parent_build_id"]
             ][0]
 
+        self._record_parent(child_image.nvr, parent_brew_build)
         return parent_brew_build
 
     def find_parent_images_with_package(
@@ -1028,6 +1976,219 @@ class PyxisAPI(object):
             parent_image, rpm_name, images, pyxis_api_instance
         )
 
+    def find_parent_image_chains(self, images, rpm_names):
+        """
+        Breadth-first version of `find_parent_images_with_package` for all
+        the `images` and `rpm_names` at once.
+
+        The parent chains are walked one level at a time. At each level, the
+        parent images of all the chains are fetched with a single Pyxis
+        query, so the number of queries depends on the depth of the image
+        hierarchy instead of the number of images. The parent images are
+        resolved from the data of that query and, when
+        KOJI_MULTICALL_BATCHING is set, from Koji data fetched for the whole
+        level, so resolving them doesn't query Pyxis and Koji per image.
+
+        :param list images: List of ContainerImages to find the parents of.
+        :param list rpm_names: List of RPM names to look for.
+        :return: list with a dict for each image in `images`. The dict maps
+            each RPM name installed in the image to a list starting with the
+            image, followed by the chain of its parent images containing the
+            RPM, as returned by `find_parent_images_with_package`.
+        :rtype: list of dict
+        """
+        cert = (conf.pyxis_certificate, conf.pyxis_private_key)
+        rebuild_lists, walks = self._start_parent_walks(images, rpm_names)
+        all_walks = list(walks)
+
+        def _find_parent_nvr(child):
+            with pyxis_gql_client(self.server_url, cert) as pyxis_api_instance:
+                return self.find_parent_brew_build_nvr_from_child(child, pyxis_api_instance)
+
+        def _walk_to_parent(walk, parent_dicts, koji_data):
+            with pyxis_gql_client(self.server_url, cert) as pyxis_api_instance:
+                return self._walk_to_parent(
+                    walk, parent_dicts, koji_data, images, pyxis_api_instance
+                )
+
+        with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
+            while walks:
+                # The walks of different RPM names start from the same image,
+                # find the parent of each image only once.
+                children = {id(walk["child"]): walk["child"] for walk in walks}
+                parent_nvrs = executor.map(_find_parent_nvr, children.values())
+                walks = self._set_parent_nvrs(walks, dict(zip(children, parent_nvrs)))
+                if not walks:
+                    break
+
+                # Fetch the parents of all the walks at this level at once.
+                parent_nvrs = sorted({walk["parent_nvr"] for walk in walks})
+                parent_dicts = self._group_images_by_nvr(
+                    parent_nvrs, self._query_images_by_nvrs(parent_nvrs)
+                )
+                koji_data = self._get_parents_koji_data(parent_dicts)
+
+                continues = list(
+                    executor.map(
+                        lambda walk: _walk_to_parent(
+                            walk,
+                            parent_dicts[walk["parent_nvr"]],
+                            koji_data.get(walk["parent_nvr"]),
+                        ),
+                        walks,
+                    )
+                )
+                walks = [walk for walk, cont in zip(walks, continues) if cont]
+
+        self._finish_parent_walks(all_walks)
+        return rebuild_lists
+
+    @staticmethod
+    def _start_parent_walks(images, rpm_names):
+        """
+        Starts the walks of `find_parent_image_chains`, one walk for each
+        RPM name installed in each image.
+
+        :param list images: List of ContainerImages to find the parents of.
+        :param list rpm_names: List of RPM names to look for.
+        :return: tuple with the per binary RPM name rebuild lists of the
+            images, filled by the walks, and the list of walks.
+        :rtype: tuple
+        """
+        rebuild_lists = []
+        walks = []
+        for image in images:
+            rebuild_list = {}  # per binary rpm name rebuild list.
+            image_rpm_names = {rpm["name"] for rpm in image["rpm_manifest"][0]["rpms"]}
+            for rpm_name in rpm_names:
+                if rpm_name not in image_rpm_names:
+                    continue
+                rebuild_list[rpm_name] = []
+                walks.append(
+                    {
+                        "image": image,
+                        "rpm_name": rpm_name,
+                        "chain": rebuild_list[rpm_name],
+                        "child": image,
+                        "image_parent": None,
+                    }
+                )
+            rebuild_lists.append(rebuild_list)
+        return rebuild_lists, walks
+
+    @staticmethod
+    def _set_parent_nvrs(walks, parent_nvrs):
+        """
+        Sets the parent NVR of the current image of each walk.
+
+        :param list walks: walks of `find_parent_image_chains`.
+        :param dict parent_nvrs: the parent NVR of the current images, with
+            the id() of the image as a key.
+        :return: the walks which continue, because their image has a parent.
+        :rtype: list
+        """
+        for walk in walks:
+            walk["parent_nvr"] = parent_nvrs[id(walk["child"])]
+        return [walk for walk in walks if walk["parent_nvr"]]
+
+    @staticmethod
+    def _group_images_by_nvr(nvrs, image_dicts):
+        """
+        Groups the Pyxis image data by the image NVR.
+
+        :param list nvrs: the queried NVRs, the images not found in Pyxis
+            get an empty list.
+        :param list image_dicts: the image data returned by Pyxis.
+        :rtype: dict
+        """
+        grouped = {nvr: [] for nvr in nvrs}
+        for image_dict in image_dicts:
+            grouped.setdefault(image_dict["brew"]["build"], []).append(image_dict)
+        return grouped
+
+    @staticmethod
+    def _get_parents_koji_data(parent_dicts):
+        """
+        Fetches the Koji data of the parent images found in Pyxis at once
+        when KOJI_MULTICALL_BATCHING is set.
+
+        :param dict parent_dicts: image data grouped by `_group_images_by_nvr`.
+        :return: dict with the image NVR as a key and the additional data as
+            a value, empty when the images fetch their data themselves.
+        :rtype: dict
+        """
+        if not conf.koji_multicall_batching:
+            return {}
+        return ContainerImage.get_additional_data_from_koji_by_nvrs(
+            [nvr for nvr, image_dicts in parent_dicts.items() if image_dicts]
+        )
+
+    def _walk_to_parent(self, walk, parent_dicts, koji_data, images, pyxis_api_instance):
+        """
+        Moves the walk of `find_parent_image_chains` one level up.
+
+        :param dict walk: the walk.
+        :param list parent_dicts: Pyxis image data of the parent NVR.
+        :param dict koji_data: additional data of the parent from Koji, or
+            None when it is not fetched yet.
+        :param list images: the images the walks started from.
+        :param PyxisGQL pyxis_api_instance: an instance of PyxisGQL
+        :return: True if the walk continues.
+        :rtype: bool
+        """
+        chain = walk["chain"]
+        parent_image = self._filter_images_by_nvrs(
+            parent_dicts, published=None, rpm_names=[walk["rpm_name"]]
+        )
+        if parent_image:
+            children = chain if chain else [walk["child"]]
+            parent_image = parent_image[0]
+            parent_image.resolve(pyxis_api_instance, children, koji_data, parent_dicts)
+        else:
+            # Set the parent of the last image with the package, so we know
+            # against which image it has been built.
+            parent = self._filter_images_by_nvrs(parent_dicts, published=None)
+            if parent:
+                parent = parent[0]
+                parent.resolve(
+                    pyxis_api_instance, chain if chain else images, koji_data, parent_dicts
+                )
+            elif chain:
+                err = "Couldn't find parent image %s. Pyxis data is probably incomplete" % (
+                    walk["parent_nvr"]
+                )
+                log.error(err)
+                if not chain[-1]["error"]:
+                    chain[-1]["error"] = err
+
+            if not chain:
+                walk["image_parent"] = parent
+            else:
+                chain[-1]["parent"] = parent
+            return False
+
+        if chain:
+            chain[-1]["parent"] = parent_image
+        chain.append(parent_image)
+        walk["child"] = parent_image
+        return True
+
+    @staticmethod
+    def _finish_parent_walks(walks):
+        """
+        Sets the parent of the images the `walks` started from and inserts
+        the images at the start of their rebuild lists.
+
+        :param list walks: all the walks of `find_parent_image_chains`.
+        """
+        for walk in walks:
+            image = walk["image"]
+            if walk["chain"]:
+                image["parent"] = walk["chain"][0]
+            elif walk["image_parent"]:
+                image["parent"] = walk["image_parent"]
+            walk["chain"].insert(0, image)
+
     def find_images_with_packages_from_content_set(
         self,
         rpm_nvrs,
@@ -1069,23 +2230,237 @@ class PyxisAPI(object):
 
         if not repos:
             return []
-        if not leaf_container_images:
-            images = []
-            # Split the repos to small chunks to generate "small" queries
-            repos_iterator = iter(repos)
-            chunk_size = 20
-            for i in range(0, len(repos), chunk_size):
-                repos_chunk = {k: repos[k] for k in islice(repos_iterator, chunk_size)}
-                images_chunk = self.find_images_with_included_rpms(
-                    content_sets, rpm_nvrs, repos_chunk, published
+        if not leaf_container_images and published and conf.pyxis_stream_images:
+            # The images are filtered page by page as they arrive from Pyxis
+            # and the survivors are resolved while the next pages are being
+            # fetched. Unpublished images can't be streamed, because only the
+            # latest NVR of each name-version is kept.
+            images = (
+                image
+                for image in self._iter_images_in_repository_chunks(
+                    content_sets, rpm_nvrs, repos, published
                 )
-                if images_chunk:
-                    images.extend(images_chunk)
+                if not (filter_fnc and filter_fnc(image))
+            )
         else:
-            # The `leaf_container_images` can contain unpublished container image,
-            # therefore set `published` to None.
-            images = self.get_images_by_nvrs(leaf_container_images, None, content_sets, rpm_nvrs)
+            if not leaf_container_images:
+                images = self._find_images_in_repository_chunks(
+                    content_sets, rpm_nvrs, repos, published
+                )
+            else:
+                # The `leaf_container_images` can contain unpublished container image,
+                # therefore set `published` to None.
+                images = self.get_images_by_nvrs(
+                    leaf_container_images, None, content_sets, rpm_nvrs
+                )
+
+            images = self._filter_found_images(images, published, filter_fnc)
+
+        def _resolve_image(image_with_koji_data):
+            image, koji_data = image_with_koji_data
+            # We do not set "children" here in resolve_content_sets call, because
+            # published images should have the content_set set.
+            with pyxis_gql_client(
+                self.server_url, (conf.pyxis_certificate, conf.pyxis_private_key)
+            ) as pyxis_api_instance:
+                image.resolve(pyxis_api_instance, None, koji_data)
+            return self._mark_directly_affected(image)
+
+        def _resolve_batch(batch):
+            return [
+                executor.submit(_resolve_image, image_with_koji_data)
+                for image_with_koji_data in self._with_koji_data(batch)
+            ]
+
+        # Each batch is submitted as soon as its images are found, its Koji
+        # data is fetched in the pool while the next images are being found,
+        # and its images are resolved in the pool once the data arrives.
+        with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
+            batches = [
+                executor.submit(_resolve_batch, batch) for batch in self._iter_koji_batches(images)
+            ]
+            return [future.result() for batch in batches for future in batch.result()]
+
+    @staticmethod
+    def _iter_koji_batches(images):
+        """
+        Yields lists of the `images` whose additional data from Koji is
+        fetched at once by `_with_koji_data`. When KOJI_MULTICALL_BATCHING is
+        enabled, the lists have KOJI_MULTICALL_BATCH_SIZE images, otherwise
+        a single image.
+        """
+        images = iter(images)
+        if not conf.koji_multicall_batching:
+            for image in images:
+                yield [image]
+            return
+
+        while chunk := list(islice(images, conf.koji_multicall_batch_size)):
+            yield chunk
+
+    @staticmethod
+    def _with_koji_data(images):
+        """
+        Returns tuples with each of the `images` and its additional data
+        from Koji. When KOJI_MULTICALL_BATCHING is enabled, the data is
+        fetched at once for all the `images`, otherwise it is None and the
+        images fetch it themselves when resolved.
+        """
+        if not conf.koji_multicall_batching:
+            return [(image, None) for image in images]
+
+        koji_data = ContainerImage.get_additional_data_from_koji_by_nvrs(
+            [image.nvr for image in images]
+        )
+        return [(image, koji_data.get(image.nvr)) for image in images]
+
+    @classmethod
+    def _iter_with_koji_data(cls, images):
+        """
+        Yields tuples with each of the `images` and its additional data from
+        Koji, see `_with_koji_data`.
+        """
+        for batch in cls._iter_koji_batches(images):
+            yield from cls._with_koji_data(batch)
+
+    def _find_images_in_repository_chunks(self, content_sets, rpm_nvrs, repos, published):
+        """
+        Runs `find_images_with_included_rpms` on chunks of the `repos`,
+        at most PYXIS_REPOSITORY_CHUNK_CONCURRENCY chunks at a time.
+
+        The chunk size is adapted by `RepositoryChunks`. When the query of a
+        chunk times out, the chunk is split in half and the halves are
+        queried instead of retrying the same query. A single repository which
+        times out is queried again with the retries enabled.
+
+        :param list content_sets: List of content_sets the image includes RPMs
+            from.
+        :param list rpm_nvrs: list of binary RPM NVRs to look for
+        :param dict repos: Dict with repository name as key and
+            ContainerRepository as value.
+        :param bool published: whether to limit queries to published
+            repositories
+        :rtype: list
+        :return: List of ContainerImage instances, in the order of `repos`.
+        """
+        cert = (conf.pyxis_certificate, conf.pyxis_private_key)
+        chunks = RepositoryChunks(repos)
+        concurrency = max(1, conf.pyxis_repository_chunk_concurrency)
+
+        def _query_chunk(chunk, retry_timeouts):
+            repos_chunk = {name: repos[name] for name in chunk}
+            start = time.monotonic()
+            with pyxis_gql_client(self.server_url, cert) as pyxis_api_instance:
+                with timeout_retries(retry_timeouts):
+                    images = self.find_images_with_included_rpms(
+                        content_sets,
+                        rpm_nvrs,
+                        repos_chunk,
+                        published,
+                        pyxis_api_instance=pyxis_api_instance,
+                    )
+            return images, time.monotonic() - start
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {}
+            while True:
+                while len(futures) < concurrency and (chunk := chunks.next_chunk()):
+                    index, names = chunk
+                    futures[executor.submit(_query_chunk, names, len(names) == 1)] = chunk
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = futures.pop(future)
+                    try:
+                        images, duration = future.result()
+                    except PyxisGQLRequestTimeout:
+                        if not chunks.split(chunk):
+                            raise
+                        continue
+                    chunks.add_images(chunk, images, duration)
+
+        return chunks.images()
+
+    def _iter_images_in_repository_chunks(self, content_sets, rpm_nvrs, repos, published):
+        """
+        Streaming version of `_find_images_in_repository_chunks`, runs
+        `iter_images_with_included_rpms` on chunks of the `repos`, one chunk
+        after another, and yields the images as they arrive.
+
+        The chunk size is adapted the same way. When the query of a chunk
+        times out, the halves of the chunk skip the images already yielded
+        from it.
+
+        :param list content_sets: List of content_sets the image includes RPMs
+            from.
+        :param list rpm_nvrs: list of binary RPM NVRs to look for
+        :param dict repos: Dict with repository name as key and
+            ContainerRepository as value.
+        :param bool published: whether to limit queries to published
+            repositories
+        :rtype: generator of ContainerImages
+        """
+        names = list(repos)
+        max_chunk_size = max(1, conf.pyxis_repository_max_chunk_size)
+        chunk_size = min(max(1, conf.pyxis_repository_chunk_size), max_chunk_size)
+
+        # Chunks split after a timeout, with the NVRs yielded from them already.
+        split_chunks = []
+        next_index = 0
+        while split_chunks or next_index < len(names):
+            if split_chunks:
+                chunk, skipped_nvrs = split_chunks.pop()
+            else:
+                chunk, skipped_nvrs = names[next_index : next_index + chunk_size], set()
+                next_index += len(chunk)
 
+            images = self.iter_images_with_included_rpms(
+                content_sets, rpm_nvrs, {name: repos[name] for name in chunk}, published
+            )
+            yielded_nvrs = set(skipped_nvrs)
+            # Only the time spent in the queries counts, not the time the
+            # caller spends with the yielded images.
+            duration = 0
+            try:
+                while True:
+                    start = time.monotonic()
+                    with timeout_retries(len(chunk) == 1):
+                        image = next(images, None)
+                    duration += time.monotonic() - start
+                    if image is None:
+                        break
+                    if image.nvr in skipped_nvrs:
+                        continue
+                    yielded_nvrs.add(image.nvr)
+                    yield image
+            except PyxisGQLRequestTimeout:
+                if len(chunk) == 1:
+                    raise
+                half = len(chunk) // 2
+                log.info("Query for %d repositories timed out, splitting it in half.", len(chunk))
+                chunk_size = max(1, min(chunk_size, half))
+                # The first half is popped first
+                split_chunks.append((chunk[half:], yielded_nvrs))
+                split_chunks.append((chunk[:half], yielded_nvrs))
+                continue
+
+            if duration < conf.pyxis_repository_chunk_fast_time:
+                chunk_size = min(chunk_size * 2, max_chunk_size)
+
+    @staticmethod
+    def _filter_found_images(images, published, filter_fnc=None):
+        """
+        Filters the images found by `find_images_with_packages_from_content_set`.
+
+        :param list images: List of ContainerImage instances.
+        :param bool published: whether the images were queried from published
+            repositories only.
+        :param function filter_fnc: refer to
+            ``find_images_with_packages_from_content_set``.
+        :rtype: list
+        """
         # In case we query for unpublished images, we need to return just
         # the latest NVR for given name-version, otherwise images would
         # contain all the versions which ever containing the rpm_name.
@@ -1106,26 +2481,25 @@ class PyxisAPI(object):
         if filter_fnc:
             images = [image for image in images if not filter_fnc(image)]
 
-        def _resolve_image(image):
-            # We do not set "children" here in resolve_content_sets call, because
-            # published images should have the content_set set.
-            pyxis_api_instance = PyxisGQL(
-                url=self.server_url, cert=(conf.pyxis_certificate, conf.pyxis_private_key)
-            )
-            image.resolve(pyxis_api_instance, None)
-
-            # Mark as latest_released only images which are not Beta or Tech Preview.
-            # This is important, because "latest_released" is used in deduplication
-            # code to mark the image to which the other images with same name-version
-            # but lower release can be upgraded.
-            release_categories = image.get("release_categories", [])
-            if "Beta" not in release_categories and "Tech Preview" not in release_categories:
-                image["latest_released"] = True
-            image["directly_affected"] = True
-            return image
+        return images
 
-        with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
-            return list(executor.map(_resolve_image, images))
+    @staticmethod
+    def _mark_directly_affected(image):
+        """
+        Marks the resolved image found in Pyxis as directly affected.
+
+        :param ContainerImage image: the resolved image.
+        :rtype: ContainerImage
+        """
+        # Mark as latest_released only images which are not Beta or Tech Preview.
+        # This is important, because "latest_released" is used in deduplication
+        # code to mark the image to which the other images with same name-version
+        # but lower release can be upgraded.
+        release_categories = image.get("release_categories", [])
+        if "Beta" not in release_categories and "Tech Preview" not in release_categories:
+            image["latest_released"] = True
+        image["directly_affected"] = True
+        return image
 
     def _deduplicate_images_to_rebuild(self, to_rebuild):
         """
@@ -1146,146 +2520,11 @@ class PyxisAPI(object):
         occurrence in a list, because the NVR is higher than NVR of foo-1-2.
         The foo-2-2 will be kept unchanged in a list, because it is the
         single record for the foo image in version 2.
-        """
 
-        # We need to deduplicate images in two phases:
-        #
-        # 1) "handle_parent_change" - During this phase, we find out if update
-        #    to latest image changes also the parent images.
-        #    For example, foo-1-1 can be built against x-1-1, but foo-1-2 can
-        #    be built against y-1-1. If we simply replace "foo-1-1" by "foo-1-2"
-        #    while keeping the original parent image, the "foo-1-2" will be built
-        #    against x-1-1 instead of y-1-1. This would be wrong.
-        #
-        #    To fix that, we therefore find out that the parent image changed in
-        #    the latest release of foo-1-2 and we replace also the parent images
-        #    according to latest release foo-1-2.
-        #
-        # 2) "update_to_latest". During this phase, we simply find out old releases
-        #    of images in `to_rebuild` and update them to latest released NVR.
-        for phase in ["handle_parent_change", "update_to_latest"]:
-            # Temporary dict mapping the NVR of image to coordinates in the
-            # `to_rebuild` list. For example
-            # nvr_to_coordinates["nvr"] = [[0, 3], ...] means that the image with
-            # nvr "nvr" is 4th image in the to_rebuild[0] list, ...
-            nvr_to_coordinates = {}
-            # Temporary dict mapping the NV-repository_key to list of NVRs.
-            # The List of NVRs is always sorted descending.
-            image_group_to_nvrs = {}
-            # Temporary dict mapping the NVR to image.
-            nvr_to_image = {}
-            # Temporary dict mapping image_group to latest released NVR for that image_group.
-            image_group_to_latest_released_nvr = {}
-
-            # Constructs the temporary dicts as described above.
-            for image_id, images in enumerate(to_rebuild):
-                for parent_id, image in enumerate(images):
-                    image_group = str(self.describe_image_group(image))
-                    image_group_to_nvrs.setdefault(image_group, [])
-                    if image.nvr not in image_group_to_nvrs[image_group]:
-                        image_group_to_nvrs[image_group].append(image.nvr)
-
-                    nvr_to_coordinates.setdefault(image.nvr, []).append([image_id, parent_id])
-                    nvr_to_image[image.nvr] = image
-
-                    if image.get("latest_released"):
-                        image_group_to_latest_released_nvr[image_group] = image.nvr
-
-            # Sort the lists in image_group_to_nvrs dict.
-            for image_group in image_group_to_nvrs.keys():
-                image_group_to_nvrs[image_group] = sorted_by_nvr(
-                    image_group_to_nvrs[image_group], reverse=True
-                )
-
-                # There might be container image NVRs which are not released yet,
-                # but some released image is already built on top of them.
-                # The issue is that such unreleased container image won't be in
-                # its containerRepository and therefore won't have proper
-                # content_sets set.
-                # In this case, we copy the content_sets from the released image.
-                # This might bring issue in case the content_sets changed
-                # dramatically between released and unreleased release of such
-                # image, but it's still the best guess we can do.
-                # This is also used only as fallback in case "content_sets.yml"
-                # does not exists in the dist-git repo, which should be rare
-                # situation.
-                latest_content_sets = []
-                for nvr in reversed(image_group_to_nvrs[image_group]):
-                    image = nvr_to_image[nvr]
-                    if not image.get("content_sets") or "content_sets_source" not in image:
-                        image["content_sets"] = latest_content_sets
-                    elif image["content_sets_source"] == "child_image":
-                        if latest_content_sets:
-                            image["content_sets"] = latest_content_sets
-                    else:
-                        latest_content_sets = image["content_sets"]
-
-            # Iterate through list of NVs.
-            for image_group, nvrs in image_group_to_nvrs.items():
-                # We want to replace NVRs which are lower than the latest released
-                # NVR with latest released NVR. If there are some higher NVRs, we
-                # want to keep them, because we don't want to rebuild the image
-                # against older NVR than the one it is currently built against.
-                if image_group in image_group_to_latest_released_nvr:
-                    latest_released_nvr = image_group_to_latest_released_nvr[image_group]
-                else:
-                    latest_released_nvr = nvrs[0]
-
-                # The latest_released_nvr_index points to the latest released NVR
-                # in the `nvrs` list. Because `nvrs` list is desc sorted, every NVR
-                # with higher index is lower and therefore we need to replace it.
-                if not conf.container_released_dependencies_only:
-                    latest_released_nvr_index = nvrs.index(latest_released_nvr)
-                else:
-                    # In case we want to use only released versions of images,
-                    # replace all the images with the latest released one.
-                    latest_released_nvr_index = -1
-
-                if phase == "handle_parent_change":
-                    # Find out the name of parent image of latest release image.
-                    latest_image = nvr_to_image[latest_released_nvr]
-                    if not latest_image.get("parent"):
-                        continue
-                    latest_parent_nvr_dict = koji.parse_NVR(latest_image["parent"].nvr)
-                    latest_parent_name = latest_parent_nvr_dict["name"]
-                    latest_parent_version = latest_parent_nvr_dict["version"]
-
-                    # Go through the older images and in case the parent image differs,
-                    # update its parents according to latest image parents.
-                    for nvr in nvrs[latest_released_nvr_index + 1 :]:
-                        image = nvr_to_image[nvr]
-                        if not image.get("parent"):
-                            continue
-                        parent_nvr_dict = koji.parse_NVR(image["parent"].nvr)
-                        parent_name = parent_nvr_dict["name"]
-                        parent_version = parent_nvr_dict["version"]
-                        if (parent_name, parent_version) != (
-                            latest_parent_name,
-                            latest_parent_version,
-                        ):
-                            for image_id, parent_id in nvr_to_coordinates[nvr]:
-                                latest_image_id, latest_parent_id = nvr_to_coordinates[
-                                    latest_released_nvr
-                                ][0]
-                                to_rebuild[image_id][parent_id:] = to_rebuild[latest_image_id][
-                                    latest_parent_id:
-                                ]
-                elif phase == "update_to_latest":
-                    for nvr in nvrs[latest_released_nvr_index + 1 :]:
-                        for image_id, parent_id in nvr_to_coordinates[nvr]:
-                            # At first replace the image in to_rebuild based
-                            # on the coordinates from temp dict.
-                            to_rebuild[image_id][parent_id] = nvr_to_image[latest_released_nvr]
-
-                            # And in case this image is not the the leaf image, also replace
-                            # the ["parent"] record for the child image to point to the image
-                            # with highest NVR.
-                            if parent_id != 0:
-                                to_rebuild[image_id][parent_id - 1]["parent"] = nvr_to_image[
-                                    latest_released_nvr
-                                ]
-
-        return to_rebuild
+        Use ``ImagesToRebuildDeduplicator`` to deduplicate the list
+        repeatedly while it grows.
+        """
+        return ImagesToRebuildDeduplicator(self, to_rebuild).deduplicate()
 
     # Cache to avoid multiple calls. We want one call per nvr, not one per arch
     @region.cache_on_arguments(to_str=lambda image: image.nvr)
@@ -1295,7 +2534,8 @@ class PyxisAPI(object):
         """
         return ImageGroup(image, self)
 
-    def _images_to_rebuild_to_batches(self, to_rebuild, directly_affected_nvrs):
+    @staticmethod
+    def _images_to_rebuild_to_batches(to_rebuild, directly_affected_nvrs):
         """
         Creates batches with images as defined by `find_images_to_rebuild`
         output from the `to_rebuild` list in following format:
@@ -1305,46 +2545,58 @@ class PyxisAPI(object):
                 ...
             ]
 
+        The batches are the layers of the dependency graph of the images
+        given by their "parent" images, see `kahn_layers`. Every image is
+        in the batch right after the batch of its parent, so the parent is
+        always recorded before the image.
+
         :param list to_rebuild: the list of images to rebuild
         :param set directly_affected_nvrs: the set of NVRs that were detected as directly affected
             and that should have `directly_affected` value set.
         :return: a list of batches with each batch having a list of images
         :rtype: list
         """
-        # At first get the max length of list in to_rebuild list.
-        max_len = 0
-        for rebuild_list in to_rebuild:
-            max_len = max(len(rebuild_list), max_len)
-
-        # Now create the batches with images. We still might find duplicate
-        # images in to_rebuild lists in two cases:
-        #
-        # 1) A depends on X and also B depends on X. The X then would be
-        #    added to first batch twice. This is simple to fix by just
-        #    adding same image to batch once.
-        # 2) A depends on X and A is also standalone image to rebuild. In this
-        #    case, A would be in the second batch, because A must be built
-        #    before X, but it is also standalone image to be rebuilt, so it
-        #    would appear also in the first batch.
-        #    To fix this, we at first add images with the longest dependency
-        #    chains, so A will be added to second batch. Once we try to add
-        #    standalone version of A, we won't add it, because it already
-        #    exists in some batch.
-        #
-        # Both of these cases are handled by adding the image to `seen` set
-        # and checking if it exists there already before adding it again.
-        batches = [[] for i in range(max_len)]
-        seen = set()
+        # The same image can be in multiple to_rebuild lists, for example
+        # when A and B both depend on X, or when A depends on X and A is
+        # also a standalone image to rebuild. Keep just the first occurrence,
+        # looking at the images with the longest dependency chains first.
+        images = {}
         for image_rebuild_list in sorted(to_rebuild, key=lambda lst: len(lst), reverse=True):
-            for image, batch in zip(reversed(image_rebuild_list), batches):
+            for image in reversed(image_rebuild_list):
                 image_key = image.nvr
                 # If one of the parents is directly affected but not marked, mark it explicitly
                 if image_key in directly_affected_nvrs and not image.get("directly_affected"):
                     image["directly_affected"] = True
-                if image_key in seen:
-                    continue
-                seen.add(image_key)
-                batch.append(image)
+                images.setdefault(image_key, image)
+
+        def get_parent_nvr(nvr):
+            parent = images[nvr].get("parent")
+            return parent.nvr if parent else None
+
+        layers = kahn_layers(list(images), get_parent_nvr)
+        batches = [[images[nvr] for nvr in layer] for layer in layers]
+
+        layered = {nvr for layer in layers for nvr in layer}
+        unlayered = [image for nvr, image in images.items() if nvr not in layered]
+        if unlayered:
+            # The images which are not in any layer are the images in the
+            # dependency cycles and their descendants. Peel off the
+            # descendants, which are not the parent of any other of these
+            # images, to report just the cycles.
+            in_cycle = {image.nvr for image in unlayered}
+            while True:
+                parents = {get_parent_nvr(nvr) for nvr in in_cycle}
+                descendants = in_cycle - parents
+                if not descendants:
+                    break
+                in_cycle -= descendants
+            log.error(
+                "Images %s depend on each other, rebuilding them and %d images depending "
+                "on them in the last batch.",
+                ", ".join(sorted(in_cycle)),
+                len(unlayered) - len(in_cycle),
+            )
+            batches.append(unlayered)
         return batches
 
     def find_images_to_rebuild(
@@ -1398,76 +2650,121 @@ class PyxisAPI(object):
             repositories=repositories,
         )
 
-        # Remove any hotfix images from list of images
-        for img in images[:]:
-            if any(label["name"] == "com.redhat.hotfix" for label in img["parsed_data"]["labels"]):
-                images.remove(img)
-                log.debug("Excluding hotfix image: %s", img.nvr)
-
-        # Not skip images when rebuild images are requested explicitly
-        if skip_nvrs and not leaf_container_images:
-            images = [img for img in images if img["brew"]["build"] not in skip_nvrs]
+        images = self._exclude_images(images, skip_nvrs, leaf_container_images)
 
         rpm_names = [koji.parse_NVR(rpm_nvr)["name"] for rpm_nvr in rpm_nvrs]
 
+        if conf.batch_parent_images_lookup:
+            to_rebuild = ImagesToRebuildDeduplicator(
+                self,
+                [
+                    rebuild_list
+                    for result in self.find_parent_image_chains(images, rpm_names)
+                    for rebuild_list in result.values()
+                ],
+            )
+            return self._finalize_images_to_rebuild(to_rebuild, images, rpm_nvrs, content_sets)
+
         def _get_images_to_rebuild(image):
             """
             Find out parent images to rebuild, helper called from threadpool.
             """
-            pyxis_api_instance = PyxisGQL(
-                url=self.server_url, cert=(conf.pyxis_certificate, conf.pyxis_private_key)
-            )
-
-            rebuild_list = {}  # per binary rpm name rebuild list.
-            for rpm_name in rpm_names:
-                for rpm in image["rpm_manifest"][0]["rpms"]:
-                    if rpm["name"] == rpm_name:
-                        break
-                else:
-                    # This `rpm_name` is not in image.
-                    continue
+            with pyxis_gql_client(
+                self.server_url, (conf.pyxis_certificate, conf.pyxis_private_key)
+            ) as pyxis_api_instance:
+                rebuild_list = {}  # per binary rpm name rebuild list.
+                for rpm_name in rpm_names:
+                    for rpm in image["rpm_manifest"][0]["rpms"]:
+                        if rpm["name"] == rpm_name:
+                            break
+                    else:
+                        # This `rpm_name` is not in image.
+                        continue
 
-                rebuild_list[rpm_name] = self.find_parent_images_with_package(
-                    image, rpm_name, images=[], pyxis_api_instance=pyxis_api_instance
-                )
-                if rebuild_list[rpm_name]:
-                    image["parent"] = rebuild_list[rpm_name][0]
-                else:
-                    parent_brew_build = self.find_parent_brew_build_nvr_from_child(
-                        image, pyxis_api_instance
+                    rebuild_list[rpm_name] = self.find_parent_images_with_package(
+                        image, rpm_name, images=[], pyxis_api_instance=pyxis_api_instance
                     )
-                    if parent_brew_build:
-                        parent = self.get_images_by_nvrs(
-                            [parent_brew_build],
-                            published=None,
-                            pyxis_api_instance=pyxis_api_instance,
+                    if rebuild_list[rpm_name]:
+                        image["parent"] = rebuild_list[rpm_name][0]
+                    else:
+                        parent_brew_build = self.find_parent_brew_build_nvr_from_child(
+                            image, pyxis_api_instance
                         )
-                        if parent:
-                            parent = parent[0]
-                            parent.resolve(pyxis_api_instance, images)
-                            image["parent"] = parent
-                rebuild_list[rpm_name].insert(0, image)
-            return rebuild_list
+                        if parent_brew_build:
+                            parent = self.get_images_by_nvrs(
+                                [parent_brew_build],
+                                published=None,
+                                pyxis_api_instance=pyxis_api_instance,
+                            )
+                            if parent:
+                                parent = parent[0]
+                                parent.resolve(pyxis_api_instance, images)
+                                image["parent"] = parent
+                    rebuild_list[rpm_name].insert(0, image)
+                return rebuild_list
 
         # For every image, find out all its parent images which contain the
         # binary rpm package and store these lists to to_rebuild.
-        to_rebuild = []
+        to_rebuild = ImagesToRebuildDeduplicator(self)
         optimization_base = 50
         with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
             for result in executor.map(_get_images_to_rebuild, images):
-                to_rebuild.extend(result.values())
+                for rebuild_list in result.values():
+                    to_rebuild.add(rebuild_list)
                 # Memory consumption of fully constructed to_rebuild list could
                 # be large. To prevent this we will periodically use
-                # deduplication on the list to reduce it size.
+                # deduplication on the list to reduce it size. Only the image
+                # groups changed since the last deduplication are handled.
                 if len(to_rebuild) > optimization_base:
-                    self._deduplicate_images_to_rebuild(to_rebuild)
+                    to_rebuild.deduplicate()
                     optimization_base += 50
+
+        return self._finalize_images_to_rebuild(to_rebuild, images, rpm_nvrs, content_sets)
+
+    @staticmethod
+    def _exclude_images(images, skip_nvrs=None, leaf_container_images=None):
+        """
+        Removes hotfix images and images from `skip_nvrs` from the images
+        found to be rebuilt.
+
+        :param list images: List of ContainerImage instances.
+        :param list skip_nvrs: List of NVRs of images to be skipped.
+        :param list leaf_container_images: refer to ``find_images_to_rebuild``.
+        :rtype: list
+        """
+        # Remove any hotfix images from list of images
+        for img in images[:]:
+            if any(label["name"] == "com.redhat.hotfix" for label in img["parsed_data"]["labels"]):
+                images.remove(img)
+                log.debug("Excluding hotfix image: %s", img.nvr)
+
+        # Not skip images when rebuild images are requested explicitly
+        if skip_nvrs and not leaf_container_images:
+            images = [img for img in images if img["brew"]["build"] not in skip_nvrs]
+
+        return images
+
+    def _finalize_images_to_rebuild(self, to_rebuild, images, rpm_nvrs, content_sets):
+        """
+        Deduplicates the `to_rebuild` lists built by `find_images_to_rebuild`
+        and converts them to batches.
+
+        :param ImagesToRebuildDeduplicator to_rebuild: the lists of images to
+            rebuild
+        :param list images: the directly affected images `to_rebuild` was
+            built from.
+        :param list rpm_nvrs: List of binary RPM NVRs to look for
+        :param list content_sets: list of strings (content sets) to consider
+            when looking for the packages
+        :return: a list of batches with each batch having a list of images
+        :rtype: list
+        """
         # The to_rebuild list now contains all the images which need to be
         # rebuilt, but there are lot of duplicates there.
 
         # At first remove duplicated images which share the same name and
         # version, but different release.
-        to_rebuild = self._deduplicate_images_to_rebuild(to_rebuild)
+        to_rebuild = to_rebuild.deduplicate()
         # Get all the directly affected images so that any parents that are not marked as
         # directly affected can be set in _images_to_rebuild_to_batches
         directly_affected_nvrs = {image.nvr for image in images if image.get("directly_affected")}
@@ -1601,7 +2898,10 @@ class PyxisAPI(object):
 
             parsed_image_nvr = kobo.rpmlib.parse_nvr(image.nvr)
             images = self.pyxis.find_latest_images_by_name_version(
-                parsed_image_nvr["name"], parsed_image_nvr["version"], published=True
+                parsed_image_nvr["name"],
+                parsed_image_nvr["version"],
+                published=True,
+                projection=IMAGE_PROJECTION_MINIMAL,
             )
             if not images:
                 continue
@@ -1629,19 +2929,9 @@ class PyxisAPI(object):
             replacements[image.nvr] = new_image
 
     def postprocess_images(self, images, rpm_name_to_nvrs):
-        # Avoid manipulating the images directly, uses a copy instead.
-        image_dicts = copy.deepcopy(images)
-        del images
-
-        for image in image_dicts:
-            # modify Pyxis image data to simulate the data structure returned from LightBlue
-            rpms = [
-                rpm
-                for rpm in copy.deepcopy(image["edges"]["rpm_manifest"]["data"]["rpms"])
-                if rpm["name"] in rpm_name_to_nvrs.keys()
-            ]
-            image["rpm_manifest"] = [{"rpms": rpms}]
-            del image["edges"]
+        image_dicts = [
+            self._reshape_image_data(image, rpm_names=rpm_name_to_nvrs) for image in images
+        ]
 
         # convert the dicts to list of ContainerImage
         return self._dicts_to_images(image_dicts)
@@ -1666,9 +2956,14 @@ class PyxisAPI(object):
         :rtype: ContainerImage or None
         """
         rpm_name_to_nvrs = {kobo.rpmlib.parse_nvr(nvr)["name"]: nvr for nvr in rpm_nvrs}
+        fixed_rpms = parse_rpm_nvrs(rpm_name_to_nvrs)
 
         images = self.pyxis.find_latest_images_by_name_version(
-            name, version, published=True, content_sets=content_sets
+            name,
+            version,
+            published=True,
+            content_sets=content_sets,
+            projection=IMAGE_PROJECTION_RPM_NAMES,
         )
         if not images:
             log.error("Could not find an image with the name and version of %s-%s", name, version)
@@ -1702,12 +2997,13 @@ class PyxisAPI(object):
                 log.debug("The image %s has a modularity mismatch", image.nvr)
                 continue
 
-            for rpm in image.get_rpms():
-                nvr_in_image = kobo.rpmlib.parse_nvra(rpm["nvra"])
-                fixed_nvr = kobo.rpmlib.parse_nvr(rpm_name_to_nvrs[rpm["name"]])
-                if kobo.rpmlib.compare_nvr(nvr_in_image, fixed_nvr, ignore_epoch=True) < 0:
-                    log.debug("The image %s does not have all the fixed RPMs", image.nvr)
-                    break
+            image_rpms = image.get_parsed_rpms(fixed_rpms)
+            if any(
+                compare_parsed_rpms(image_rpm, fixed_rpms[name][0]) < 0
+                for name, parsed_image_rpms in image_rpms.items()
+                for image_rpm in parsed_image_rpms
+            ):
+                log.debug("The image %s does not have all the fixed RPMs", image.nvr)
             else:
                 candidate_images.append(image)
 
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import time
+
+import koji
+
+from freshmaker import conf, log
+from freshmaker.image import ImagesToRebuildDeduplicator, PyxisAPI, RepositoryChunks
+from freshmaker.pyxis_gql import pyxis_gql_client
+from freshmaker.pyxis_gql_async import PyxisAsyncGQL
+
+
+class PyxisAsyncAPI(PyxisAPI):
+    """
+    PyxisAPI which finds the images to rebuild using PyxisAsyncGQL.
+
+    The repository chunk queries, the parent image walks and the image
+    resolving are run concurrently, limited by PYXIS_ASYNC_MAX_CONCURRENCY.
+    Only the Pyxis queries are done here, the decisions are made by the
+    PyxisAPI helpers, so both find the same images to rebuild the same way.
+    The parent images are looked up level by level, as PyxisAPI does with
+    BATCH_PARENT_IMAGES_LOOKUP. The blocking Koji, ODCS, database and RPM
+    index lookups are run in threads.
+    """
+
+    def __init__(self, server_url):
+        """Initialize PyxisAsyncAPI instance
+
+        :param str server_url: Pyxis GraphQL url
+        """
+        super().__init__(server_url)
+        # The PyxisAsyncGQL fetches the GraphQL schema synchronously, so it
+        # must be created outside of the event loop.
+        self.async_pyxis = PyxisAsyncGQL(
+            url=server_url, certpath=conf.pyxis_certificate, keypath=conf.pyxis_private_key
+        )
+        self._semaphore = None
+
+    async def _query_pyxis(self, method_name, *args, **kwargs):
+        """
+        Calls the PyxisAsyncGQL `method_name` with the concurrency limit
+        and timeout applied.
+        """
+        async with self._semaphore:
+            async with asyncio.timeout(self.async_pyxis.timeout):
+                return await getattr(self.async_pyxis, method_name)(*args, **kwargs)
+
+    async def _run_blocking(self, func, *args):
+        """
+        Runs blocking `func` in a thread with the concurrency limit applied.
+        """
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    async def _run_blocking_with_pyxis(self, func, *args):
+        """
+        Runs blocking `func` in a thread like `_run_blocking`, passing it a
+        PyxisGQL client of the thread as the last argument.
+        """
+
+        def _run():
+            with pyxis_gql_client(
+                self.server_url, (conf.pyxis_certificate, conf.pyxis_private_key)
+            ) as pyxis_api_instance:
+                return func(*args, pyxis_api_instance)
+
+        return await self._run_blocking(_run)
+
+    async def _query_images_by_nvrs_async(self, nvrs, include_rpm_manifest=True):
+        """
+        Asynchronous version of ``PyxisAPI._query_images_by_nvrs``.
+
+        The PyxisAsyncGQL image fields with and without the RPMs are the
+        ones of the IMAGE_PROJECTION_FULL and IMAGE_PROJECTION_REPOS
+        projection profiles.
+        """
+        if len(nvrs) == 1:
+            return await self._query_pyxis(
+                "find_images_by_nvr", nvrs[0], include_rpms=include_rpm_manifest
+            )
+        return await self._query_pyxis(
+            "find_images_by_nvrs", nvrs, include_rpms=include_rpm_manifest
+        )
+
+    async def _resolve_image(self, image, children=None, koji_data=None, pyxis_images=None):
+        """
+        Asynchronous version of ``ContainerImage.resolve``.
+        """
+        try:
+            log.debug("Resolving image: %s", image.nvr)
+            await self._run_blocking(image.resolve_commit, koji_data)
+            await self._run_blocking(image.resolve_compose_sources)
+            # Resolve the children without content_sets here, so
+            # resolve_content_sets does not need to query Pyxis on its own.
+            for child in children or []:
+                if "content_sets" not in child:
+                    await self._resolve_image(child)
+            await self._run_blocking_with_pyxis(
+                lambda pyxis_api_instance: image.resolve_content_sets(pyxis_api_instance, children)
+            )
+            if pyxis_images is None:
+                pyxis_images = await self._query_images_by_nvrs_async(
+                    [image.nvr], include_rpm_manifest=False
+                )
+                if image.is_unpublished(pyxis_images):
+                    # The complete RPM manifest is needed only for unpublished images
+                    pyxis_images = await self._query_images_by_nvrs_async([image.nvr])
+            image.set_published(pyxis_images)
+        except Exception as e:
+            err = "Cannot resolve the container image: %s" % e
+            image.log_error(err)
+
+    async def _find_images_with_included_rpms(
+        self, content_sets, rpm_nvrs, repositories, published=True
+    ):
+        """
+        Asynchronous version of ``PyxisAPI.find_images_with_included_rpms``.
+        """
+        auto_rebuild_tags = self._get_auto_rebuild_tags(repositories)
+        rpm_name_to_nvrs = self._get_rpm_name_to_nvrs(rpm_nvrs)
+
+        # The RPM image index is a SQLite database and its candidates are
+        # confirmed with PyxisGQL queries, look them up in a thread.
+        images = await self._run_blocking_with_pyxis(
+            self._find_indexed_images_with_included_rpms,
+            rpm_name_to_nvrs,
+            content_sets,
+            repositories,
+            published,
+            auto_rebuild_tags,
+        )
+        if images is None:
+            images = await self._query_pyxis(
+                "find_images_by_installed_rpms",
+                list(rpm_name_to_nvrs),
+                content_sets,
+                list(repositories),
+                published,
+                list(auto_rebuild_tags),
+            )
+        if not images:
+            return []
+
+        return self._filter_images_with_included_rpms(
+            images, rpm_name_to_nvrs, repositories, content_sets
+        )
+
+    async def _find_images_in_repository_chunks(self, content_sets, rpm_nvrs, repos, published):
+        """
+        Asynchronous version of
+        ``PyxisAPI._find_images_in_repository_chunks``.
+
+        The query of a chunk times out after the PyxisAsyncGQL timeout, a
+        single repository which times out is not queried again.
+        """
+        chunks = RepositoryChunks(repos)
+        concurrency = max(1, conf.pyxis_repository_chunk_concurrency)
+
+        async def _query_chunk(chunk):
+            start = time.monotonic()
+            images = await self._find_images_with_included_rpms(
+                content_sets, rpm_nvrs, {name: repos[name] for name in chunk}, published
+            )
+            return images, time.monotonic() - start
+
+        tasks = {}
+        while True:
+            while len(tasks) < concurrency and (chunk := chunks.next_chunk()):
+                index, names = chunk
+                tasks[asyncio.ensure_future(_query_chunk(names))] = chunk
+            if not tasks:
+                break
+
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                chunk = tasks.pop(task)
+                try:
+                    images, duration = task.result()
+                except TimeoutError:
+                    if not chunks.split(chunk):
+                        raise
+                    continue
+                chunks.add_images(chunk, images, duration)
+
+        return chunks.images()
+
+    async def _get_images_by_nvrs(
+        self, nvrs, published=True, content_sets=None, rpm_nvrs=None, rpm_names=None
+    ):
+        """
+        Asynchronous version of ``PyxisAPI.get_images_by_nvrs``.
+        """
+        images = await self._query_images_by_nvrs_async(nvrs)
+        if not images:
+            return []
+
+        return self._filter_images_by_nvrs(images, published, content_sets, rpm_nvrs, rpm_names)
+
+    async def _find_parent_brew_build_nvr_from_child(self, child_image):
+        """
+        Asynchronous version of
+        ``PyxisAPI.find_parent_brew_build_nvr_from_child``.
+        """
+        # The image lineage is stored in the database, query it in a thread.
+        known, parent_brew_build = await self._run_blocking(self._get_known_parent_nvr, child_image)
+        if known:
+            return parent_brew_build
+
+        await self._resolve_image(child_image)
+        return await self._run_blocking(self._get_resolved_parent_nvr, child_image)
+
+    async def _find_parent_image_chains(self, images, rpm_names):
+        """
+        Asynchronous version of ``PyxisAPI.find_parent_image_chains``.
+        """
+        rebuild_lists, walks = self._start_parent_walks(images, rpm_names)
+        all_walks = list(walks)
+
+        while walks:
+            # The walks of different RPM names start from the same image,
+            # find the parent of each image only once.
+            children = {id(walk["child"]): walk["child"] for walk in walks}
+            parent_nvrs = await asyncio.gather(
+                *[self._find_parent_brew_build_nvr_from_child(child) for child in children.values()]
+            )
+            walks = self._set_parent_nvrs(walks, dict(zip(children, parent_nvrs)))
+            if not walks:
+                break
+
+            # Fetch the parents of all the walks at this level at once.
+            parent_nvrs = sorted({walk["parent_nvr"] for walk in walks})
+            parent_dicts = self._group_images_by_nvr(
+                parent_nvrs, await self._query_images_by_nvrs_async(parent_nvrs)
+            )
+            koji_data = await self._run_blocking(self._get_parents_koji_data, parent_dicts)
+
+            # The parents are resolved from the data fetched above, only the
+            # Koji data not batched and the ODCS composes are fetched by
+            # each walk, so the walks are run in threads.
+            continues = await asyncio.gather(
+                *[
+                    self._run_blocking_with_pyxis(
+                        self._walk_to_parent,
+                        walk,
+                        parent_dicts[walk["parent_nvr"]],
+                        koji_data.get(walk["parent_nvr"]),
+                        images,
+                    )
+                    for walk in walks
+                ]
+            )
+            walks = [walk for walk, cont in zip(walks, continues) if cont]
+
+        self._finish_parent_walks(all_walks)
+        return rebuild_lists
+
+    async def _find_images_with_packages_from_content_set(
+        self,
+        rpm_nvrs,
+        content_sets,
+        filter_fnc=None,
+        published=True,
+        release_categories=conf.container_release_categories,
+        leaf_container_images=None,
+        repositories=None,
+    ):
+        """
+        Asynchronous version of
+        ``PyxisAPI.find_images_with_packages_from_content_set``.
+        """
+        # The repositories may be queried from Pyxis by PyxisGQL.
+        repos = await self._run_blocking(
+            lambda: self.find_repositories(published, release_categories, names=repositories)
+        )
+
+        if not repos:
+            return []
+        if not leaf_container_images:
+            images = await self._find_images_in_repository_chunks(
+                content_sets, rpm_nvrs, repos, published
+            )
+        else:
+            # The `leaf_container_images` can contain unpublished container image,
+            # therefore set `published` to None.
+            images = await self._get_images_by_nvrs(
+                leaf_container_images, None, content_sets, rpm_nvrs
+            )
+
+        images = self._filter_found_images(images, published, filter_fnc)
+
+        async def _resolve_batch(batch):
+            images_with_koji_data = await self._run_blocking(self._with_koji_data, batch)
+            return await asyncio.gather(
+                *[
+                    self._resolve_image(image, None, koji_data)
+                    for image, koji_data in images_with_koji_data
+                ]
+            )
+
+        await asyncio.gather(*[_resolve_batch(batch) for batch in self._iter_koji_batches(images)])
+        return [self._mark_directly_affected(image) for image in images]
+
+    async def _find_rebuild_lists(
+        self,
+        rpm_nvrs,
+        content_sets,
+        published,
+        release_categories,
+        filter_fnc,
+        leaf_container_images,
+        skip_nvrs,
+        repositories,
+    ):
+        """
+        Finds the directly affected images and the rebuild lists of their
+        parent images.
+
+        :return: tuple with the ImagesToRebuildDeduplicator of rebuild lists and
+            the directly affected images.
+        :rtype: tuple
+        """
+        self._semaphore = asyncio.Semaphore(conf.pyxis_async_max_concurrency)
+
+        images = await self._find_images_with_packages_from_content_set(
+            rpm_nvrs,
+            content_sets,
+            filter_fnc,
+            published,
+            release_categories,
+            leaf_container_images=leaf_container_images,
+            repositories=repositories,
+        )
+        images = self._exclude_images(images, skip_nvrs, leaf_container_images)
+
+        rpm_names = [koji.parse_NVR(rpm_nvr)["name"] for rpm_nvr in rpm_nvrs]
+        results = await self._find_parent_image_chains(images, rpm_names)
+        to_rebuild = ImagesToRebuildDeduplicator(
+            self, [rebuild_list for result in results for rebuild_list in result.values()]
+        )
+        return to_rebuild, images
+
+    def find_images_to_rebuild(
+        self,
+        rpm_nvrs,
+        content_sets,
+        published=True,
+        release_categories=conf.container_release_categories,
+        filter_fnc=None,
+        leaf_container_images=None,
+        skip_nvrs=None,
+        repositories: list[str] | None = None,
+    ):
+        """
+        Find images to rebuild through image build layers.
+
+        Refer to ``PyxisAPI.find_images_to_rebuild`` for the description of
+        the arguments and the return value.
+        """
+        to_rebuild, images = asyncio.run(
+            self._find_rebuild_lists(
+                rpm_nvrs,
+                content_sets,
+                published,
+                release_categories,
+                filter_fnc,
+                leaf_container_images,
+                skip_nvrs,
+                repositories,
+            )
+        )
+        return self._finalize_images_to_rebuild(to_rebuild, images, rpm_nvrs, content_sets)
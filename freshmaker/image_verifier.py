@@ -25,7 +25,7 @@ from mypy_extensions import TypedDict
 from typing import Optional
 
 from freshmaker import conf
-from freshmaker.pyxis_gql import PyxisGQL
+from freshmaker.pyxis_gql import IMAGE_PROJECTION_REPOS, PyxisGQL, get_repository_catalog
 
 
 class DataElements(TypedDict):
@@ -47,6 +47,7 @@ class ImageVerifier(object):
                 url=conf.pyxis_graphql_url, cert=(conf.pyxis_certificate, conf.pyxis_private_key)
             )
         )
+        self._catalog = get_repository_catalog(self.pyxis.url, self.pyxis.cert)
 
     def _verify_repository_data(self, repo):
         """
@@ -96,7 +97,11 @@ class ImageVerifier(object):
         """
         Returns the ContainerRepository object based on the Repository name.
         """
-        repos = self.pyxis.find_repositories_by_repository_name(repo_name)
+        repos = None
+        if self._catalog:
+            repos = self._catalog.find_repositories_by_repository_name(repo_name)
+        if repos is None:
+            repos = self.pyxis.find_repositories_by_repository_name(repo_name)
 
         if not repos:
             raise ValueError("Cannot get repository %s from Pyxis." % repo_name)
@@ -123,6 +128,12 @@ class ImageVerifier(object):
         image_repo = repos[0]
 
         # returns a single repository
+        if self._catalog:
+            repo = self._catalog.get_repository_by_registry_path(
+                image_repo["registry"], image_repo["repository"]
+            )
+            if repo is not None:
+                return repo
         return self.pyxis.get_repository_by_registry_path(
             image_repo["registry"], image_repo["repository"]
         )
@@ -136,7 +147,7 @@ class ImageVerifier(object):
         :rtype: dict
         :return: Dict with image NVR as key and list of content_sets as values.
         """
-        images = self.pyxis.find_images_by_nvr(image_nvr)
+        images = self.pyxis.find_images_by_nvr(image_nvr, IMAGE_PROJECTION_REPOS)
 
         if not images:
             raise ValueError("No images found for the specified NVR")
@@ -32,8 +32,13 @@ from kobo import rpmlib
 from io import BytesIO
 from zipfile import ZipFile
 
+import atexit
 import contextlib
 import dogpile.cache
+from dogpile.cache.api import NO_VALUE
+import queue
+import threading
+import time
 import re
 import requests
 import yaml
@@ -45,6 +50,7 @@ from gi.repository import Modulemd  # noqa E402
 
 import freshmaker.utils  # noqa E402
 from freshmaker import log, conf, db  # noqa E402
+from freshmaker.cache import immutable_region  # noqa E402
 from freshmaker.consumer import work_queue_put  # noqa E402
 from freshmaker.events import BrewContainerTaskStateChangeEvent  # noqa E402
 from freshmaker.models import ArtifactBuild  # noqa E402
@@ -56,6 +62,36 @@ class KojiLookupError(ValueError):
     pass
 
 
+def _is_build_completed(build):
+    """Returns True if the Koji build is completed, so it won't change anymore"""
+    return bool(build) and build.get("state") == koji.BUILD_STATES["COMPLETE"]
+
+
+def _cache_key(method, server, arg):
+    """
+    Returns the cache key of the KojiService `method` called with the single
+    `arg` on the Koji `server`.
+
+    The server is part of the key, so the data of different Koji instances
+    don't mix, especially in the persistent immutable cache which survives
+    changes of KOJI_PROFILE. The argument stays last, so the values can be
+    invalidated by `invalidate_immutable_cache`.
+    """
+    return "%s:%s|%s|%s" % (method.__module__, method.__name__, server, arg)
+
+
+def _server_key_generator(namespace, fn, to_str=str):
+    """
+    dogpile.cache function key generator of the KojiService methods called
+    with a single argument, see `_cache_key`.
+    """
+
+    def generate_key(self, arg):
+        return _cache_key(fn, self.server, to_str(arg))
+
+    return generate_key
+
+
 class KojiService(object):
     """Wrapper of Koji API and profile configuration
 
@@ -246,7 +282,11 @@ class KojiService(object):
         build_info = self.session.getBuild(build_nvr)
         return self.session.listRPMs(buildID=build_info["id"], arches=arches)
 
-    @region.cache_on_arguments()
+    @freshmaker.utils.singleflight(instance_key=lambda self: self.server)
+    @region.cache_on_arguments(function_key_generator=_server_key_generator)
+    @immutable_region.cache_on_arguments(
+        should_cache_fn=_is_build_completed, function_key_generator=_server_key_generator
+    )
     def get_build(self, buildinfo):
         """
         Return information about a build.
@@ -260,15 +300,185 @@ class KojiService(object):
     def get_build_id(self, build_nvr):
         return self.session.findBuildID(build_nvr)
 
+    @freshmaker.utils.singleflight(instance_key=lambda self: self.server)
+    @immutable_region.cache_on_arguments(function_key_generator=_server_key_generator)
     def get_task_request(self, task_id):
         return self.session.getTaskRequest(task_id)
 
+    def _multicall(self, method, args_list):
+        """
+        Calls the Koji API `method` once for each item of `args_list` in
+        multicall requests of at most KOJI_MULTICALL_BATCH_SIZE calls.
+
+        :param str method: name of the Koji API method.
+        :param list args_list: list of tuples with the arguments of each call.
+        :return: list with the result of each call, or the exception raised
+            by the call.
+        :rtype: list
+        """
+        if not args_list:
+            return []
+        with self.session.multicall(strict=False, batch=conf.koji_multicall_batch_size) as m:
+            calls = [getattr(m, method)(*args) for args in args_list]
+        results = []
+        for call in calls:
+            try:
+                results.append(call.result)
+            except (koji.GenericError, koji.Fault) as e:
+                results.append(e)
+        return results
+
+    def _cached_multicall(self, cached_method, method, args, regions):
+        """
+        Batch version of the `cached_method` calling the Koji API `method`
+        once for each item of `args`.
+
+        The results are looked up in the cache `regions` of the
+        `cached_method` first. The missing ones are fetched with
+        `_multicall`, coalesced with the concurrent `cached_method` calls,
+        and stored in the `regions`, so the `cached_method` and this method
+        share the same cached data.
+
+        :param cached_method: KojiService method decorated by
+            ``freshmaker.utils.singleflight`` and ``cache_on_arguments`` of
+            the `regions`, called with a single argument.
+        :param str method: name of the Koji API method.
+        :param list args: single argument of each call.
+        :param list regions: list of (region, should_cache_fn) tuples in the
+            order the `cached_method` is decorated by them, should_cache_fn
+            can be None.
+        :return: dict with the argument as a key and the result of the call,
+            or the exception raised by the call, as a value.
+        :rtype: dict
+        """
+        results = {}
+        missing = list(dict.fromkeys(args))
+        for i, (cache_region, _) in enumerate(regions):
+            if not missing:
+                break
+            values = cache_region.get_multi(
+                [_cache_key(cached_method, self.server, arg) for arg in missing]
+            )
+            found = {arg: value for arg, value in zip(missing, values) if value is not NO_VALUE}
+            # Fill the outer regions, like the decorated method does.
+            self._cache_results(cached_method, self.server, found, regions[:i])
+            results.update(found)
+            missing = [arg for arg in missing if arg not in found]
+
+        if missing:
+            keys = {cached_method.make_key(self, arg): arg for arg in missing}
+
+            def _fetch(flight_keys):
+                fetch_args = [keys[key] for key in flight_keys]
+                fetched = dict(zip(fetch_args, self._multicall(method, [(a,) for a in fetch_args])))
+                self._cache_results(cached_method, self.server, fetched, regions)
+                return {key: fetched[keys[key]] for key in flight_keys}
+
+            for key, result in cached_method.flight.do_multi(list(keys), _fetch).items():
+                results[keys[key]] = result
+        return results
+
+    @staticmethod
+    def _cache_results(cached_method, server, results, regions):
+        """Stores the `results` of `_cached_multicall` in the `regions`."""
+        for cache_region, should_cache_fn in regions:
+            mapping = {
+                _cache_key(cached_method, server, arg): result
+                for arg, result in results.items()
+                if not isinstance(result, Exception)
+                and (should_cache_fn is None or should_cache_fn(result))
+            }
+            if mapping:
+                cache_region.set_multi(mapping)
+
+    def get_container_builds(self, nvrs, with_arches=False):
+        """
+        Returns the builds, task requests and image arches of the container
+        builds `nvrs`, fetched with one multicall request for each kind of
+        data instead of several calls for every build. The builds and task
+        requests are shared with the caches of `get_build` and
+        `get_task_request`, only the ones missing there are fetched.
+
+        :param list nvrs: NVRs of the container builds.
+        :param bool with_arches: whether to get the arches of the images.
+        :return: dict with the NVR as a key and a dict with the "build",
+            "task_request" and "arches" keys as a value. The values are None
+            when the data doesn't exist in Koji or cannot be fetched.
+        :rtype: dict
+        """
+        nvrs = list(dict.fromkeys(nvrs))
+        builds = {nvr: {"build": None, "task_request": None, "arches": None} for nvr in nvrs}
+
+        fetched_builds = self._cached_multicall(
+            self.get_build,
+            "getBuild",
+            nvrs,
+            [(self.region, None), (immutable_region, _is_build_completed)],
+        )
+        for nvr, build in fetched_builds.items():
+            if isinstance(build, Exception):
+                log.warning("Cannot get Koji build %s: %s", nvr, build)
+            else:
+                builds[nvr]["build"] = build
+        found = {nvr: data["build"] for nvr, data in builds.items() if data["build"]}
+
+        task_ids = {}
+        for nvr, build in found.items():
+            task_id = build.get("task_id") or build.get("extra", {}).get("container_koji_task_id")
+            if task_id:
+                task_ids[nvr] = task_id
+        task_requests = self._cached_multicall(
+            self.get_task_request,
+            "getTaskRequest",
+            list(task_ids.values()),
+            [(immutable_region, None)],
+        )
+        for nvr, task_id in task_ids.items():
+            task_request = task_requests[task_id]
+            if isinstance(task_request, Exception):
+                log.warning("Cannot get Koji task request of build %s: %s", nvr, task_request)
+            else:
+                builds[nvr]["task_request"] = task_request
+
+        if with_arches:
+            archives_list = self._multicall(
+                "listArchives", [(build["build_id"],) for build in found.values()]
+            )
+            for nvr, archives in zip(found, archives_list):
+                if isinstance(archives, Exception):
+                    log.warning("Cannot list Koji archives of build %s: %s", nvr, archives)
+                else:
+                    builds[nvr]["arches"] = self._get_image_arches(archives)
+
+        return builds
+
     def get_build_target(self, target_name):
         return self.session.getBuildTarget(target_name)
 
     def get_task_info(self, task_id):
         return self.session.getTaskInfo(task_id)
 
+    def get_tasks_info(self, task_ids):
+        """
+        Returns information about the tasks `task_ids`, fetched with
+        multicall requests.
+
+        :param list task_ids: IDs of the Koji tasks.
+        :return: dict with the task ID as a key and the task information as
+            a value. The tasks which cannot be fetched are missing in the dict.
+        :rtype: dict
+        """
+        task_ids = list(task_ids)
+        tasks = {}
+        for task_id, task in zip(
+            task_ids, self._multicall("getTaskInfo", [(task_id,) for task_id in task_ids])
+        ):
+            if isinstance(task, Exception) or not task:
+                log.warning("Cannot get Koji task %s: %s", task_id, task)
+                continue
+            tasks[task_id] = task
+        return tasks
+
     def list_archives(self, build_id, archive_type=None):
         return self.session.listArchives(build_id, type=archive_type)
 
@@ -480,14 +690,168 @@ class KojiService(object):
             log.error("Read packager string failed for NVR %s: %s", build_nvr, str(e))
             return None
 
-    @region.cache_on_arguments()
-    def get_build_arches(self, build_id):
-        archives = self.list_archives(build_id=build_id)
+    @staticmethod
+    def _get_image_arches(archives):
         arches = [
             archive["extra"]["image"]["arch"] for archive in archives if archive["btype"] == "image"
         ]
         return " ".join(sorted(arches))
 
+    @region.cache_on_arguments()
+    def get_build_arches(self, build_id):
+        archives = self.list_archives(build_id=build_id)
+        return self._get_image_arches(archives)
+
+
+class KojiSessionPool:
+    """
+    Thread-safe pool of KojiService instances logged in to Koji.
+
+    The sessions are logged in lazily, up to `size` of them, and stay
+    logged in between their uses. When all the sessions are in use, the
+    caller waits until one of them is returned.
+
+    A session is logged in again when it has been logged in for more than
+    KOJI_SESSION_MAX_AGE seconds, or when it has been idle for more than
+    KOJI_SESSION_HEALTH_CHECK_INTERVAL seconds and Koji doesn't know its
+    user anymore. The sessions are logged out by `close`, at exit.
+    """
+
+    def __init__(self, profile, dry_run, size):
+        """
+        :param str profile: Koji profile name.
+        :param bool dry_run: whether the sessions run in dry run mode.
+        :param int size: maximum number of sessions in the pool.
+        """
+        self.profile = profile
+        self.dry_run = dry_run
+        self.size = size
+        # Idle sessions as (service, time of login, time of last use)
+        self._sessions = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _login(self, service):
+        """Logs the `service` in, returns the time of the login"""
+        service.krb_login()
+        # We are not logged in in dry run mode...
+        if not self.dry_run and not service.logged_in:
+            raise koji.AuthError("Could not login server %s" % service.server)
+        return time.monotonic()
+
+    @staticmethod
+    def _logout(service):
+        try:
+            if service.logged_in:
+                service.logout()
+        except Exception as e:
+            log.warning("Cannot logout from Koji server %s: %s", service.server, e)
+
+    @staticmethod
+    def _is_logged_in(service):
+        """Checks that the Koji server still knows the user of the `service`"""
+        try:
+            return bool(service.session.getLoggedInUser())
+        except Exception as e:
+            log.warning("Koji session of %s is not usable: %s", service.server, e)
+            return False
+
+    def _refresh(self, service, logged_in_at, last_used_at):
+        """
+        Logs the `service` in again when its session is too old or not
+        logged in anymore, returns the time of the login.
+        """
+        if self.dry_run:
+            return logged_in_at
+        now = time.monotonic()
+        if now - logged_in_at >= conf.koji_session_max_age:
+            log.debug("Logging into %s again, the session is too old.", service.server)
+        elif now - last_used_at >= conf.koji_session_health_check_interval and (
+            not self._is_logged_in(service)
+        ):
+            log.info("Logging into %s again, the session is not logged in.", service.server)
+        else:
+            return logged_in_at
+        self._logout(service)
+        return self._login(service)
+
+    def _get(self):
+        try:
+            service, logged_in_at, last_used_at = self._sessions.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    log.debug("Logging into %s with Kerberos authentication.", self.profile)
+                    service = KojiService(profile=self.profile, dry_run=self.dry_run)
+                    return service, self._login(service)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            service, logged_in_at, last_used_at = self._sessions.get()
+
+        try:
+            return service, self._refresh(service, logged_in_at, last_used_at)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, service):
+        self._logout(service)
+        with self._lock:
+            self._created -= 1
+
+    @contextlib.contextmanager
+    def service(self):
+        """Context manager borrowing a logged in KojiService from the pool"""
+        service, logged_in_at = self._get()
+        try:
+            yield service
+        except koji.AuthError:
+            # The session is not usable anymore, the next caller logs in again.
+            self._discard(service)
+            raise
+        except BaseException:
+            self._sessions.put((service, logged_in_at, time.monotonic()))
+            raise
+        self._sessions.put((service, logged_in_at, time.monotonic()))
+
+    def close(self):
+        """Logout all the idle sessions in the pool"""
+        while True:
+            try:
+                service, _, _ = self._sessions.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(service)
+
+
+_session_pools: dict[tuple, KojiSessionPool] = {}
+_session_pools_lock = threading.Lock()
+
+
+def get_koji_session_pool(profile, dry_run=False):
+    """
+    Returns the process-wide KojiSessionPool for the `profile`, with
+    KOJI_SESSION_POOL_SIZE sessions at most.
+
+    :param str profile: Koji profile name.
+    :param bool dry_run: whether the sessions run in dry run mode.
+    :rtype: KojiSessionPool
+    """
+    key = (profile, dry_run)
+    with _session_pools_lock:
+        if key not in _session_pools:
+            pool = KojiSessionPool(profile, dry_run, conf.koji_session_pool_size)
+            atexit.register(pool.close)
+            _session_pools[key] = pool
+        return _session_pools[key]
+
 
 @contextlib.contextmanager
 def koji_service(profile=None, logger=None, login=True, dry_run=False):
@@ -505,7 +869,15 @@ def koji_service(profile=None, logger=None, login=True, dry_run=False):
         # if you want it to use alternative Koji profile rather than the default one koji
         with KojiService(koji='stg', logger=logger) as service:
             ...
+
+    When KOJI_SESSION_POOL_SIZE is set, the logged in services are borrowed
+    from the process-wide pool and they are not logged out afterwards.
     """
+    if login and conf.koji_session_pool_size and conf.krb_auth_principal:
+        with get_koji_session_pool(profile, dry_run).service() as service:
+            yield service
+        return
+
     service = KojiService(profile=profile, dry_run=dry_run)
 
     if login:
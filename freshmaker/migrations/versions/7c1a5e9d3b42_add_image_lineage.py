@@ -0,0 +1,27 @@
+"""Add image_lineage table
+
+Revision ID: 7c1a5e9d3b42
+Revises: fcba8824bf8d
+Create Date: 2026-10-16 22:40:12.531027
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c1a5e9d3b42'
+down_revision = 'fcba8824bf8d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'image_lineage',
+        sa.Column('nvr', sa.String(), nullable=False),
+        sa.Column('parent_nvr', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('nvr'),
+    )
+
+
+def downgrade():
+    op.drop_table('image_lineage')
@@ -0,0 +1,41 @@
+"""Add build_submissions table and events.priority
+
+Revision ID: a4d2f81c6e07
+Revises: 7c1a5e9d3b42
+Create Date: 2026-10-16 23:52:08.114306
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4d2f81c6e07'
+down_revision = '7c1a5e9d3b42'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'events', sa.Column('priority', sa.Integer(), nullable=False, server_default='0')
+    )
+    op.create_table(
+        'build_submissions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('build_id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False),
+        sa.Column('time_queued', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['build_id'], ['artifact_builds.id'], ),
+        sa.ForeignKeyConstraint(['event_id'], ['events.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('build_id'),
+    )
+    op.create_index(
+        op.f('ix_build_submissions_event_id'), 'build_submissions', ['event_id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_build_submissions_event_id'), table_name='build_submissions')
+    op.drop_table('build_submissions')
+    op.drop_column('events', 'priority')
@@ -0,0 +1,22 @@
+"""Add events.predicted_time_done
+
+Revision ID: c8e51f0b2d94
+Revises: a4d2f81c6e07
+Create Date: 2026-10-17 01:14:37.602913
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c8e51f0b2d94'
+down_revision = 'a4d2f81c6e07'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('events', sa.Column('predicted_time_done', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('events', 'predicted_time_done')
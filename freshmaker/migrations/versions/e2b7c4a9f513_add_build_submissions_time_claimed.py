@@ -0,0 +1,22 @@
+"""Add build_submissions.time_claimed
+
+Revision ID: e2b7c4a9f513
+Revises: c8e51f0b2d94
+Create Date: 2026-10-17 09:41:22.318045
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c4a9f513'
+down_revision = 'c8e51f0b2d94'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('build_submissions', sa.Column('time_claimed', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('build_submissions', 'time_claimed')
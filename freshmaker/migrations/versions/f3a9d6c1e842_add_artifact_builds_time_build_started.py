@@ -0,0 +1,22 @@
+"""Add artifact_builds.time_build_started
+
+Revision ID: f3a9d6c1e842
+Revises: e2b7c4a9f513
+Create Date: 2026-10-17 14:12:37.502914
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d6c1e842'
+down_revision = 'e2b7c4a9f513'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('artifact_builds', sa.Column('time_build_started', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('artifact_builds', 'time_build_started')
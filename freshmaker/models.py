@@ -26,7 +26,10 @@
 import json
 
 from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta
+from statistics import median
+from sqlalchemy import and_, case, func, literal, null, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import validates, relationship
 from sqlalchemy.schema import Index
 from sqlalchemy.sql.expression import false
@@ -190,6 +193,14 @@ class Event(FreshmakerBase):
     manual_triggered = db.Column(
         db.Boolean, default=False, doc="Whether this event is triggered manually"
     )
+    # Priority of the submission of the builds of this event to Koji, see
+    # ErrataAdvisory.priority. The builds of the events with higher priority
+    # are submitted first.
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Completion time of this event predicted from the expected durations of
+    # its builds when their submission started, see
+    # ContainerBuildHandler._sort_by_critical_path.
+    predicted_time_done = db.Column(db.DateTime, nullable=True)
 
     @classmethod
     def create(
@@ -205,6 +216,7 @@ class Event(FreshmakerBase):
         requester=None,
         requested_rebuilds=None,
         requester_metadata=None,
+        priority=0,
     ):
         if event_type in EVENT_TYPES:
             event_type = EVENT_TYPES[event_type]
@@ -221,6 +233,7 @@ class Event(FreshmakerBase):
             requester=requester,
             requested_rebuilds=requested_rebuilds,
             requester_metadata=requester_metadata,
+            priority=priority,
         )
         session.add(event)
         return event
@@ -252,6 +265,7 @@ class Event(FreshmakerBase):
         requester=None,
         requested_rebuilds=None,
         requester_metadata=None,
+        priority=0,
     ):
         instance = cls.get(session, message_id)
         if instance:
@@ -267,6 +281,7 @@ class Event(FreshmakerBase):
             requester=requester,
             requested_rebuilds=requested_rebuilds,
             requester_metadata=requester_metadata,
+            priority=priority,
         )
         session.commit()
         return instance
@@ -291,6 +306,8 @@ class Event(FreshmakerBase):
                     "requester_metadata_json field is ill-formatted: %s", requester_metadata
                 )
                 requester_metadata = None
+        advisory = getattr(event, "advisory", None)
+        priority = advisory.priority if advisory else 0
 
         return cls.get_or_create(
             session,
@@ -303,6 +320,7 @@ class Event(FreshmakerBase):
             requester=requester,
             requested_rebuilds=requested_rebuilds,
             requester_metadata=requester_metadata,
+            priority=priority,
         )
 
     @classmethod
@@ -511,6 +529,7 @@ class Event(FreshmakerBase):
             "state_reason": self.state_reason,
             "time_created": _utc_datetime_to_iso(self.time_created),
             "time_done": _utc_datetime_to_iso(self.time_done),
+            "predicted_time_done": _utc_datetime_to_iso(self.predicted_time_done),
             "url": event_url,
             "dry_run": self.dry_run,
             "requester": self.requester,
@@ -609,6 +628,9 @@ class ArtifactBuild(FreshmakerBase):
     state = db.Column(db.Integer, nullable=False)
     state_reason = db.Column(db.String, nullable=True)
     time_submitted = db.Column(db.DateTime, nullable=False)
+    # Time of the submission to the build system, so the build duration can
+    # be computed once the build is completed.
+    time_build_started = db.Column(db.DateTime, nullable=True)
     time_completed = db.Column(db.DateTime)
 
     # Link to the Artifact on which this one depends and which triggered
@@ -760,6 +782,9 @@ class ArtifactBuild(FreshmakerBase):
         if ArtifactBuildState(state).counter:
             ArtifactBuildState(state).counter.inc()
 
+        if self.state == ArtifactBuildState.BUILD.value:
+            self.time_build_started = datetime.utcnow()
+
         self.state_reason = state_reason
         if self.state in [
             ArtifactBuildState.DONE.value,
@@ -818,6 +843,105 @@ class ArtifactBuild(FreshmakerBase):
             "rebuild_reason": RebuildReason(self.rebuild_reason or 0).name.lower(),
         }
 
+    @classmethod
+    def get_expected_durations(cls, session, builds, default, history_size=20):
+        """
+        Returns the expected durations of the container image `builds`.
+
+        The duration of a build is the median duration of the last successful
+        builds of the same image name-version, or of the same image name
+        when there is no such build. The durations are measured from the
+        submission of the builds to the build system, the builds submitted
+        before it was recorded are not taken into account.
+
+        :param session: db.session
+        :param list builds: list of ArtifactBuild.
+        :param int default: duration of the builds without any history.
+        :param int history_size: maximum number of the last successful builds
+            of an image name-version, or name, the durations are computed
+            from.
+        :return: dict with the build id as a key and the expected duration in
+            seconds as a value.
+        :rtype: dict
+        """
+        names = {build.name for build in builds}
+        if not names:
+            return {}
+        name_versions = {
+            build.original_nvr.rsplit("-", 1)[0] for build in builds if build.original_nvr
+        }
+
+        def _escape_like(value):
+            return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+        # The name-version of the original NVR, when it's one of the
+        # `name_versions`. The release following it never contains a dash.
+        whens = [
+            (
+                and_(
+                    cls.original_nvr.like(_escape_like(nv) + "-%", escape="\\"),
+                    cls.original_nvr.notlike(_escape_like(nv) + "-%-%", escape="\\"),
+                ),
+                nv,
+            )
+            for nv in sorted(name_versions)
+        ]
+        name_version = (case(*whens, else_=None) if whens else null()).label("name_version")
+        history = (
+            session.query(
+                cls.name,
+                name_version,
+                cls.time_build_started,
+                cls.time_completed,
+                func.row_number()
+                .over(partition_by=cls.name, order_by=cls.time_completed.desc())
+                .label("name_row_number"),
+                func.row_number()
+                .over(partition_by=name_version, order_by=cls.time_completed.desc())
+                .label("name_version_row_number"),
+            )
+            .filter(
+                cls.name.in_(list(names)),
+                cls.type == ArtifactType.IMAGE.value,
+                cls.state == ArtifactBuildState.DONE.value,
+                cls.time_build_started.isnot(None),
+                cls.time_completed.isnot(None),
+            )
+            .subquery()
+        )
+        durations_by_name = defaultdict(list)
+        durations_by_name_version = defaultdict(list)
+        for name, nv, time_build_started, time_completed, name_row, nv_row in session.query(
+            history.c.name,
+            history.c.name_version,
+            history.c.time_build_started,
+            history.c.time_completed,
+            history.c.name_row_number,
+            history.c.name_version_row_number,
+        ).filter(
+            or_(
+                history.c.name_row_number <= history_size,
+                and_(
+                    history.c.name_version.isnot(None),
+                    history.c.name_version_row_number <= history_size,
+                ),
+            )
+        ):
+            duration = (time_completed - time_build_started).total_seconds()
+            if name_row <= history_size:
+                durations_by_name[name].append(duration)
+            if nv is not None and nv_row <= history_size:
+                durations_by_name_version[nv].append(duration)
+
+        expected = {}
+        for build in builds:
+            name_version = build.original_nvr.rsplit("-", 1)[0] if build.original_nvr else None
+            durations = durations_by_name_version.get(name_version) or durations_by_name.get(
+                build.name
+            )
+            expected[build.id] = median(durations) if durations else default
+        return expected
+
     def get_root_dep_on(self):
         dep_on = self.dep_on
         while dep_on:
@@ -890,3 +1014,248 @@ class ArtifactBuildCompose(FreshmakerBase):
 
     build = db.relationship("ArtifactBuild", back_populates="composes")
     compose = db.relationship("Compose", back_populates="builds")
+
+
+class ImageLineage(FreshmakerBase):
+    """
+    Parent of a container image build, as found in Pyxis or Koji.
+
+    Builds never change once they exist, so the parent of an image NVR is
+    stored once and reused. Base images are stored without parent.
+
+    The lineage is recorded and queried from the threads resolving the
+    images, so these methods use their own connection instead of the
+    thread-local session.
+    """
+
+    __tablename__ = "image_lineage"
+
+    nvr = db.Column(db.String, primary_key=True)
+    parent_nvr = db.Column(db.String, nullable=True)
+
+    @classmethod
+    def record(cls, nvr, parent_nvr):
+        """
+        Stores the parent of the image `nvr`.
+
+        :param str nvr: image NVR.
+        :param str parent_nvr: parent image NVR, None for base images.
+        """
+        table = cls.__table__
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(
+                    table.update().where(table.c.nvr == nvr).values(parent_nvr=parent_nvr)
+                )
+                if not updated.rowcount:
+                    conn.execute(table.insert().values(nvr=nvr, parent_nvr=parent_nvr))
+        except IntegrityError:
+            # The lineage has been recorded concurrently
+            pass
+
+    @classmethod
+    def get_parent(cls, nvr):
+        """
+        Returns the recorded parent of the image `nvr`.
+
+        :param str nvr: image NVR.
+        :return: tuple with True and the parent NVR (None for base images)
+            when the parent is recorded, otherwise (False, None).
+        :rtype: tuple
+        """
+        table = cls.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(select(table.c.parent_nvr).where(table.c.nvr == nvr)).first()
+        if row is None:
+            return False, None
+        return True, row.parent_nvr
+
+    @classmethod
+    def get_ancestors(cls, nvrs, max_depth=100):
+        """
+        Returns the recorded ancestors of the images `nvrs`, queried at once
+        with a single recursive query.
+
+        :param list nvrs: image NVRs.
+        :param int max_depth: maximum number of ancestors returned for an
+            image, protects against cycles in the data.
+        :return: dict with the image NVR as a key and the list of its
+            ancestor NVRs as a value: [parent, grandparent, ...]. The list
+            ends with None when the base image has been recorded. The NVRs
+            without any recorded parent are missing in the dict.
+        :rtype: dict
+        """
+        if not nvrs:
+            return {}
+        table = cls.__table__
+        lineage = (
+            select(
+                table.c.nvr.label("root"),
+                table.c.nvr,
+                table.c.parent_nvr,
+                literal(0).label("depth"),
+            )
+            .where(table.c.nvr.in_(list(nvrs)))
+            .cte("lineage", recursive=True)
+        )
+        parent = table.alias("parent")
+        lineage = lineage.union_all(
+            select(lineage.c.root, parent.c.nvr, parent.c.parent_nvr, lineage.c.depth + 1)
+            .where(parent.c.nvr == lineage.c.parent_nvr)
+            .where(lineage.c.depth < max_depth - 1)
+        )
+        query = select(lineage.c.root, lineage.c.parent_nvr).order_by(
+            lineage.c.root, lineage.c.depth
+        )
+
+        ancestors = {}
+        with db.engine.connect() as conn:
+            for root, parent_nvr in conn.execute(query):
+                ancestors.setdefault(root, []).append(parent_nvr)
+        return ancestors
+
+
+class BuildSubmission(FreshmakerBase):
+    """
+    Container image build waiting in the queue for its submission to Koji,
+    see ContainerBuildHandler.submit_queued_builds.
+    """
+
+    __tablename__ = "build_submissions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    build_id = db.Column(
+        db.Integer, db.ForeignKey("artifact_builds.id"), nullable=False, unique=True
+    )
+    event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False, index=True)
+    # Priority of the event at the time the build was queued.
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    time_queued = db.Column(db.DateTime, nullable=False)
+    # Time the submission was picked for the submission to Koji. The claimed
+    # submission stays in the queue until the build leaves the PLANNED state,
+    # so it is picked again once the claim expires.
+    time_claimed = db.Column(db.DateTime, nullable=True)
+
+    build = db.relationship("ArtifactBuild")
+
+    @classmethod
+    def enqueue(cls, session, build):
+        """
+        Queues the `build` for submission, unless it is queued already.
+        The claim of the already queued submission is released, so it can
+        be picked again right away.
+
+        :param session: db.session
+        :param ArtifactBuild build: build to queue.
+        :return: the queued submission.
+        :rtype: BuildSubmission
+        """
+        submission = session.query(cls).filter_by(build_id=build.id).first()
+        if submission:
+            submission.time_claimed = None
+            return submission
+        submission = cls(
+            build_id=build.id,
+            event_id=build.event_id,
+            priority=build.event.priority,
+            time_queued=datetime.utcnow(),
+        )
+        session.add(submission)
+        return submission
+
+    # Key of the PostgreSQL advisory lock taken by ``lock_queue``.
+    QUEUE_LOCK_KEY = 0x66726D71
+
+    @classmethod
+    def lock_queue(cls, session):
+        """
+        Locks the queue until the end of the transaction, so the concurrent
+        callers check the number of builds in flight and claim the
+        submissions one after another and cannot claim more submissions
+        than there is room for.
+
+        The transaction-level advisory lock is taken only on PostgreSQL,
+        the SQLite database used for development and tests runs a single
+        Freshmaker process.
+
+        :param session: db.session
+        """
+        if session.bind.dialect.name == "postgresql":
+            session.execute(select(func.pg_advisory_xact_lock(cls.QUEUE_LOCK_KEY)))
+
+    @classmethod
+    def count_claimed(cls, session, claim_timeout):
+        """
+        Returns the number of the submissions claimed in the last
+        `claim_timeout` seconds whose builds are still PLANNED, because the
+        claimer did not submit them to Koji yet.
+
+        :param session: db.session
+        :param int claim_timeout: number of seconds after which the claimed
+            submissions can be claimed again.
+        :rtype: int
+        """
+        return (
+            session.query(cls)
+            .join(ArtifactBuild, cls.build_id == ArtifactBuild.id)
+            .filter(
+                cls.time_claimed >= datetime.utcnow() - timedelta(seconds=claim_timeout),
+                ArtifactBuild.state == ArtifactBuildState.PLANNED.value,
+            )
+            .count()
+        )
+
+    @classmethod
+    def claim_next(cls, session, limit, claim_timeout):
+        """
+        Claims the next `limit` queued submissions, which are not claimed
+        or whose claim is older than `claim_timeout` seconds.
+
+        The submissions with higher priority go first. The submissions with
+        the same priority are picked from their events in turns, so every
+        event gets a fair share of the submissions. Within an event, the
+        submissions are picked in the order they were queued.
+
+        Only the picked rows are locked until the end of the transaction,
+        and the rows locked by the concurrent callers are skipped, so the
+        concurrent callers claim different submissions.
+
+        :param session: db.session
+        :param int limit: maximum number of submissions to claim.
+        :param int claim_timeout: number of seconds after which the claimed
+            submissions can be claimed again.
+        :rtype: list of BuildSubmission
+        """
+        now = datetime.utcnow()
+        claimable = or_(
+            cls.time_claimed.is_(None),
+            cls.time_claimed < now - timedelta(seconds=claim_timeout),
+        )
+        turn = (
+            func.row_number()
+            .over(partition_by=cls.event_id, order_by=(cls.time_queued, cls.id))
+            .label("turn")
+        )
+        ranked = session.query(cls.id, cls.priority, cls.time_queued, turn).filter(claimable)
+        ranked = ranked.subquery()
+        next_ids = [
+            row.id
+            for row in session.query(ranked.c.id)
+            .order_by(ranked.c.priority.desc(), ranked.c.turn, ranked.c.time_queued, ranked.c.id)
+            .limit(limit)
+        ]
+        if not next_ids:
+            return []
+
+        # The window function cannot be used together with FOR UPDATE, so the
+        # picked rows are locked by a separate query.
+        submissions = (
+            session.query(cls)
+            .filter(cls.id.in_(next_ids), claimable)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for submission in submissions:
+            submission.time_claimed = now
+        order = {submission_id: i for i, submission_id in enumerate(next_ids)}
+        return sorted(submissions, key=lambda submission: order[submission.id])
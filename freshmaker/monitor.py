@@ -30,6 +30,7 @@ from prometheus_client import (  # noqa: F401
     ProcessCollector,
     CollectorRegistry,
     Counter,
+    Gauge,
     multiprocess,
     Histogram,
     generate_latest,
@@ -119,6 +120,60 @@ freshmaker_event_canceled_counter = Counter(
     registry=registry,
 )
 
+pyxis_gql_pool_hit_counter = Counter(
+    "pyxis_gql_pool_hit",
+    "Number of PyxisGQL clients reused from the pool",
+    registry=registry,
+)
+pyxis_gql_pool_miss_counter = Counter(
+    "pyxis_gql_pool_miss",
+    "Number of PyxisGQL clients created for the pool",
+    registry=registry,
+)
+pyxis_gql_pool_wait_counter = Counter(
+    "pyxis_gql_pool_wait",
+    "Number of times a PyxisGQL client had to be waited for",
+    registry=registry,
+)
+pyxis_gql_pool_wait_time = Histogram(
+    "pyxis_gql_pool_wait_time",
+    "Time spent waiting for a PyxisGQL client from the pool",
+    registry=registry,
+)
+singleflight_coalesced_counter = Counter(
+    "singleflight_coalesced",
+    "Number of calls which waited for the result of the same call in flight",
+    ["function"],
+    registry=registry,
+)
+pyxis_query_latency = Histogram(
+    "pyxis_query_latency",
+    "Latency of the Pyxis GraphQL queries",
+    ["query_name", "projection"],
+    registry=registry,
+)
+pyxis_query_response_size = Histogram(
+    "pyxis_query_response_size",
+    "Size in bytes of the Pyxis GraphQL query responses",
+    ["query_name", "projection"],
+    buckets=(1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, float("inf")),
+    registry=registry,
+)
+pyxis_page_size_gauge = Gauge(
+    "pyxis_page_size",
+    "Page size learned for the type of paginated Pyxis GraphQL query",
+    ["query_type"],
+    multiprocess_mode="livemostrecent",
+    registry=registry,
+)
+build_submission_queue_wait_time = Histogram(
+    "build_submission_queue_wait_time",
+    "Time the container image builds spent in the queue before their submission to Koji",
+    ["priority"],
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, float("inf")),
+    registry=registry,
+)
+
 freshmaker_build_api_latency = Histogram("build_api_latency", "BuildAPI latency", registry=registry)
 freshmaker_event_api_latency = Histogram("event_api_latency", "EventAPI latency", registry=registry)
 
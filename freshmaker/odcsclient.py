@@ -45,6 +45,7 @@ from freshmaker.kojiservice import koji_service
 from freshmaker.consumer import work_queue_put
 from freshmaker.types import ArtifactBuildState
 from freshmaker.events import ODCSComposeStateChangeEvent
+from freshmaker.utils import singleflight
 
 
 class RetryingODCS(ODCS):
@@ -59,6 +60,11 @@ class RetryingODCS(ODCS):
             else:
                 raise
 
+    # All the clients are created for the configured ODCS server.
+    @singleflight(instance_key=lambda self: conf.odcs_server_url)
+    def get_compose(self, compose_id):
+        return super(RetryingODCS, self).get_compose(compose_id)
+
 
 def create_odcs_client():
     """
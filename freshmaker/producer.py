@@ -22,6 +22,7 @@
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
 import koji
+import time
 from moksha.hub.api.producer import PollingProducer
 from datetime import timedelta, datetime
 
@@ -30,6 +31,7 @@ from freshmaker.types import EventState, ArtifactBuildState
 from freshmaker.kojiservice import koji_service
 from freshmaker.events import BrewContainerTaskStateChangeEvent
 from freshmaker.consumer import work_queue_put
+from freshmaker.handlers.koji import RebuildImagesOnParentImageBuild
 
 try:
     # SQLAlchemy 1.4
@@ -45,9 +47,15 @@ except ImportError:
 class FreshmakerProducer(PollingProducer):
     frequency = timedelta(seconds=conf.polling_interval)
 
+    def __init__(self, hub):
+        super(FreshmakerProducer, self).__init__(hub)
+        # Koji task ID -> (time of the last check, interval until the next check)
+        self._task_watermarks = {}
+
     def poll(self):
         try:
             self.check_unfinished_koji_tasks(db.session)
+            self.submit_queued_builds()
         except _sa_disconnect_exceptions as ex:
             db.session.rollback()
             log.error("Invalid request, session is rolled back: %s", ex.orig)
@@ -57,30 +65,79 @@ class FreshmakerProducer(PollingProducer):
 
         log.info('Poller will now sleep for "{}" seconds'.format(conf.polling_interval))
 
+    def _is_task_due(self, task_id, now):
+        """Returns True if the Koji task `task_id` should be checked now"""
+        watermark = self._task_watermarks.get(task_id)
+        if watermark is None:
+            return True
+        last_checked, interval = watermark
+        # Allow some jitter of the polling.
+        return now - last_checked >= interval - conf.polling_interval / 2
+
+    def _record_task_check(self, task_id, now):
+        """
+        Records the check of the running Koji task `task_id`. The longer
+        the task runs, the less often it is checked, at least every
+        KOJI_TASK_POLL_MAX_INTERVAL seconds.
+        """
+        _, interval = self._task_watermarks.get(task_id, (None, 0))
+        interval = min(max(interval * 2, conf.polling_interval), conf.koji_task_poll_max_interval)
+        self._task_watermarks[task_id] = (now, interval)
+
+    def submit_queued_builds(self):
+        """
+        Submits the queued container image builds when there is room for
+        them in Koji, so they do not wait for the next finished build.
+        """
+        if conf.build_submission_max_in_flight:
+            RebuildImagesOnParentImageBuild().submit_queued_builds()
+
     def check_unfinished_koji_tasks(self, session):
         stale_date = datetime.utcnow() - timedelta(days=7)
-        db_events = (
-            session.query(models.Event)
+        builds = (
+            session.query(models.ArtifactBuild.name, models.ArtifactBuild.build_id)
+            .join(models.Event, models.ArtifactBuild.event_id == models.Event.id)
             .filter(
                 models.Event.state == EventState.BUILDING.value,
                 models.Event.time_created >= stale_date,
+                models.ArtifactBuild.state == ArtifactBuildState.BUILD.value,
+                models.ArtifactBuild.build_id > 0,
             )
             .all()
         )
 
-        for db_event in db_events:
-            for build in db_event.builds:
-                if build.state != ArtifactBuildState.BUILD.value:
-                    continue
-                if build.build_id <= 0:
-                    continue
-                with koji_service(conf.koji_profile, log, login=False) as koji_session:
-                    task = koji_session.get_task_info(build.build_id)
-                    task_states = {v: k for k, v in koji.TASK_STATES.items()}
-                    new_state = task_states[task["state"]]
-                    if new_state not in ["FAILED", "CLOSED"]:
-                        continue
-                    event = BrewContainerTaskStateChangeEvent(
-                        "fake event", build.name, None, None, build.build_id, "BUILD", new_state
-                    )
-                    work_queue_put(event)
+        # Forget the tasks which are not building anymore.
+        task_ids = {build.build_id for build in builds}
+        self._task_watermarks = {
+            task_id: watermark
+            for task_id, watermark in self._task_watermarks.items()
+            if task_id in task_ids
+        }
+
+        now = time.monotonic()
+        builds = [build for build in builds if self._is_task_due(build.build_id, now)]
+        if not builds:
+            return
+
+        with koji_service(conf.koji_profile, log, login=False) as koji_session:
+            if conf.koji_multicall_batching:
+                tasks = koji_session.get_tasks_info([build.build_id for build in builds])
+            else:
+                tasks = {
+                    build.build_id: koji_session.get_task_info(build.build_id) for build in builds
+                }
+
+        task_states = {v: k for k, v in koji.TASK_STATES.items()}
+        for build in builds:
+            task = tasks.get(build.build_id)
+            if not task:
+                continue
+            new_state = task_states[task["state"]]
+            if new_state not in ["FAILED", "CLOSED"]:
+                self._record_task_check(build.build_id, now)
+                continue
+            self._task_watermarks.pop(build.build_id, None)
+            event = BrewContainerTaskStateChangeEvent(
+                "fake event", build.name, None, None, build.build_id, "BUILD", new_state
+            )
+            work_queue_put(event)
@@ -19,8 +19,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import fcntl
+import json
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import cached_property
 from typing import Optional
+from urllib.parse import urlparse
 
 import backoff
 import dogpile.cache
@@ -29,7 +39,17 @@ from gql import Client, gql
 from gql.dsl import DSLQuery, DSLSchema, dsl_gql
 from gql.transport.requests import RequestsHTTPTransport
 
-from freshmaker import conf
+from freshmaker import conf, log
+from freshmaker.monitor import (
+    pyxis_gql_pool_hit_counter,
+    pyxis_gql_pool_miss_counter,
+    pyxis_gql_pool_wait_counter,
+    pyxis_gql_pool_wait_time,
+    pyxis_page_size_gauge,
+    pyxis_query_latency,
+    pyxis_query_response_size,
+)
+from freshmaker.utils import freeze, singleflight
 
 
 class PyxisGQLRequestError(Exception):
@@ -51,15 +71,85 @@ class PyxisGQLRequestTimeout(PyxisGQLRequestError):
     pass
 
 
+# Projection profiles of the image queries, each one selecting less data than the
+# next one. Callers should use the smallest profile containing the data they need.
+# Architecture and brew build/package only.
+IMAGE_PROJECTION_MINIMAL = "minimal"
+# Minimal plus the content sets, parent build, labels and repositories.
+IMAGE_PROJECTION_REPOS = "repos"
+# Repos plus the name and NVRA of every RPM, enough to compare RPM versions.
+IMAGE_PROJECTION_RPM_NAMES = "rpm-names"
+# Repos plus the complete RPM manifest, including the source RPMs.
+IMAGE_PROJECTION_FULL = "full"
+IMAGE_PROJECTIONS = (
+    IMAGE_PROJECTION_MINIMAL,
+    IMAGE_PROJECTION_REPOS,
+    IMAGE_PROJECTION_RPM_NAMES,
+    IMAGE_PROJECTION_FULL,
+)
+
+
+_timeout_retries = threading.local()
+
+
+def _retry_timeouts():
+    return getattr(_timeout_retries, "enabled", True)
+
+
+@contextmanager
+def timeout_retries(enabled):
+    """
+    Context manager enabling or disabling the retries of the Pyxis queries
+    which timed out in the current thread.
+
+    When disabled, PyxisGQLRequestTimeout is raised right away, so the
+    caller can split the query into smaller ones instead of waiting to
+    retry the same query.
+
+    :param bool enabled: whether the timed out queries are retried.
+    """
+    previous = _retry_timeouts()
+    _timeout_retries.enabled = enabled
+    try:
+        yield
+    finally:
+        _timeout_retries.enabled = previous
+
+
 class PyxisGQL:
     region = dogpile.cache.make_region().configure(conf.dogpile_cache_backend, expiration_time=1200)
 
-    def __init__(self, url, cert):
-        """Create authenticated Pyxis GraphQL session"""
+    def __init__(self, url, cert, keep_alive=False):
+        """Create authenticated Pyxis GraphQL session
+
+        :param str url: Pyxis GraphQL url.
+        :param tuple cert: client certificate and private key.
+        :param bool keep_alive: when True, the HTTP session is kept open
+            between the queries, so the TLS connection is reused. Such
+            client must not be used by multiple threads at the same time.
+        """
+        self.url = url
+        self.cert = cert
         transport = RequestsHTTPTransport(url=url, cert=cert, retries=3)
 
         # Fetch the schema from the transport using an introspection query
         self._client = Client(transport=transport, fetch_schema_from_transport=True)
+        self._keep_alive = keep_alive
+        self._session = None
+
+    def _execute(self, document):
+        """Execute a GraphQL document, reusing the session if kept alive"""
+        if not self._keep_alive:
+            return self._client.execute(document)
+        if self._session is None:
+            self._session = self._client.connect_sync()
+        return self._session.execute(document)
+
+    def close(self):
+        """Close the kept alive session, if any"""
+        if self._session is not None:
+            self._client.close_sync()
+            self._session = None
 
     @cached_property
     def dsl_schema(self):
@@ -74,7 +164,7 @@ class PyxisGQL:
                     get_ping
                 }
             """)
-        self._client.execute(query)
+        self._execute(query)
         return DSLSchema(self._client.schema)
 
     @backoff.on_exception(
@@ -83,19 +173,70 @@ class PyxisGQL:
         factor=30,
         max_tries=3,
         jitter=None,  # use deterministic backoff, do not apply random jitter
+        giveup=lambda e: not _retry_timeouts(),
     )
-    def query(self, query_dsl):
+    def query(self, query_dsl, projection=""):
         """Execute a GraphQL query with Domain Specific Language
 
         :params gql.dsl.DSLField query_dsl: a DSL query
+        :param str projection: image projection profile selected by the
+            query, if any, used in the metrics.
         :return: The result of execution.
         """
-        response = self._client.execute(dsl_gql(DSLQuery(query_dsl)))
-
         response_field_name = query_dsl.name
+        response, response_headers = self._query_document(
+            [query_dsl], response_field_name, projection
+        )
+        self._raise_for_error(response, response_field_name, response_headers)
+        return response
+
+    def query_batch(self, query_dsls, query_name):
+        """Execute several aliased GraphQL queries in one request
+
+        The queries which failed are left out of the result, so the caller
+        can send them separately, with the retries of `query`.
+
+        :params list query_dsls: DSL queries, each aliased to a different name.
+        :param str query_name: name of the batch, used in the metrics.
+        :return: results of the successful queries by their alias.
+        :rtype: dict
+        """
+        response, response_headers = self._query_document(query_dsls, query_name)
+        results = {}
+        for query_dsl in query_dsls:
+            alias = query_dsl.ast_field.alias.value
+            try:
+                self._raise_for_error(response, alias, response_headers)
+            except PyxisGQLRequestError as e:
+                log.warning("Query %s of the batch %s failed: %s", alias, query_name, e)
+                continue
+            results[alias] = response[alias]
+        return results
+
+    def _query_document(self, query_dsls, query_name, projection=""):
+        """
+        Send the `query_dsls` in one GraphQL document and record the latency
+        and the size of the response as `query_name` and `projection`, so
+        the image projection profiles can be compared.
+
+        :return: the response and its HTTP headers.
+        :rtype: tuple
+        """
+        start = time.monotonic()
+        response = self._execute(dsl_gql(DSLQuery(*query_dsls)))
+        pyxis_query_latency.labels(query_name, projection).observe(time.monotonic() - start)
+        # No headers are set when the transport did not send any HTTP request
+        response_headers = self._client.transport.response_headers or {}
+        content_length = response_headers.get("Content-Length")
+        if content_length:
+            pyxis_query_response_size.labels(query_name, projection).observe(int(content_length))
+        return response, response_headers
+
+    def _raise_for_error(self, response, response_field_name, response_headers):
+        """Raise the error of the `response_field_name` query, if any"""
         error = response[response_field_name]["error"]
         if error is not None:
-            trace_id = self._client.transport.response_headers.get("trace_id", False)
+            trace_id = response_headers.get("trace_id", False)
 
             if (
                 error["detail"]
@@ -104,11 +245,140 @@ class PyxisGQL:
                 raise PyxisGQLRequestTimeout(error=error, trace_id=trace_id)
             raise PyxisGQLRequestError(error=error, trace_id=trace_id)
 
-        return response
+    def _paginate(
+        self,
+        query_name,
+        build_query,
+        process_page=None,
+        query_type=None,
+        default_page_size=None,
+        projection="",
+    ):
+        """Fetch all the pages of a paginated query
+
+        The arguments are the same as for `_iter_pages`.
+
+        :return: data of all the pages
+        :rtype: list
+        """
+        results = []
+        for page in self._iter_pages(
+            query_name, build_query, process_page, query_type, default_page_size, projection
+        ):
+            results.extend(page)
+        return results
+
+    def _iter_pages(
+        self,
+        query_name,
+        build_query,
+        process_page=None,
+        query_type=None,
+        default_page_size=None,
+        projection="",
+    ):
+        """Fetch the pages of a paginated query and yield them as they arrive
+
+        The first page is fetched to get the total number of results, the
+        remaining pages are then fetched concurrently, at most
+        PYXIS_PAGE_FETCH_CONCURRENCY at a time, and yielded in order.
+
+        The page size is chosen by the `page_size_controller`. When the first
+        page times out, the query is restarted with a smaller page size
+        instead of being retried.
+
+        :param str query_name: name of the query, as used in the response.
+        :param callable build_query: function returning the DSL query for
+            the page number and page size passed to it.
+        :param callable process_page: optional function called with the data
+            of each page, it can modify the data in place.
+        :param str query_type: type of the query the page size is learned
+            for, `query_name` by default.
+        :param int default_page_size: page size used until a page size is
+            learned, PYXIS_DEFAULT_PAGE_SIZE by default.
+        :param str projection: image projection profile selected by the
+            query, if any, see `query`.
+        :return: generator of the non-empty data of the pages
+        :rtype: generator of lists
+        """
+        query_type = query_type or query_name
+        page_size = page_size_controller.get(
+            query_type, default_page_size or conf.pyxis_default_page_size
+        )
+        retry_timeouts = _retry_timeouts()
+
+        def _fetch_page(page_num, pyxis=self):
+            start = time.monotonic()
+            try:
+                response = pyxis.query(build_query(page_num, page_size), projection=projection)[
+                    query_name
+                ]
+            except PyxisGQLRequestTimeout:
+                page_size_controller.record_timeout(query_type, page_size)
+                raise
+            page_size_controller.record_page(
+                query_type, page_size, time.monotonic() - start, len(response["data"] or [])
+            )
+            if response["data"] and process_page:
+                process_page(response["data"])
+            return response
+
+        def _fetch_page_concurrently(page_num):
+            # PyxisGQL can't run concurrent queries, use another client
+            with pyxis_gql_client(self.url, self.cert, pool_name="pages") as pyxis:
+                with timeout_retries(retry_timeouts):
+                    return _fetch_page(page_num, pyxis)
+
+        while True:
+            can_shrink = page_size_controller.can_shrink(page_size)
+            try:
+                with timeout_retries(retry_timeouts and not can_shrink):
+                    response = _fetch_page(0)
+                break
+            except PyxisGQLRequestTimeout:
+                if not can_shrink:
+                    raise
+                # Nothing has been fetched yet, so restart with a smaller page
+                page_size = min(
+                    page_size_controller.get(query_type, page_size),
+                    page_size_controller.shrink(page_size),
+                )
+
+        if not response["data"]:
+            return
+        yield response["data"]
+        total = response.get("total")
+        # If page_size >= total, means all results have been fetched in the first page
+        if total is not None and response["page_size"] >= total:
+            return
+
+        page_num = 1
+        concurrency = conf.pyxis_page_fetch_concurrency
+        if total is not None and concurrency > 1:
+            page_nums = range(page_num, math.ceil(total / response["page_size"]))
+            if page_nums:
+                with ThreadPoolExecutor(max_workers=min(concurrency, len(page_nums))) as executor:
+                    for response in executor.map(_fetch_page_concurrently, page_nums):
+                        # Data is empty when there are no more results
+                        if not response["data"]:
+                            return
+                        yield response["data"]
+                page_num = page_nums.stop
+
+        # Fetch the pages one after another until there are no more results,
+        # this also catches the results added after the first page was fetched.
+        while len(response["data"]) >= response["page_size"]:
+            response = _fetch_page(page_num)
+            # Data is empty when there are no more results
+            if not response["data"]:
+                break
+            yield response["data"]
+            page_num += 1
 
     def _get_repo_projection(self):
         ds = self.dsl_schema
         projection = [
+            ds.ContainerRepository.registry,
             ds.ContainerRepository.release_categories,
             ds.ContainerRepository.auto_rebuild_tags,
             ds.ContainerRepository.published,
@@ -116,7 +386,16 @@ class PyxisGQL:
         ]
         return projection
 
-    def _get_image_projection(self, include_rpms=True):
+    def _get_image_projection(self, profile=IMAGE_PROJECTION_FULL):
+        """Get the fields selected by the image projection profile
+
+        :param str profile: one of the IMAGE_PROJECTIONS profiles.
+        :return: list of ContainerImage fields
+        :rtype: list
+        """
+        if profile not in IMAGE_PROJECTIONS:
+            raise ValueError(f"Unknown image projection profile: {profile}")
+
         ds = self.dsl_schema
         projection = [
             ds.ContainerImage.architecture,
@@ -124,6 +403,11 @@ class PyxisGQL:
                 ds.Brew.build,
                 ds.Brew.package,
             ),
+        ]
+        if profile == IMAGE_PROJECTION_MINIMAL:
+            return projection
+
+        projection += [
             ds.ContainerImage.content_sets,
             ds.ContainerImage.parent_brew_build,
             ds.ContainerImage.parsed_data.select(
@@ -144,18 +428,16 @@ class PyxisGQL:
 
         # Include rpm manifest data in result, use edges to get the rpm manifest
         # data because the direct rpm manifest field doesn't include all data
-        if include_rpms:
+        if profile in (IMAGE_PROJECTION_RPM_NAMES, IMAGE_PROJECTION_FULL):
+            rpm_fields = [ds.RpmsItems.name, ds.RpmsItems.nvra]
+            if profile == IMAGE_PROJECTION_FULL:
+                rpm_fields += [ds.RpmsItems.srpm_name, ds.RpmsItems.srpm_nevra]
             projection.append(
                 ds.ContainerImage.edges.select(
                     ds.ContainerImageEdges.rpm_manifest.select(
                         ds.ContainerImageRPMManifestResponse.data.select(
                             ds.ContainerImageRPMManifest.image_id,
-                            ds.ContainerImageRPMManifest.rpms.select(
-                                ds.RpmsItems.name,
-                                ds.RpmsItems.nvra,
-                                ds.RpmsItems.srpm_name,
-                                ds.RpmsItems.srpm_nevra,
-                            ),
+                            ds.ContainerImageRPMManifest.rpms.select(*rpm_fields),
                         ),
                     ),
                 )
@@ -163,6 +445,34 @@ class PyxisGQL:
 
         return projection
 
+    def _find_repositories_by_filter(self, query_filter):
+        """Get all image repositories matching the query filter
+
+        :param dict query_filter: find_repositories query filter
+        :return: list of image repositories
+        :rtype: list
+        """
+        ds = self.dsl_schema
+
+        def _build_query(page_num, page_size):
+            return ds.Query.find_repositories(
+                page=page_num,
+                page_size=page_size,
+                filter=query_filter,
+            ).select(
+                ds.ContainerRepositoryPaginatedResponse.error.select(
+                    ds.ResponseError.status,
+                    ds.ResponseError.detail,
+                ),
+                ds.ContainerRepositoryPaginatedResponse.page,
+                ds.ContainerRepositoryPaginatedResponse.page_size,
+                ds.ContainerRepositoryPaginatedResponse.total,
+                ds.ContainerRepositoryPaginatedResponse.data.select(*self._get_repo_projection()),
+            )
+
+        return self._paginate("find_repositories", _build_query)
+
+    @singleflight(instance_key=lambda self: self.url)
     @region.cache_on_arguments()
     def find_repositories(
         self,
@@ -196,41 +506,9 @@ class PyxisGQL:
         if names:
             query_filter["and"].append({"repository": {"in": names}})
 
-        repositories = []
-        ds = self.dsl_schema
-
-        page_num = 0
-        # Iterate all pages
-        while True:
-            query_dsl = ds.Query.find_repositories(
-                page=page_num,
-                page_size=conf.pyxis_default_page_size,
-                filter=query_filter,
-            ).select(
-                ds.ContainerRepositoryPaginatedResponse.error.select(
-                    ds.ResponseError.status,
-                    ds.ResponseError.detail,
-                ),
-                ds.ContainerRepositoryPaginatedResponse.page,
-                ds.ContainerRepositoryPaginatedResponse.page_size,
-                ds.ContainerRepositoryPaginatedResponse.total,
-                ds.ContainerRepositoryPaginatedResponse.data.select(*self._get_repo_projection()),
-            )
-
-            result = self.query(query_dsl)
-            data = result["find_repositories"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-
-            repositories.extend(data)
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_repositories"]["page_size"] >= result["find_repositories"]["total"]:
-                break
-            page_num += 1
-
-        return repositories
+        return self._find_repositories_by_filter(query_filter)
 
+    @singleflight(instance_key=lambda self: self.url)
     @region.cache_on_arguments()
     def find_repositories_by_repository_name(self, repository: str) -> list:
         """Get image repositories by repository name
@@ -246,41 +524,9 @@ class PyxisGQL:
         # Query Red Hat repositories only
         query_filter["and"].append({"vendor_label": {"eq": "redhat"}})
 
-        repositories = []
-        ds = self.dsl_schema
-
-        page_num = 0
-        # Iterate all pages
-        while True:
-            query_dsl = ds.Query.find_repositories(
-                page=page_num,
-                page_size=conf.pyxis_default_page_size,
-                filter=query_filter,
-            ).select(
-                ds.ContainerRepositoryPaginatedResponse.error.select(
-                    ds.ResponseError.status,
-                    ds.ResponseError.detail,
-                ),
-                ds.ContainerRepositoryPaginatedResponse.page,
-                ds.ContainerRepositoryPaginatedResponse.page_size,
-                ds.ContainerRepositoryPaginatedResponse.total,
-                ds.ContainerRepositoryPaginatedResponse.data.select(*self._get_repo_projection()),
-            )
-
-            result = self.query(query_dsl)
-            data = result["find_repositories"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-
-            repositories.extend(data)
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_repositories"]["page_size"] >= result["find_repositories"]["total"]:
-                break
-            page_num += 1
-
-        return repositories
+        return self._find_repositories_by_filter(query_filter)
 
+    @singleflight(instance_key=lambda self: self.url)
     @region.cache_on_arguments()
     def find_repositories_by_registry_paths(self, registry_paths):
         """Get image repositories by registry paths
@@ -303,41 +549,9 @@ class PyxisGQL:
                 }
             )
 
-        repositories = []
-        ds = self.dsl_schema
-
-        page_num = 0
-        # Iterate all pages
-        while True:
-            query_dsl = ds.Query.find_repositories(
-                page=page_num,
-                page_size=conf.pyxis_default_page_size,
-                filter=query_filter,
-            ).select(
-                ds.ContainerRepositoryPaginatedResponse.error.select(
-                    ds.ResponseError.status,
-                    ds.ResponseError.detail,
-                ),
-                ds.ContainerRepositoryPaginatedResponse.page,
-                ds.ContainerRepositoryPaginatedResponse.page_size,
-                ds.ContainerRepositoryPaginatedResponse.total,
-                ds.ContainerRepositoryPaginatedResponse.data.select(*self._get_repo_projection()),
-            )
-
-            result = self.query(query_dsl)
-            data = result["find_repositories"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-
-            repositories.extend(data)
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_repositories"]["page_size"] >= result["find_repositories"]["total"]:
-                break
-            page_num += 1
-
-        return repositories
+        return self._find_repositories_by_filter(query_filter)
 
+    @singleflight(instance_key=lambda self: self.url)
     @region.cache_on_arguments()
     def get_repository_by_registry_path(self, registry, repository):
         """Get image repository by registry path
@@ -363,60 +577,50 @@ class PyxisGQL:
         result = self.query(query_dsl)
         return result["get_repository_by_registry_path"]["data"]
 
+    @singleflight(instance_key=lambda self: self.url)
     @region.cache_on_arguments()
-    def find_images_by_nvr(self, nvr: str, include_rpms: bool = True):
-        ds = self.dsl_schema
-
-        images = []
-        page_num = 0
-
-        # Iterate all pages
-        while True:
-            query_dsl = ds.Query.find_images_by_nvr(
-                page=page_num,
-                page_size=conf.pyxis_default_page_size,
-                nvr=nvr,
-            ).select(
-                ds.ContainerImagePaginatedResponse.error.select(
-                    ds.ResponseError.status,
-                    ds.ResponseError.detail,
-                ),
-                ds.ContainerImagePaginatedResponse.page,
-                ds.ContainerImagePaginatedResponse.page_size,
-                ds.ContainerImagePaginatedResponse.total,
-                ds.ContainerImagePaginatedResponse.data.select(
-                    *self._get_image_projection(include_rpms=include_rpms)
-                ),
+    def find_images_by_nvr(self, nvr: str, projection: str = IMAGE_PROJECTION_FULL):
+        if conf.pyxis_nvr_batching:
+            images = get_pyxis_nvr_batcher(self.url, self.cert).find_images_by_nvr(
+                self, nvr, projection
             )
+            if images is not None:
+                return freeze(images)
 
-            result = self.query(query_dsl)
-            data = result["find_images_by_nvr"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
+        def _build_query(page_num, page_size):
+            return self._find_images_by_nvr_query(nvr, page_num, page_size, projection)
 
-            images.extend(data)
-
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_images_by_nvr"]["page_size"] >= result["find_images_by_nvr"]["total"]:
-                break
-            page_num += 1
+        # The result is shared with the cache, freeze it so it cannot be
+        # modified by the callers.
+        return freeze(self._paginate("find_images_by_nvr", _build_query, projection=projection))
 
-        return images
+    def _find_images_by_nvr_query(self, nvr, page_num, page_size, projection=IMAGE_PROJECTION_FULL):
+        ds = self.dsl_schema
+        return ds.Query.find_images_by_nvr(
+            page=page_num,
+            page_size=page_size,
+            nvr=nvr,
+        ).select(
+            ds.ContainerImagePaginatedResponse.error.select(
+                ds.ResponseError.status,
+                ds.ResponseError.detail,
+            ),
+            ds.ContainerImagePaginatedResponse.page,
+            ds.ContainerImagePaginatedResponse.page_size,
+            ds.ContainerImagePaginatedResponse.total,
+            ds.ContainerImagePaginatedResponse.data.select(*self._get_image_projection(projection)),
+        )
 
+    @singleflight(instance_key=lambda self: self.url)
     @region.cache_on_arguments()
-    def find_images_by_nvrs(self, nvrs, include_rpms=True):
+    def find_images_by_nvrs(self, nvrs, projection=IMAGE_PROJECTION_FULL):
         ds = self.dsl_schema
+        query_filter = {"brew": {"build": {"in": nvrs}}}
 
-        images = []
-        page_num = 0
-
-        # Iterate all pages
-        while True:
-            query_filter = {"brew": {"build": {"in": nvrs}}}
-            query_dsl = ds.Query.find_images(
+        def _build_query(page_num, page_size):
+            return ds.Query.find_images(
                 page=page_num,
-                page_size=conf.pyxis_default_page_size,
+                page_size=page_size,
                 filter=query_filter,
             ).select(
                 ds.ContainerImagePaginatedResponse.error.select(
@@ -427,25 +631,17 @@ class PyxisGQL:
                 ds.ContainerImagePaginatedResponse.page_size,
                 ds.ContainerImagePaginatedResponse.total,
                 ds.ContainerImagePaginatedResponse.data.select(
-                    *self._get_image_projection(include_rpms=include_rpms)
+                    *self._get_image_projection(projection)
                 ),
             )
 
-            result = self.query(query_dsl)
-            data = result["find_images"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-
-            images.extend(data)
-
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_images"]["page_size"] >= result["find_images"]["total"]:
-                break
-            page_num += 1
-
-        return images
+        return freeze(
+            self._paginate(
+                "find_images", _build_query, query_type="find_images_by_nvrs", projection=projection
+            )
+        )
 
+    @singleflight(instance_key=lambda self: self.url)
     def find_images_by_installed_rpms(
         self, rpm_names, content_sets=None, repositories=None, published=None, tags=None
     ):
@@ -459,8 +655,50 @@ class PyxisGQL:
         :return: List of image data
         :rtype: list
         """
-        images = []
+        results = []
+        for page in self._iter_images_by_installed_rpms(
+            rpm_names, content_sets, repositories, published, tags
+        ):
+            results.extend(page)
+        return results
+
+    def iter_images_by_installed_rpms(
+        self, rpm_names, content_sets=None, repositories=None, published=None, tags=None
+    ):
+        """Find images which have the provided rpms installed and yield the
+        pages of the results as they arrive
 
+        The images are sorted by NVR, so all the architectures of the same
+        image NVR follow each other, but they can be split between two pages.
+        The images with the same NVR are sorted by their unique _id, so the
+        order is stable between the pages.
+
+        :param list rpm_names: List of rpm names
+        :param list content_sets: List of content sets
+        :param list repositories: List of repository paths
+        :param bool published: The published attribution of image
+        :param list tags: List of image tags
+        :return: generator of the lists of image data in a page
+        :rtype: generator of lists
+        """
+        return self._iter_images_by_installed_rpms(
+            rpm_names,
+            content_sets,
+            repositories,
+            published,
+            tags,
+            sort_by=[{"field": "brew.build", "order": "ASC"}, {"field": "_id", "order": "ASC"}],
+        )
+
+    def _iter_images_by_installed_rpms(
+        self,
+        rpm_names,
+        content_sets=None,
+        repositories=None,
+        published=None,
+        tags=None,
+        sort_by=None,
+    ):
         query_filter = {}
         query_filter["and"] = []
 
@@ -482,17 +720,17 @@ class PyxisGQL:
         query_filter["and"].append({"rpm_manifest": {"rpms": {"name": {"in": rpm_names}}}})
 
         ds = self.dsl_schema
-        page_num = 0
 
         # This query is resource consuming and Pyxis may not be able to handle it in a time
         # manner when the page_size is large, use the configured small page size to avoid errors.
+        sort_args = {"sort_by": sort_by} if sort_by else {}
 
-        # Iterate all pages
-        while True:
-            query_dsl = ds.Query.find_images(
+        def _build_query(page_num, page_size):
+            return ds.Query.find_images(
                 page=page_num,
-                page_size=conf.pyxis_small_page_size,
+                page_size=page_size,
                 filter=query_filter,
+                **sort_args,
             ).select(
                 ds.ContainerImagePaginatedResponse.error.select(
                     ds.ResponseError.status,
@@ -500,30 +738,28 @@ class PyxisGQL:
                 ),
                 ds.ContainerImagePaginatedResponse.page,
                 ds.ContainerImagePaginatedResponse.page_size,
+                ds.ContainerImagePaginatedResponse.total,
                 ds.ContainerImagePaginatedResponse.data.select(*self._get_image_projection()),
             )
 
-            result = self.query(query_dsl)
-            data = result["find_images"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-
+        def _filter_rpms(data):
             # Only keep the rpms we care about, the large rpm manifest data can impact performance
             for img in data:
                 rpms = img["edges"]["rpm_manifest"]["data"]["rpms"]
                 img["edges"]["rpm_manifest"]["data"]["rpms"] = [
                     rpm for rpm in rpms if rpm["name"] in rpm_names
                 ]
-            images.extend(data)
 
-            # This page has less items than the page size, it's the last page
-            if len(data) < result["find_images"]["page_size"]:
-                break
-            page_num += 1
-
-        return images
+        return self._iter_pages(
+            "find_images",
+            _build_query,
+            process_page=_filter_rpms,
+            query_type="find_images_by_installed_rpms",
+            default_page_size=conf.pyxis_small_page_size,
+            projection=IMAGE_PROJECTION_FULL,
+        )
 
+    @singleflight(instance_key=lambda self: self.url)
     def find_images_by_names(self, names):
         """Find all the images for a specific list of names.
 
@@ -531,7 +767,6 @@ class PyxisGQL:
         :return: list of container images matching the requested names.
         :rtype: list of ContainerImages
         """
-        images = []
         query_filter = {"and": []}
         query_filter["and"].append({"brew": {"package": {"in": names}}})
         # Only query for published images
@@ -540,12 +775,11 @@ class PyxisGQL:
         )
 
         ds = self.dsl_schema
-        page_num = 0
 
-        while True:
-            query_dsl = ds.Query.find_images(
+        def _build_query(page_num, page_size):
+            return ds.Query.find_images(
                 page=page_num,
-                page_size=conf.pyxis_default_page_size,
+                page_size=page_size,
                 filter=query_filter,
             ).select(
                 ds.ContainerImagePaginatedResponse.error.select(
@@ -556,24 +790,18 @@ class PyxisGQL:
                 ds.ContainerImagePaginatedResponse.page_size,
                 ds.ContainerImagePaginatedResponse.total,
                 ds.ContainerImagePaginatedResponse.data.select(
-                    *self._get_image_projection(include_rpms=False)
+                    *self._get_image_projection(IMAGE_PROJECTION_REPOS)
                 ),
             )
 
-            result = self.query(query_dsl)
-            data = result["find_images"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-            images.extend(data)
-
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_images"]["page_size"] >= result["find_images"]["total"]:
-                break
-            page_num += 1
-
-        return images
+        return self._paginate(
+            "find_images",
+            _build_query,
+            query_type="find_images_by_names",
+            projection=IMAGE_PROJECTION_REPOS,
+        )
 
+    @singleflight(instance_key=lambda self: self.url)
     def find_images_by_repository(
         self, repository: str, auto_rebuild_tags: Optional[list[str]] = None
     ) -> list:
@@ -583,8 +811,6 @@ class PyxisGQL:
         :return: List of image data
         :rtype: list
         """
-        images = []
-
         query_filter: dict = {}
         query_filter["and"] = []
 
@@ -596,13 +822,11 @@ class PyxisGQL:
             )
 
         ds = self.dsl_schema
-        page_num = 0
 
-        # Iterate all pages
-        while True:
-            query_dsl = ds.Query.find_images(
+        def _build_query(page_num, page_size):
+            return ds.Query.find_images(
                 page=page_num,
-                page_size=conf.pyxis_default_page_size,
+                page_size=page_size,
                 filter=query_filter,
             ).select(
                 ds.ContainerImagePaginatedResponse.error.select(
@@ -613,26 +837,26 @@ class PyxisGQL:
                 ds.ContainerImagePaginatedResponse.page_size,
                 ds.ContainerImagePaginatedResponse.total,
                 ds.ContainerImagePaginatedResponse.data.select(
-                    *self._get_image_projection(include_rpms=False)
+                    *self._get_image_projection(IMAGE_PROJECTION_REPOS)
                 ),
             )
 
-            result = self.query(query_dsl)
-            data = result["find_images"]["data"]
-            # Data is empty when there are no more results
-            if not data:
-                break
-
-            images.extend(data)
-
-            # If page_size >= total, means all results have been fetched in the first page
-            if result["find_images"]["page_size"] >= result["find_images"]["total"]:
-                break
-            page_num += 1
-
-        return images
+        return self._paginate(
+            "find_images",
+            _build_query,
+            query_type="find_images_by_repository",
+            projection=IMAGE_PROJECTION_REPOS,
+        )
 
-    def find_latest_images_by_name_version(self, name, version, published=None, content_sets=None):
+    @singleflight(instance_key=lambda self: self.url)
+    def find_latest_images_by_name_version(
+        self,
+        name,
+        version,
+        published=None,
+        content_sets=None,
+        projection=IMAGE_PROJECTION_FULL,
+    ):
         """
         Find the latest images that match the specified name, version, and are filtered by the given content sets.
 
@@ -673,10 +897,10 @@ class PyxisGQL:
             ds.ContainerImagePaginatedResponse.page,
             ds.ContainerImagePaginatedResponse.page_size,
             ds.ContainerImagePaginatedResponse.total,
-            ds.ContainerImagePaginatedResponse.data.select(*self._get_image_projection()),
+            ds.ContainerImagePaginatedResponse.data.select(*self._get_image_projection(projection)),
         )
 
-        images = self.query(query_dsl)["find_images"]["data"]
+        images = self.query(query_dsl, projection=projection)["find_images"]["data"]
         if not images:
             return []
 
@@ -691,3 +915,701 @@ class PyxisGQL:
                 latest_nvr = current_nvr
 
         return [img for img in images if img["brew"]["build"] == latest_nvr]
+
+    def iter_images_for_rpm_index(self, updated_after=None, last_id=None):
+        """Yield the pages of images indexed by their installed RPMs
+
+        Without `updated_after`, all the published images are returned.
+        Otherwise all the images updated since this date are returned,
+        including the unpublished ones, so the index learns about them too.
+
+        The images are sorted by their last update date and _id, and the
+        pages are fetched by a cursor on these fields instead of the page
+        number, so no image is skipped when the images are updated during
+        the sync. The images updated meanwhile are returned again, with their
+        new data.
+
+        :param str updated_after: ISO 8601 date of the last update.
+        :param str last_id: _id of the last image updated at `updated_after`
+            returned before, the images updated at the same time with lower
+            or the same _id are skipped.
+        :return: generator of the lists of image data in a page
+        :rtype: generator of lists
+        """
+        if updated_after:
+            base_filter = {"last_update_date": {"ge": updated_after}}
+        else:
+            base_filter = {"repositories_elemMatch": {"and": [{"published": {"eq": True}}]}}
+
+        ds = self.dsl_schema
+        query_type = "find_images_for_rpm_index"
+        page_size = page_size_controller.get(query_type, conf.pyxis_small_page_size)
+        cursor = (updated_after, last_id) if updated_after and last_id else None
+        # _ids of the images returned with the last update date of the cursor,
+        # the "ge" filter returns them again.
+        cursor_ids = {last_id} if cursor else set()
+
+        while True:
+            query_filter = base_filter
+            if cursor:
+                last_update_date, image_id = cursor
+                query_filter = {
+                    "and": [
+                        base_filter,
+                        {
+                            "or": [
+                                {"last_update_date": {"gt": last_update_date}},
+                                {
+                                    "and": [
+                                        {"last_update_date": {"ge": last_update_date}},
+                                        {"_id": {"gt": image_id}},
+                                    ]
+                                },
+                            ]
+                        },
+                    ]
+                }
+            query_dsl = ds.Query.find_images(
+                page=0,
+                page_size=page_size,
+                filter=query_filter,
+                sort_by=[
+                    {"field": "last_update_date", "order": "ASC"},
+                    {"field": "_id", "order": "ASC"},
+                ],
+            ).select(
+                ds.ContainerImagePaginatedResponse.error.select(
+                    ds.ResponseError.status,
+                    ds.ResponseError.detail,
+                ),
+                ds.ContainerImagePaginatedResponse.page,
+                ds.ContainerImagePaginatedResponse.page_size,
+                ds.ContainerImagePaginatedResponse.total,
+                ds.ContainerImagePaginatedResponse.data.select(
+                    ds.ContainerImage._id,
+                    ds.ContainerImage.last_update_date,
+                    *self._get_image_projection(IMAGE_PROJECTION_RPM_NAMES),
+                ),
+            )
+
+            start = time.monotonic()
+            can_shrink = page_size_controller.can_shrink(page_size)
+            try:
+                with timeout_retries(_retry_timeouts() and not can_shrink):
+                    data = (
+                        self.query(query_dsl, projection=IMAGE_PROJECTION_RPM_NAMES)["find_images"][
+                            "data"
+                        ]
+                        or []
+                    )
+            except PyxisGQLRequestTimeout:
+                if not can_shrink:
+                    raise
+                page_size_controller.record_timeout(query_type, page_size)
+                page_size = page_size_controller.shrink(page_size)
+                continue
+            page_size_controller.record_page(
+                query_type, page_size, time.monotonic() - start, len(data)
+            )
+
+            page = [
+                image
+                for image in data
+                if not (
+                    cursor and image["last_update_date"] == cursor[0] and image["_id"] in cursor_ids
+                )
+            ]
+            if page:
+                yield page
+            if len(data) < page_size:
+                return
+
+            last = data[-1]
+            if not cursor or last["last_update_date"] != cursor[0]:
+                cursor_ids = set()
+            cursor_ids.update(
+                image["_id"]
+                for image in data
+                if image["last_update_date"] == last["last_update_date"]
+            )
+            cursor = (last["last_update_date"], last["_id"])
+            page_size = page_size_controller.get(query_type, page_size)
+
+
+class PyxisGQLPool:
+    """
+    Thread-safe pool of keep-alive PyxisGQL clients.
+
+    The clients are created lazily, up to `size` of them. When all the
+    clients are in use, the caller waits until one of them is returned.
+    """
+
+    def __init__(self, url, cert, size):
+        """
+        :param str url: Pyxis GraphQL url.
+        :param tuple cert: client certificate and private key.
+        :param int size: maximum number of clients in the pool.
+        """
+        self.url = url
+        self.cert = cert
+        self.size = size
+        self._clients = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _get(self):
+        try:
+            client = self._clients.get_nowait()
+            pyxis_gql_pool_hit_counter.inc()
+            return client
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            pyxis_gql_pool_miss_counter.inc()
+            try:
+                return PyxisGQL(url=self.url, cert=self.cert, keep_alive=True)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        pyxis_gql_pool_wait_counter.inc()
+        start = time.monotonic()
+        client = self._clients.get()
+        pyxis_gql_pool_wait_time.observe(time.monotonic() - start)
+        return client
+
+    @contextmanager
+    def client(self):
+        """Context manager borrowing a PyxisGQL client from the pool"""
+        client = self._get()
+        try:
+            yield client
+        finally:
+            self._clients.put(client)
+
+    def close(self):
+        """Close all the idle clients in the pool"""
+        while True:
+            try:
+                client = self._clients.get_nowait()
+            except queue.Empty:
+                return
+            client.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools: dict[tuple, PyxisGQLPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pyxis_gql_pool(url, cert, pool_name="default"):
+    """
+    Returns the process-wide PyxisGQLPool for the `url` and `cert`.
+
+    The size of the "default" pool is PYXIS_GQL_POOL_SIZE, or
+    MAX_THREAD_WORKERS when it is not set. The "pages" pool, used to fetch
+    the pages of paginated queries concurrently, is
+    PYXIS_PAGE_FETCH_CONCURRENCY times larger.
+
+    :param str url: Pyxis GraphQL url.
+    :param tuple cert: client certificate and private key.
+    :param str pool_name: name of the pool, "default" or "pages".
+    :rtype: PyxisGQLPool
+    """
+    key = (url, cert, pool_name)
+    with _pools_lock:
+        if key not in _pools:
+            size = conf.pyxis_gql_pool_size or conf.max_thread_workers
+            if pool_name == "pages":
+                size *= conf.pyxis_page_fetch_concurrency
+            _pools[key] = PyxisGQLPool(url, cert, size)
+        return _pools[key]
+
+
+@contextmanager
+def pyxis_gql_client(url, cert, pool_name="default"):
+    """
+    Context manager providing a PyxisGQL client for the current thread.
+
+    When PYXIS_GQL_POOL_ENABLED is True, the client is borrowed from the
+    process-wide pool, otherwise a new client is created.
+
+    :param str url: Pyxis GraphQL url.
+    :param tuple cert: client certificate and private key.
+    :param str pool_name: name of the pool to borrow the client from.
+    """
+    if not conf.pyxis_gql_pool_enabled:
+        yield PyxisGQL(url=url, cert=cert)
+        return
+    with get_pyxis_gql_pool(url, cert, pool_name).client() as client:
+        yield client
+
+
+class _NVRBatch:
+    def __init__(self):
+        # Dict used as an ordered set of the (nvr, projection) lookups
+        self.lookups = {}
+        self.results = {}
+        self.sent = False
+        self.done = threading.Event()
+
+
+class PyxisNVRBatcher:
+    """
+    Batches the concurrent `PyxisGQL.find_images_by_nvr` lookups.
+
+    A lookup is sent to Pyxis right away when no batch is in flight, so the
+    lookups done one after another are not delayed. The lookups done while
+    a batch is in flight are collected and sent as the next batch once the
+    batch in flight is done, once there are PYXIS_NVR_BATCH_SIZE of them,
+    or after PYXIS_NVR_BATCH_WINDOW milliseconds. The batch is sent as one
+    GraphQL document with an aliased find_images_by_nvr root field per NVR,
+    by the thread which sends it, using its own PyxisGQL client. The other
+    threads wait for their results.
+    """
+
+    def __init__(self):
+        self._batch = None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def find_images_by_nvr(self, pyxis, nvr, projection=IMAGE_PROJECTION_FULL):
+        """
+        Returns the first page of the images with the `nvr`.
+
+        :param PyxisGQL pyxis: client used to send the batch when this
+            lookup sends it.
+        :param str nvr: image NVR.
+        :param str projection: image projection profile, see IMAGE_PROJECTIONS.
+        :return: image data, or None when the images must be queried
+            separately, because there are more pages of them or the batch
+            query failed.
+        :rtype: list or None
+        """
+        lookup = (nvr, projection)
+        deadline = time.monotonic() + conf.pyxis_nvr_batch_window / 1000
+        with self._cond:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _NVRBatch()
+            batch.lookups[lookup] = None
+            while (
+                not batch.sent
+                and self._in_flight
+                and len(batch.lookups) < conf.pyxis_nvr_batch_size
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    break
+            sender = not batch.sent
+            if sender:
+                # The next lookups start a new batch
+                batch.sent = True
+                self._batch = None
+                self._in_flight += 1
+
+        if not sender:
+            batch.done.wait()
+            return batch.results.get(lookup)
+
+        try:
+            self._send(pyxis, batch)
+        finally:
+            batch.done.set()
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+        return batch.results.get(lookup)
+
+    def _send(self, pyxis, batch):
+        lookups = list(batch.lookups)
+        page_size = page_size_controller.get("find_images_by_nvr", conf.pyxis_default_page_size)
+        fields = [
+            pyxis._find_images_by_nvr_query(nvr, 0, page_size, projection).alias(f"nvr{i}")
+            for i, (nvr, projection) in enumerate(lookups)
+        ]
+        try:
+            response = pyxis.query_batch(fields, "find_images_by_nvr_batch")
+        except Exception as e:
+            log.warning(
+                "Batched query for %d NVRs failed, querying them separately: %s",
+                len(lookups),
+                e,
+            )
+            return
+
+        for i, lookup in enumerate(lookups):
+            result = response.get(f"nvr{i}")
+            if result is None:
+                continue
+            total = result.get("total")
+            if total is None or total > result["page_size"]:
+                continue
+            batch.results[lookup] = result["data"] or []
+
+
+_nvr_batchers: dict[tuple, PyxisNVRBatcher] = {}
+
+
+def get_pyxis_nvr_batcher(url, cert):
+    """
+    Returns the process-wide PyxisNVRBatcher for the `url` and `cert`.
+
+    :param str url: Pyxis GraphQL url.
+    :param tuple cert: client certificate and private key.
+    :rtype: PyxisNVRBatcher
+    """
+    key = (url, cert)
+    with _pools_lock:
+        if key not in _nvr_batchers:
+            _nvr_batchers[key] = PyxisNVRBatcher()
+        return _nvr_batchers[key]
+
+
+class PyxisPageSizeController:
+    """
+    Learns the page size of each type of paginated Pyxis query when
+    PYXIS_ADAPTIVE_PAGE_SIZE is enabled.
+
+    The page size is halved when a page times out and grows by a quarter
+    when a full page is returned faster than PYXIS_PAGE_SIZE_TARGET_LATENCY,
+    within PYXIS_MIN_PAGE_SIZE and PYXIS_MAX_PAGE_SIZE. The learned page
+    sizes are stored in the `state_file`, so they survive restarts, and
+    exported as the "pyxis_page_size" gauge.
+    """
+
+    def __init__(self, state_file=None):
+        """
+        :param str state_file: path to the JSON file storing the learned
+            page sizes, they are not stored when not set.
+        """
+        self.state_file = state_file
+        self._page_sizes = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def enabled(self):
+        return conf.pyxis_adaptive_page_size
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as f:
+                page_sizes = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Cannot load the Pyxis page sizes from %s: %s", self.state_file, e)
+            return
+        for query_type, page_size in page_sizes.items():
+            self._set(query_type, int(page_size))
+
+    def _save(self):
+        """Stores the learned page sizes, must be called with the lock held"""
+        if not self.state_file:
+            return
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(self._page_sizes, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            log.warning("Cannot store the Pyxis page sizes to %s: %s", self.state_file, e)
+
+    def _set(self, query_type, page_size):
+        self._page_sizes[query_type] = page_size
+        pyxis_page_size_gauge.labels(query_type).set(page_size)
+
+    def get(self, query_type, default):
+        """
+        Returns the page size to use for the `query_type`.
+
+        :param str query_type: type of the query.
+        :param int default: page size used when none has been learned yet,
+            or when PYXIS_ADAPTIVE_PAGE_SIZE is disabled.
+        :rtype: int
+        """
+        if not self.enabled:
+            return default
+        with self._lock:
+            return self._page_sizes.get(query_type, default)
+
+    def can_shrink(self, page_size):
+        """Returns True if the page size can be shrunk after a timeout"""
+        return bool(self.enabled) and page_size > conf.pyxis_min_page_size
+
+    def shrink(self, page_size):
+        """Returns the page size to use after the `page_size` timed out"""
+        return max(conf.pyxis_min_page_size, page_size // 2)
+
+    def record_page(self, query_type, page_size, latency, count):
+        """
+        Records the page of the `query_type` fetched with the `page_size`,
+        growing the page size when the page was full and fetched fast.
+
+        :param str query_type: type of the query.
+        :param int page_size: page size the page was fetched with.
+        :param float latency: number of seconds it took to fetch the page.
+        :param int count: number of results in the page.
+        """
+        if not self.enabled or count < page_size:
+            return
+        if latency >= conf.pyxis_page_size_target_latency:
+            return
+        new_page_size = min(conf.pyxis_max_page_size, max(page_size + 1, page_size * 5 // 4))
+        with self._lock:
+            # The page size has already been changed by another page
+            if self._page_sizes.get(query_type, page_size) != page_size:
+                return
+            if new_page_size > page_size:
+                self._set(query_type, new_page_size)
+                self._save()
+
+    def record_timeout(self, query_type, page_size):
+        """
+        Records the timeout of the page of the `query_type` fetched with
+        the `page_size`, shrinking the page size.
+
+        :param str query_type: type of the query.
+        :param int page_size: page size the page was fetched with.
+        """
+        if not self.enabled:
+            return
+        new_page_size = self.shrink(page_size)
+        with self._lock:
+            # Other pages fetched concurrently with the same page size can
+            # time out too, shrink the page size only once for them.
+            if self._page_sizes.get(query_type, page_size) < page_size:
+                return
+            if new_page_size < page_size:
+                log.info(
+                    "Pyxis query %s timed out, shrinking its page size to %d.",
+                    query_type,
+                    new_page_size,
+                )
+                self._set(query_type, new_page_size)
+                self._save()
+
+
+page_size_controller = PyxisPageSizeController(conf.pyxis_page_size_state_file)
+
+
+class PyxisRepositoryCatalog:
+    """
+    Local catalog of the Red Hat container repositories in Pyxis.
+
+    The catalog is stored in a JSON file shared by all the Freshmaker
+    processes on the host and refreshed by a background thread every
+    REPOSITORY_CATALOG_REFRESH_INTERVAL seconds, so the repository lookups
+    don't query Pyxis. Only one process refreshes the file at a time, the
+    other ones reload it once it changes.
+
+    The lookups return None when the catalog has not been fetched yet or is
+    older than REPOSITORY_CATALOG_MAX_AGE, the callers then query Pyxis.
+    """
+
+    def __init__(self, url, cert, catalog_file):
+        self.url = url
+        self.cert = cert
+        self.catalog_file = catalog_file
+        self._lock = threading.Lock()
+        self._repositories = None
+        self._refreshed_at = 0
+        self._mtime = None
+        self._refresher_pid = None
+
+    def _start_refresher(self):
+        """Starts the background refresh thread in this process, if not started yet"""
+        # Threads don't survive fork, every process needs its own thread
+        if self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        thread = threading.Thread(
+            target=self._refresh_loop, name="pyxis-repository-catalog", daemon=True
+        )
+        thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh_if_stale()
+            except Exception:
+                log.exception("Cannot refresh the repository catalog %s", self.catalog_file)
+            time.sleep(min(conf.repository_catalog_refresh_interval, 60))
+
+    def _load(self):
+        """Loads the catalog file when it changed since it was last loaded"""
+        try:
+            mtime = os.stat(self.catalog_file).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.catalog_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Cannot load the repository catalog %s: %s", self.catalog_file, e)
+            return
+        with self._lock:
+            self._repositories = freeze(data["repositories"])
+            self._refreshed_at = data["refreshed_at"]
+            self._mtime = mtime
+
+    def _is_stale(self):
+        return time.time() - self._refreshed_at >= conf.repository_catalog_refresh_interval
+
+    def refresh_if_stale(self):
+        """
+        Refreshes the catalog when it is older than
+        REPOSITORY_CATALOG_REFRESH_INTERVAL and no other process is
+        refreshing it.
+        """
+        self._load()
+        if not self._is_stale():
+            return
+        with open(f"{self.catalog_file}.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is refreshing the catalog
+                return
+            # The catalog may have been refreshed before the lock was acquired
+            self._load()
+            if self._is_stale():
+                self.refresh()
+
+    def refresh(self):
+        """Fetches all the Red Hat repositories from Pyxis and stores them"""
+        log.info("Refreshing the repository catalog %s", self.catalog_file)
+        pyxis = PyxisGQL(url=self.url, cert=self.cert)
+        repositories = pyxis._find_repositories_by_filter({"vendor_label": {"eq": "redhat"}})
+        data = {"refreshed_at": time.time(), "repositories": repositories}
+        tmp_file = f"{self.catalog_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.catalog_file)
+        self._load()
+
+    def _get_repositories(self):
+        self._start_refresher()
+        self._load()
+        if self._repositories is None:
+            return None
+        if time.time() - self._refreshed_at > conf.repository_catalog_max_age:
+            log.warning("The repository catalog %s is outdated", self.catalog_file)
+            return None
+        return self._repositories
+
+    def find_repositories(
+        self, published=None, release_categories=None, auto_rebuild_tags=None, names=None
+    ):
+        """
+        Returns the repositories, as `PyxisGQL.find_repositories` does.
+
+        :rtype: list or None
+        """
+        repositories = self._get_repositories()
+        if repositories is None:
+            return None
+        if isinstance(published, bool):
+            repositories = [r for r in repositories if r["published"] == published]
+        if release_categories:
+            repositories = [
+                r
+                for r in repositories
+                if not set(r["release_categories"] or []).isdisjoint(release_categories)
+            ]
+        if auto_rebuild_tags:
+            repositories = [
+                r
+                for r in repositories
+                if not set(r["auto_rebuild_tags"] or []).isdisjoint(auto_rebuild_tags)
+            ]
+        if names:
+            repositories = [r for r in repositories if r["repository"] in names]
+        return list(repositories)
+
+    def find_repositories_by_repository_name(self, repository):
+        """
+        Returns the repositories named `repository`, as
+        `PyxisGQL.find_repositories_by_repository_name` does.
+
+        :rtype: list or None
+        """
+        return self.find_repositories(names=[repository])
+
+    def find_repositories_by_registry_paths(self, registry_paths):
+        """
+        Returns the repositories with the `registry_paths`, as
+        `PyxisGQL.find_repositories_by_registry_paths` does.
+
+        :rtype: list or None
+        """
+        repositories = self._get_repositories()
+        if repositories is None:
+            return None
+        paths = {(path["registry"], path["repository"]) for path in registry_paths}
+        found = [r for r in repositories if (r["registry"], r["repository"]) in paths]
+        # Only the Red Hat repositories are in the catalog, let the caller
+        # query Pyxis for the other ones.
+        if len(found) < len(paths):
+            return None
+        return found
+
+    def get_repository_by_registry_path(self, registry, repository):
+        """
+        Returns the repository with the registry path, as
+        `PyxisGQL.get_repository_by_registry_path` does.
+
+        :rtype: dict or None
+        """
+        found = self.find_repositories_by_registry_paths(
+            [{"registry": registry, "repository": repository}]
+        )
+        return found[0] if found else None
+
+
+_repository_catalogs: dict[tuple, PyxisRepositoryCatalog] = {}
+
+
+def _repository_catalog_file(url):
+    """
+    Returns the REPOSITORY_CATALOG_FILE path with the host of the Pyxis `url`
+    added before the extension, so each Pyxis instance has its own catalog.
+    """
+    host = urlparse(url if "//" in url else "//" + url).hostname or "pyxis"
+    root, ext = os.path.splitext(conf.repository_catalog_file)
+    return "%s.%s%s" % (root, host, ext)
+
+
+def get_repository_catalog(url, cert):
+    """
+    Returns the process-wide PyxisRepositoryCatalog for the `url` and `cert`.
+    The catalog is stored in REPOSITORY_CATALOG_FILE with the Pyxis host
+    added to its name.
+
+    :param str url: Pyxis GraphQL url.
+    :param tuple cert: client certificate and private key.
+    :return: the catalog, or None when REPOSITORY_CATALOG_FILE is not set.
+    :rtype: PyxisRepositoryCatalog or None
+    """
+    if not conf.repository_catalog_file:
+        return None
+    key = (url, cert)
+    with _pools_lock:
+        if key not in _repository_catalogs:
+            _repository_catalogs[key] = PyxisRepositoryCatalog(
+                url, cert, _repository_catalog_file(url)
+            )
+        return _repository_catalogs[key]
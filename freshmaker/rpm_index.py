@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from freshmaker import conf, log
+from freshmaker.pyxis_gql import PyxisGQL
+
+
+class RPMImageIndex:
+    """
+    Local inverted index from RPM name to the Pyxis images with the RPM
+    installed.
+
+    The index is stored in a SQLite database shared by all the Freshmaker
+    processes on the host. It is built from a sweep of all the published
+    images and then kept current by fetching the images updated since the
+    last sync, every RPM_INDEX_SYNC_INTERVAL seconds, in a background
+    thread. Only one process syncs the index at a time.
+
+    The index only narrows down the candidate images, the callers must
+    confirm them against Pyxis.
+    """
+
+    def __init__(self, url, cert, filename):
+        self.url = url
+        self.cert = cert
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._syncer_pid = None
+
+        dirname = os.path.dirname(self.filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    @property
+    def _connection(self):
+        # SQLite connections can't be shared with forked processes.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self.filename, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "image_id TEXT PRIMARY KEY, "
+                "nvr TEXT NOT NULL, "
+                "architecture TEXT, "
+                "content_sets TEXT NOT NULL, "
+                "repositories TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rpms ("
+                "name TEXT NOT NULL, "
+                "nvra TEXT NOT NULL, "
+                "image_id TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS rpms_name ON rpms (name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS rpms_image_id ON rpms (image_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _get_meta(self, key):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _start_syncer(self):
+        """Starts the background sync thread in this process, if not started yet"""
+        # Threads don't survive fork, every process needs its own thread
+        if self._syncer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._syncer_pid == os.getpid():
+                return
+            self._syncer_pid = os.getpid()
+        thread = threading.Thread(target=self._sync_loop, name="rpm-image-index", daemon=True)
+        thread.start()
+
+    def _sync_loop(self):
+        while True:
+            try:
+                self.sync_if_stale()
+            except Exception:
+                log.exception("Cannot sync the RPM image index %s", self.filename)
+            time.sleep(min(conf.rpm_index_sync_interval, 60))
+
+    def _synced_at(self):
+        with self._lock:
+            return float(self._get_meta("synced_at") or 0)
+
+    def sync_if_stale(self):
+        """
+        Syncs the index when it was synced more than RPM_INDEX_SYNC_INTERVAL
+        seconds ago and no other process is syncing it.
+        """
+        if time.time() - self._synced_at() < conf.rpm_index_sync_interval:
+            return
+        with open(f"{self.filename}.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is syncing the index
+                return
+            # The index may have been synced before the lock was acquired
+            if time.time() - self._synced_at() >= conf.rpm_index_sync_interval:
+                self.sync()
+
+    def sync(self):
+        """
+        Fetches the images updated since the last sync from Pyxis, or all
+        the published images on the first sync, and indexes them.
+        """
+        with self._lock:
+            updated_after = self._get_meta("last_update_date")
+            last_id = self._get_meta("last_image_id")
+        started_at = time.time()
+        log.info("Syncing the RPM image index %s, updated after %s", self.filename, updated_after)
+
+        pyxis = PyxisGQL(url=self.url, cert=self.cert)
+        count = 0
+        for images in pyxis.iter_images_for_rpm_index(updated_after, last_id):
+            self._index_images(images)
+            count += len(images)
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)",
+                (str(started_at),),
+            )
+        log.info("Indexed %d images in the RPM image index %s", count, self.filename)
+
+    def _index_images(self, images):
+        """Replaces the indexed data of the `images` with their current data"""
+        image_rows = []
+        rpm_rows = []
+        last_update_date = last_id = None
+        for image in images:
+            if image.get("last_update_date"):
+                last_update_date, last_id = image["last_update_date"], image["_id"]
+            # Images built by Konflux lack Brew metadata, they can't be rebuilt
+            if not image.get("brew"):
+                continue
+            image_rows.append(
+                (
+                    image["_id"],
+                    image["brew"]["build"],
+                    image.get("architecture"),
+                    json.dumps(image.get("content_sets") or []),
+                    json.dumps(image.get("repositories") or []),
+                )
+            )
+            edges = image.get("edges") or {}
+            rpm_manifest = (edges.get("rpm_manifest") or {}).get("data") or {}
+            for rpm in rpm_manifest.get("rpms") or []:
+                rpm_rows.append((rpm["name"], rpm["nvra"], image["_id"]))
+
+        with self._lock:
+            conn = self._connection
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "DELETE FROM rpms WHERE image_id = ?", [(row[0],) for row in image_rows]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO images "
+                    "(image_id, nvr, architecture, content_sets, repositories) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    image_rows,
+                )
+                conn.executemany(
+                    "INSERT INTO rpms (name, nvra, image_id) VALUES (?, ?, ?)", rpm_rows
+                )
+                # The pages are sorted by the last update date and _id, so the
+                # next sync can continue after the last indexed image.
+                if last_update_date:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        [("last_update_date", last_update_date), ("last_image_id", last_id)],
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def find_image_nvrs(
+        self, rpm_names, content_sets=None, repositories=None, published=None, tags=None
+    ):
+        """
+        Returns the NVRs of the indexed images matching the same criteria
+        as `PyxisGQL.find_images_by_installed_rpms`.
+
+        :param list rpm_names: List of rpm names
+        :param list content_sets: List of content sets
+        :param list repositories: List of repository paths
+        :param bool published: The published attribution of image
+        :param list tags: List of image tags
+        :return: set of image NVRs, or None when the index has not been
+            synced in the last RPM_INDEX_MAX_AGE seconds.
+        :rtype: set or None
+        """
+        self._start_syncer()
+        if time.time() - self._synced_at() > conf.rpm_index_max_age:
+            return None
+
+        rpm_names = list(rpm_names)
+        if not rpm_names:
+            return set()
+        placeholders = ", ".join("?" * len(rpm_names))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT images.nvr, images.content_sets, images.repositories "
+                "FROM rpms JOIN images ON rpms.image_id = images.image_id "
+                f"WHERE rpms.name IN ({placeholders})",
+                rpm_names,
+            ).fetchall()
+
+        content_sets = set(content_sets or [])
+        repositories = set(repositories or [])
+        tags = set(tags or [])
+        nvrs = set()
+        for nvr, image_content_sets, image_repositories in rows:
+            if content_sets and content_sets.isdisjoint(json.loads(image_content_sets)):
+                continue
+            if any(
+                (not isinstance(published, bool) or repo["published"] == published)
+                and (not repositories or repo["repository"] in repositories)
+                and (not tags or not tags.isdisjoint(tag["name"] for tag in repo["tags"] or []))
+                for repo in json.loads(image_repositories)
+            ):
+                nvrs.add(nvr)
+        return nvrs
+
+
+_rpm_indexes: dict[tuple, RPMImageIndex] = {}
+_rpm_indexes_lock = threading.Lock()
+
+
+def get_rpm_index(url, cert):
+    """
+    Returns the process-wide RPMImageIndex for the `url` and `cert`.
+
+    :param str url: Pyxis GraphQL url.
+    :param tuple cert: client certificate and private key.
+    :return: the index, or None when RPM_INDEX_FILE is not set.
+    :rtype: RPMImageIndex or None
+    """
+    if not conf.rpm_index_file:
+        return None
+    key = (url, cert)
+    with _rpm_indexes_lock:
+        if key not in _rpm_indexes:
+            _rpm_indexes[key] = RPMImageIndex(url, cert, conf.rpm_index_file)
+        return _rpm_indexes[key]
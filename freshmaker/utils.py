@@ -25,12 +25,14 @@ import os
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 import backoff
 import kobo.rpmlib
 import koji
 import requests
+import rpm
 import semver
 import yaml
 
@@ -39,6 +41,7 @@ from requests_kerberos import HTTPKerberosAuth, OPTIONAL
 from urllib.parse import urlparse
 
 from freshmaker import app, conf, log
+from freshmaker.monitor import singleflight_coalesced_counter
 from freshmaker.types import ArtifactType
 
 # Global authenticated session for Product Pages API
@@ -65,11 +68,76 @@ def _get_authenticated_product_pages_session():
     return _product_pages_session
 
 
-def _cmp(a, b):
+# Tokens of the `rpmvercmp_key`. Their order follows rpmvercmp: "~" sorts
+# before the end of the string, "^" after the end of the string but before
+# any segment and numeric segments are newer than alphabetic ones.
+_TILDE = (0,)
+_END = (1,)
+_CARET = (2,)
+_ALPHA = 3
+_NUMERIC = 4
+
+
+def rpmvercmp_key(value):
     """
-    Replacement for cmp() in Python 3.
+    Returns the key sorting the version strings the same way as rpmvercmp,
+    which is used by ``rpm.labelCompare`` to compare the epoch, version and
+    release of the RPMs.
+
+    The separators are ignored, numeric segments are compared as integers
+    and alphabetic segments as strings.
+
+    :param str value: Version string, for example epoch, version or release.
+    :rtype: tuple
+    :return: Key which can be compared with keys of other version strings.
     """
-    return (a > b) - (a < b)
+    tokens = []
+    i = 0
+    length = len(value)
+    while i < length:
+        char = value[i]
+        if char == "~":
+            tokens.append(_TILDE)
+            i += 1
+        elif char == "^":
+            tokens.append(_CARET)
+            i += 1
+        elif char.isascii() and char.isdigit():
+            start = i
+            while i < length and value[i].isascii() and value[i].isdigit():
+                i += 1
+            tokens.append((_NUMERIC, int(value[start:i])))
+        elif char.isascii() and char.isalpha():
+            start = i
+            while i < length and value[i].isascii() and value[i].isalpha():
+                i += 1
+            tokens.append((_ALPHA, value[start:i]))
+        else:
+            i += 1
+    tokens.append(_END)
+    return tuple(tokens)
+
+
+@functools.lru_cache(maxsize=16384)
+def nvr_sort_key(nvr):
+    """
+    Returns the key sorting the NVRs the same way as
+    ``kobo.rpmlib.compare_nvr``. The NVRs with different names are sorted
+    by the name.
+
+    The keys are cached, so sorting the same NVRs again does not parse them.
+
+    :param str nvr: NVR to get the key for.
+    :rtype: tuple
+    :return: Key which can be compared with keys of other NVRs.
+    """
+    parsed = kobo.rpmlib.parse_nvr(nvr)
+    return (
+        parsed["name"],
+        rpmvercmp_key(str(parsed["epoch"])),
+        rpmvercmp_key(str(parsed["version"])),
+        rpmvercmp_key(str(parsed["release"])),
+    )
 
 
 def sorted_by_nvr(lst, get_nvr=None, reverse=False):
@@ -84,24 +152,46 @@ def sorted_by_nvr(lst, get_nvr=None, reverse=False):
     :return: Sorted `lst`.
     """
 
-    def _compare_items(item1, item2):
+    def _get_key(item):
         if get_nvr:
-            nvr1 = get_nvr(item1)
-            nvr2 = get_nvr(item2)
-        elif hasattr(item1, "nvr") and hasattr(item2, "nvr"):
-            nvr1 = item1.nvr
-            nvr2 = item2.nvr
+            nvr = get_nvr(item)
+        elif hasattr(item, "nvr"):
+            nvr = item.nvr
         else:
-            nvr1 = item1
-            nvr2 = item2
+            nvr = item
+        return nvr_sort_key(nvr)
+
+    return sorted(lst, key=_get_key, reverse=reverse)
+
+
+def kahn_layers(nodes, get_parent):
+    """
+    Splits the `nodes` of a dependency forest into layers using Kahn's
+    algorithm. The first layer contains the nodes without parent, every
+    other node is in the layer right after the layer of its parent.
 
-        nvr1_dict = kobo.rpmlib.parse_nvr(nvr1)
-        nvr2_dict = kobo.rpmlib.parse_nvr(nvr2)
-        if nvr1_dict["name"] != nvr2_dict["name"]:
-            return _cmp(nvr1_dict["name"], nvr2_dict["name"])
-        return kobo.rpmlib.compare_nvr(nvr1_dict, nvr2_dict)
+    :param list nodes: List of hashable nodes.
+    :param fnc get_parent: Function taking the node and returning its
+        parent node, or None. Parents which are not in `nodes` are ignored.
+    :rtype: list
+    :return: List of layers, each of them is a list of nodes. The nodes which
+        are part of a dependency cycle are not in any layer.
+    """
+    node_set = set(nodes)
+    children = {}
+    layer = []
+    for node in nodes:
+        parent = get_parent(node)
+        if parent is not None and parent != node and parent in node_set:
+            children.setdefault(parent, []).append(node)
+        else:
+            layer.append(node)
 
-    return sorted(lst, key=functools.cmp_to_key(_compare_items), reverse=reverse)
+    layers = []
+    while layer:
+        layers.append(layer)
+        layer = [child for node in layer for child in children.get(node, [])]
+    return layers
 
 
 def get_url_for(*args, **kwargs):
@@ -199,6 +289,161 @@ def retry(
     return wrapper
 
 
+def _make_hashable(value):
+    """Converts the lists, sets and dicts in `value` to hashable types"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _make_hashable(val)) for key, val in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_make_hashable(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_make_hashable(item) for item in value)
+    return value
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces the concurrent calls with the same key, so only one of them
+    is executed and the others wait for it and share its result, or its
+    exception.
+
+    Unlike the cache, the result is not kept once the call finishes.
+    """
+
+    def __init__(self, name):
+        """
+        :param str name: name of the coalesced calls, used as a label of
+            the "singleflight_coalesced" counter.
+        """
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Calls the `function` with the `args` and `kwargs`, unless a call
+        with the same `key` is already in flight. In that case, waits for
+        that call and returns its result.
+
+        :param key: hashable key identifying the call.
+        :param callable function: function to call.
+        :return: result of the call.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            singleflight_coalesced_counter.labels(self.name).inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function(*args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def do_multi(self, keys, function):
+        """
+        Batch version of `do`. Calls the `function` once with the `keys`
+        which are not in flight, and waits for the calls of the other keys
+        already in flight.
+
+        :param list keys: hashable keys identifying the calls.
+        :param callable function: function called with the list of keys not
+            in flight, returning a dict with the result of each of them. The
+            result can be an exception, which is raised by the coalesced
+            calls waiting for it.
+        :return: dict with the result, or the exception, of each key.
+        :rtype: dict
+        """
+        leading = {}
+        waiting = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                flight = self._flights.get(key)
+                if flight is None:
+                    leading[key] = self._flights[key] = _Flight()
+                else:
+                    waiting[key] = flight
+
+        results = {}
+        try:
+            if leading:
+                results = function(list(leading))
+        except Exception as e:
+            for flight in leading.values():
+                flight.error = e
+            raise
+        else:
+            for key, flight in leading.items():
+                result = results.get(key)
+                if isinstance(result, Exception):
+                    flight.error = result
+                else:
+                    flight.result = result
+        finally:
+            with self._lock:
+                for key in leading:
+                    del self._flights[key]
+            for flight in leading.values():
+                flight.done.set()
+
+        # The own calls are done before waiting, so two batches waiting for
+        # each other's keys cannot deadlock.
+        for key, flight in waiting.items():
+            singleflight_coalesced_counter.labels(self.name).inc()
+            flight.done.wait()
+            results[key] = flight.error if flight.error is not None else flight.result
+        return results
+
+
+def singleflight(instance_key=None):
+    """
+    A decorator coalescing the concurrent calls of the function with the
+    same arguments using `SingleFlight`.
+
+    :param callable instance_key: when set, the function is a method and
+        the calls of different instances are coalesced when this function
+        returns the same value for them, for example the server URL.
+    """
+
+    def wrapper(function):
+        flight = SingleFlight(function.__qualname__)
+
+        def make_key(*args, **kwargs):
+            if instance_key is not None:
+                return (instance_key(args[0]), _make_hashable(args[1:]), _make_hashable(kwargs))
+            return (_make_hashable(args), _make_hashable(kwargs))
+
+        @functools.wraps(function)
+        def inner(*args, **kwargs):
+            return flight.do(make_key(*args, **kwargs), function, *args, **kwargs)
+
+        # Batch versions of the function coalesce with its calls using these.
+        inner.flight = flight
+        inner.make_key = make_key
+        return inner
+
+    return wrapper
+
+
 def _run_command(
     command,
     logger=None,
@@ -244,6 +489,119 @@ def is_pkg_modular(nvr):
     return "module+" in nvr
 
 
+def _parse_rpm(nvr, parse_fnc):
+    """
+    Parses the RPM `nvr` into the (evr, modular) tuple used by
+    `compare_parsed_rpms`. The epoch in evr is always "0", because the
+    RPMs are compared with the epoch ignored.
+    """
+    parsed = parse_fnc(nvr)
+    return ("0", parsed["version"], parsed["release"]), is_pkg_modular(nvr)
+
+
+def parse_rpm_nvra(nvra):
+    """
+    Parses the RPM NVRA from the container image RPM manifest, so it can
+    be compared with `compare_parsed_rpms` without parsing it again.
+
+    :param str nvra: RPM NVRA.
+    :rtype: tuple
+    :return: (evr, modular) tuple.
+    """
+    return _parse_rpm(nvra, kobo.rpmlib.parse_nvra)
+
+
+def parse_rpm_nvrs(rpm_name_to_nvrs):
+    """
+    Parses the RPM NVRs once, so they can be compared with the RPMs in many
+    container images without parsing them again.
+
+    :param dict rpm_name_to_nvrs: Dict with RPM name as a key and list of
+        NVRs, or a single NVR, as a value.
+    :rtype: dict
+    :return: Dict with RPM name as a key and list of (evr, modular) tuples
+        as a value.
+    """
+    ret = {}
+    for name, nvrs in rpm_name_to_nvrs.items():
+        if isinstance(nvrs, str):
+            nvrs = [nvrs]
+        ret[name] = [_parse_rpm(nvr, kobo.rpmlib.parse_nvr) for nvr in nvrs]
+    return ret
+
+
+def compare_parsed_rpms(rpm1, rpm2):
+    """
+    Compares two RPMs parsed by `parse_rpm_nvrs` or `parse_rpm_nvra`
+    the same way as ``kobo.rpmlib.compare_nvr(nvr1, nvr2, ignore_epoch=True)``
+    compares RPMs of the same name.
+
+    :return: rpm1 newer than rpm2: 1, same: 0, rpm1 older: -1.
+    :rtype: int
+    """
+    return rpm.labelCompare(rpm1[0], rpm2[0])
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError("%s is read-only" % type(self).__name__)
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict returned by `freeze`. It compares equal to the dict
+    with the same items, but every method modifying it raises TypeError.
+    """
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    """
+    Read-only list returned by `freeze`. It compares equal to the list
+    with the same items, but every method modifying it raises TypeError.
+    """
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(data):
+    """
+    Recursively converts the dicts and lists in `data` to FrozenDict and
+    FrozenList, so the data can be shared, for example with the cache,
+    without being copied.
+
+    :param data: JSON-like data.
+    :return: Frozen copy of `data`.
+    """
+    if isinstance(data, (FrozenDict, FrozenList)):
+        return data
+    if isinstance(data, dict):
+        return FrozenDict((key, freeze(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return FrozenList(freeze(value) for value in data)
+    return data
+
+
 @retry(wait_on=(requests.exceptions.RequestException,), logger=log)  # type: ignore
 def get_ocp_release_date(ocp_version):
     """Get the OpenShift version release date via the Product Pages API
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Benchmarks the RPM NVR filters of PyxisAPI on a synthetic set of container
+images and compares them with filtering which parses the NVRs in the
+nested loops.
+
+It is intended to be called from the top-level Freshmaker git repository:
+
+  python scripts/benchmark_nvr_filters.py --images 10000
+"""
+
+import argparse
+import os
+import random
+import sys
+from unittest import mock
+
+# Set the PYTHON_PATH to top level Freshmaker directory and also set
+# the FRESHMAKER_DEVELOPER_ENV to 1.
+sys.path.append(os.getcwd())
+os.environ["FRESHMAKER_DEVELOPER_ENV"] = "1"
+
+import kobo.rpmlib  # noqa: E402
+
+from freshmaker.image import ContainerImage, PyxisAPI  # noqa: E402
+from freshmaker.utils import is_pkg_modular  # noqa: E402
+from benchmark_utils import timed  # noqa: E402
+
+
+def make_images(count, rpms_per_image, rpm_names):
+    """Generates `count` ContainerImages with random RPM versions."""
+    images = []
+    for i in range(count):
+        rpms = []
+        for name in random.sample(rpm_names, rpms_per_image):
+            release = "%d.el8" % random.randint(1, 10)
+            if random.random() < 0.1:
+                release += ".module+el8.%d+%d" % (random.randint(1, 9), random.randint(1, 9999))
+            rpms.append({"name": name, "nvra": "%s-1.%d-%s.x86_64" % (name, i % 7, release)})
+        images.append(
+            ContainerImage.create(
+                {"brew": {"build": "image-%d-1-1" % i}, "rpm_manifest": [{"rpms": rpms}]}
+            )
+        )
+    return images
+
+
+def legacy_filter(images, rpm_name_to_nvrs):
+    """
+    Filters out the images the way PyxisAPI did before the NVRs were
+    pre-parsed: every NVR is parsed for every RPM of every image.
+    """
+    ret = []
+    for image in images:
+        included = False
+        for rpm in image.get_rpms() or []:
+            image_rpm_nvra = kobo.rpmlib.parse_nvra(rpm["nvra"])
+            for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), []):
+                input_rpm_nvr = kobo.rpmlib.parse_nvr(rpm_nvr)
+                if kobo.rpmlib.compare_nvr(image_rpm_nvra, input_rpm_nvr, ignore_epoch=True) == -1:
+                    included = True
+                    break
+            if included:
+                break
+        if not included:
+            continue
+        for rpm in image.get_rpms():
+            if any(
+                is_pkg_modular(rpm_nvr) == is_pkg_modular(rpm["nvra"])
+                for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), [])
+            ):
+                ret.append(image)
+                break
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--rpms-per-image", type=int, default=200)
+    parser.add_argument("--advisory-rpms", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rpm_names = ["package%d" % i for i in range(args.rpms_per_image * 2)]
+    rpm_name_to_nvrs = {
+        name: ["%s-1.%d-5.el8" % (name, minor) for minor in (3, 5)]
+        for name in random.sample(rpm_names, args.advisory_rpms)
+    }
+    images = make_images(args.images, args.rpms_per_image, rpm_names)
+
+    with mock.patch("freshmaker.image.PyxisGQL"):
+        pyxis = PyxisAPI("pyxis.localhost")
+
+    def preparsed_filter(images, rpm_name_to_nvrs):
+        images = pyxis.filter_out_images_with_higher_rpm_nvr(images, rpm_name_to_nvrs)
+        return pyxis.filter_out_modularity_mismatch(images, rpm_name_to_nvrs)
+
+    with mock.patch("freshmaker.image.log"):
+        expected = timed("NVRs parsed in the nested loops", legacy_filter, images, rpm_name_to_nvrs)
+        ret = timed("Pre-parsed manifests (first run)", preparsed_filter, images, rpm_name_to_nvrs)
+        timed("Pre-parsed manifests (cached)", preparsed_filter, images, rpm_name_to_nvrs)
+
+    if [image.nvr for image in ret] != [image.nvr for image in expected]:
+        sys.exit("The filtered images differ!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Compares the batches of the images to rebuild built by the chain length,
+as PyxisAPI._images_to_rebuild_to_batches used to build them, with the
+Kahn layers of the image dependency graph it builds now.
+
+The rebuild lists are generated for random image hierarchies in which the
+parents of some images have been replaced by other images, like the
+parents replaced by the latest images of their image group. For each
+batching, it counts the batches and the images recorded before their
+parent, which lose their dep_on and are built without waiting for the
+rebuilt parent.
+
+It also simulates the makespan of the rebuild, the time until the last
+image is built, with every image taking a random build time between
+--min-duration and --max-duration minutes:
+
+  * chain batches: the batches built by the chain length are built one
+    after another, each batch taking as long as its slowest image;
+  * DAG: every image is built as soon as its rebuilt parent is built,
+    so it finishes its build time after its parent.
+
+It is intended to be called from the top-level Freshmaker git repository:
+
+  python scripts/benchmark_rebuild_schedule.py --images 500 --replaced 0.2
+"""
+
+import argparse
+import os
+import random
+import sys
+
+# Set the PYTHON_PATH to top level Freshmaker directory and also set
+# the FRESHMAKER_DEVELOPER_ENV to 1.
+sys.path.append(os.getcwd())
+os.environ["FRESHMAKER_DEVELOPER_ENV"] = "1"
+
+from freshmaker.image import ContainerImage, PyxisAPI  # noqa: E402
+
+
+def generate_rebuild_lists(rng, count, replaced, root_ratio):
+    """
+    Generates the rebuild lists of a random image hierarchy with `count`
+    images, one list in the [child_image, parent_of_child_image, ...]
+    format for each leaf image. Then the parent of the `replaced` fraction
+    of the images is replaced by another random image built before it,
+    keeping the rebuild lists unchanged.
+    """
+    images = []
+    for i in range(count):
+        parent = rng.choice(images) if images and rng.random() >= root_ratio else None
+        image = ContainerImage.create({"brew": {"build": "image%d-1-1" % i}})
+        image["parent"] = parent
+        images.append(image)
+
+    parent_nvrs = {image["parent"].nvr for image in images if image["parent"]}
+    to_rebuild = []
+    for image in images:
+        if image.nvr in parent_nvrs:
+            continue
+        rebuild_list = [image]
+        while rebuild_list[-1]["parent"]:
+            rebuild_list.append(rebuild_list[-1]["parent"])
+        to_rebuild.append(rebuild_list)
+
+    # The images are generated parents first, so the replaced parents never
+    # create a dependency cycle.
+    for i, image in enumerate(images):
+        if i and rng.random() < replaced:
+            image["parent"] = rng.choice(images[:i])
+    return to_rebuild
+
+
+def chain_length_batches(to_rebuild):
+    """The batches as _images_to_rebuild_to_batches used to build them."""
+    max_len = max((len(rebuild_list) for rebuild_list in to_rebuild), default=0)
+    batches = [[] for i in range(max_len)]
+    seen = set()
+    for rebuild_list in sorted(to_rebuild, key=lambda lst: len(lst), reverse=True):
+        for image, batch in zip(reversed(rebuild_list), batches):
+            if image.nvr in seen:
+                continue
+            seen.add(image.nvr)
+            batch.append(image)
+    return batches
+
+
+def count_lost_dep_on(batches):
+    """
+    Returns the number of images whose parent is rebuilt, but is recorded
+    after them, so the images are recorded without dep_on.
+    """
+    nvrs = {image.nvr for batch in batches for image in batch}
+    recorded = set()
+    lost = 0
+    for batch in batches:
+        for image in batch:
+            parent = image["parent"]
+            if parent and parent.nvr in nvrs and parent.nvr not in recorded:
+                lost += 1
+            recorded.add(image.nvr)
+    return lost
+
+
+def generate_durations(rng, to_rebuild, min_duration, max_duration):
+    """Returns the random build time of every image to rebuild by its NVR."""
+    nvrs = sorted({image.nvr for rebuild_list in to_rebuild for image in rebuild_list})
+    return {nvr: rng.uniform(min_duration, max_duration) for nvr in nvrs}
+
+
+def chain_batches_makespan(batches, durations):
+    """
+    Returns the makespan of the `batches` built one after another, each
+    batch finishing with its slowest image.
+    """
+    return sum(max(durations[image.nvr] for image in batch) for batch in batches if batch)
+
+
+def dag_makespan(batches, durations):
+    """
+    Returns the makespan of the images in the `batches` built as soon as
+    their rebuilt parent is built.
+    """
+    images = {image.nvr: image for batch in batches for image in batch}
+    finished = {}
+
+    def finish(image):
+        if image.nvr not in finished:
+            parent = image["parent"]
+            start = finish(images[parent.nvr]) if parent and parent.nvr in images else 0
+            finished[image.nvr] = start + durations[image.nvr]
+        return finished[image.nvr]
+
+    return max((finish(image) for image in images.values()), default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--images", type=int, default=500, help="Number of images")
+    parser.add_argument(
+        "--replaced", type=float, default=0.2, help="Fraction of the images with replaced parent"
+    )
+    parser.add_argument(
+        "--root-ratio", type=float, default=0.05, help="Fraction of the images without parent"
+    )
+    parser.add_argument(
+        "--min-duration", type=float, default=20, help="Minimum image build time in minutes"
+    )
+    parser.add_argument(
+        "--max-duration", type=float, default=60, help="Maximum image build time in minutes"
+    )
+    parser.add_argument("--runs", type=int, default=10, help="Number of random hierarchies")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    header = "%-6s %7s %7s %13s %13s %13s %13s %13s %13s"
+    row = "%-6s %7s %7s %13s %13s %13d %13d %13.0f %13.0f"
+    print(
+        header
+        % (
+            "run",
+            "images",
+            "lists",
+            "chain batches",
+            "kahn batches",
+            "chain lost",
+            "kahn lost",
+            "chain [min]",
+            "DAG [min]",
+        )
+    )
+    total_chain_lost = total_kahn_lost = 0
+    total_chain_makespan = total_dag_makespan = 0
+    for run in range(args.runs):
+        to_rebuild = generate_rebuild_lists(rng, args.images, args.replaced, args.root_ratio)
+        durations = generate_durations(rng, to_rebuild, args.min_duration, args.max_duration)
+        chain_batches = chain_length_batches(to_rebuild)
+        kahn_batches = PyxisAPI._images_to_rebuild_to_batches(to_rebuild, set())
+        chain_lost = count_lost_dep_on(chain_batches)
+        kahn_lost = count_lost_dep_on(kahn_batches)
+        chain_makespan = chain_batches_makespan(chain_batches, durations)
+        kahn_makespan = dag_makespan(kahn_batches, durations)
+        total_chain_lost += chain_lost
+        total_kahn_lost += kahn_lost
+        total_chain_makespan += chain_makespan
+        total_dag_makespan += kahn_makespan
+        print(
+            row
+            % (
+                run,
+                args.images,
+                len(to_rebuild),
+                len(chain_batches),
+                len(kahn_batches),
+                chain_lost,
+                kahn_lost,
+                chain_makespan,
+                kahn_makespan,
+            )
+        )
+
+    print(
+        row
+        % (
+            "total",
+            "",
+            "",
+            "",
+            "",
+            total_chain_lost,
+            total_kahn_lost,
+            total_chain_makespan,
+            total_dag_makespan,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
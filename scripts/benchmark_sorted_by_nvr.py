@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Benchmarks sorted_by_nvr against sorting with the kobo.rpmlib.compare_nvr
+comparator, which parses both NVRs on every comparison.
+
+It is intended to be called from the top-level Freshmaker git repository:
+
+  python scripts/benchmark_sorted_by_nvr.py --nvrs 10000
+"""
+
+import argparse
+import functools
+import os
+import random
+import sys
+
+# Set the PYTHON_PATH to top level Freshmaker directory and also set
+# the FRESHMAKER_DEVELOPER_ENV to 1.
+sys.path.append(os.getcwd())
+os.environ["FRESHMAKER_DEVELOPER_ENV"] = "1"
+
+import kobo.rpmlib  # noqa: E402
+
+from freshmaker.utils import nvr_sort_key, sorted_by_nvr  # noqa: E402
+from benchmark_utils import timed  # noqa: E402
+
+
+def compare_nvrs(nvr1, nvr2):
+    """The comparator sorted_by_nvr used before it had the sort key."""
+    nvr1_dict = kobo.rpmlib.parse_nvr(nvr1)
+    nvr2_dict = kobo.rpmlib.parse_nvr(nvr2)
+    if nvr1_dict["name"] != nvr2_dict["name"]:
+        return (nvr1_dict["name"] > nvr2_dict["name"]) - (nvr1_dict["name"] < nvr2_dict["name"])
+    return kobo.rpmlib.compare_nvr(nvr1_dict, nvr2_dict)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--nvrs", type=int, default=10000)
+    parser.add_argument("--names", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    nvrs = [
+        "image%d-container-v4.%d.%d-%d.%d"
+        % (
+            random.randrange(args.names),
+            random.randrange(20),
+            random.randrange(100),
+            random.randrange(1000),
+            random.randrange(10),
+        )
+        for _ in range(args.nvrs)
+    ]
+
+    expected = timed("compare_nvr comparator", sorted, nvrs, key=functools.cmp_to_key(compare_nvrs))
+    nvr_sort_key.cache_clear()
+    ret = timed("sorted_by_nvr (first run)", sorted_by_nvr, nvrs)
+    timed("sorted_by_nvr (cached keys)", sorted_by_nvr, nvrs)
+
+    if ret != expected:
+        sys.exit("The sorted NVRs differ!")
+
+
+if __name__ == "__main__":
+    main()
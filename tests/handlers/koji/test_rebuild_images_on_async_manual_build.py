@@ -19,9 +19,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from freshmaker import db
+from freshmaker import conf, db
 from freshmaker.handlers.koji import RebuildImagesOnAsyncManualBuild
 from freshmaker.events import FreshmakerAsyncManualBuildEvent
 from freshmaker.types import EventState
@@ -497,3 +497,82 @@ class TestRebuildImagesOnAsyncManualBuild(helpers.ModelsTestCase):
             # Check if build in DB corresponds to parent of the image
             build = db_event.builds.first().json()
             self.assertEqual(build["build_args"].get("original_parent", 0), original_parent)
+
+    @patch.object(conf, "persist_image_lineage", new=True)
+    def test_get_image_tree_from_image_lineage(self):
+        image_e = ContainerImage(self.image_e)
+        image_e["parent"] = None
+        image_d = ContainerImage(self.image_d)
+        image_d["parent"] = None
+        image_a = ContainerImage(self.image_a)
+        image_a["parent"] = None
+        image_0 = ContainerImage(self.image_0)
+        pyxis = MagicMock()
+        pyxis.get_recorded_ancestors.return_value = {
+            image_e.nvr: [image_d.nvr, image_a.nvr, image_0.nvr, None]
+        }
+        pyxis.get_images_by_nvrs.return_value = [image_0, image_a, image_d]
+
+        tree = RebuildImagesOnAsyncManualBuild().get_image_tree(pyxis, image_e, [])
+
+        self.assertEqual([image.nvr for image in tree], [image_d.nvr, image_a.nvr, image_0.nvr])
+        self.assertIs(image_e["parent"], tree[0])
+        self.assertIs(tree[1]["parent"], tree[2])
+        pyxis.get_recorded_ancestors.assert_called_once_with([image_e.nvr])
+        pyxis.get_images_by_nvrs.assert_called_once_with(
+            [image_d.nvr, image_a.nvr, image_0.nvr], published=None
+        )
+        pyxis.find_parent_brew_build_nvr_from_child.assert_not_called()
+
+    @patch.object(conf, "persist_image_lineage", new=True)
+    @patch("freshmaker.image.ContainerImage.resolve")
+    def test_find_images_trees_from_image_lineage(self, resolve):
+        image_e = ContainerImage(self.image_e)
+        image_d = ContainerImage(self.image_d)
+        image_a = ContainerImage(self.image_a)
+        image_0 = ContainerImage(self.image_0)
+        pyxis = MagicMock()
+        pyxis.get_recorded_ancestors.return_value = {
+            image_e.nvr: [image_a.nvr, image_0.nvr, None],
+            image_d.nvr: [image_a.nvr, image_0.nvr, None],
+        }
+        pyxis.get_images_by_nvrs.return_value = [image_a, image_0]
+        pyxis._deduplicate_images_to_rebuild.side_effect = lambda trees: trees
+
+        trees = RebuildImagesOnAsyncManualBuild().find_images_trees_to_rebuild(
+            [image_e, image_d], pyxis
+        )
+
+        self.assertEqual(
+            [[image.nvr for image in tree] for tree in trees],
+            [
+                [image_e.nvr, image_a.nvr, image_0.nvr],
+                [image_d.nvr, image_a.nvr, image_0.nvr],
+            ],
+        )
+        # The trees do not share the images
+        self.assertIsNot(trees[0][1], trees[1][1])
+        # The shared ancestors are looked up and resolved only once
+        pyxis.get_recorded_ancestors.assert_called_once_with([image_e.nvr, image_d.nvr])
+        pyxis.get_images_by_nvrs.assert_called_once_with([image_a.nvr, image_0.nvr], published=None)
+        self.assertEqual(resolve.call_count, 2)
+        pyxis.find_parent_brew_build_nvr_from_child.assert_not_called()
+
+    @patch.object(conf, "persist_image_lineage", new=True)
+    def test_get_image_tree_continues_after_image_lineage(self):
+        image_e = ContainerImage(self.image_e)
+        image_d = ContainerImage(self.image_d)
+        image_a = ContainerImage(self.image_a)
+        image_0 = ContainerImage(self.image_0)
+        pyxis = MagicMock()
+        pyxis.get_recorded_ancestors.return_value = {image_e.nvr: [image_d.nvr]}
+        pyxis.find_parent_brew_build_nvr_from_child.side_effect = [image_a.nvr, image_0.nvr, None]
+        pyxis.get_images_by_nvrs.side_effect = [[image_d], [image_a], [image_0]]
+
+        tree = RebuildImagesOnAsyncManualBuild().get_image_tree(pyxis, image_e, [])
+
+        self.assertEqual([image.nvr for image in tree], [image_d.nvr, image_a.nvr, image_0.nvr])
+        self.assertEqual(
+            [c.args[0] for c in pyxis.find_parent_brew_build_nvr_from_child.call_args_list],
+            tree,
+        )
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import itertools
+from unittest import mock
+
+import dogpile.cache
+import koji
+from dogpile.cache.api import NO_VALUE
+
+from freshmaker.cache import SQLiteBackend, invalidate_immutable_cache
+from freshmaker.kojiservice import _is_build_completed
+
+
+def _make_region(filename, **arguments):
+    arguments["filename"] = str(filename)
+    return dogpile.cache.make_region().configure("freshmaker.sqlite", arguments=arguments)
+
+
+def test_sqlite_backend_persists_values(tmp_path):
+    db_file = tmp_path / "cache" / "immutable.sqlite"
+    region = _make_region(db_file)
+    calls = []
+
+    @region.cache_on_arguments()
+    def get_build(nvr):
+        calls.append(nvr)
+        return {"nvr": nvr}
+
+    assert get_build("foo-1-1") == {"nvr": "foo-1-1"}
+    assert get_build("foo-1-1") == {"nvr": "foo-1-1"}
+    assert calls == ["foo-1-1"]
+
+    # A new region, like after the restart, gets the value from the file.
+    region = _make_region(db_file)
+    assert region.get(get_build.__module__ + ":get_build|foo-1-1") == {"nvr": "foo-1-1"}
+
+
+def test_sqlite_backend_evicts_least_recently_used(tmp_path):
+    backend = SQLiteBackend(
+        {"filename": str(tmp_path / "cache.sqlite"), "max_size": 30, "eviction_interval": 1}
+    )
+
+    with mock.patch("freshmaker.cache.time.time", side_effect=itertools.count(1)):
+        backend.set_serialized("a", b"x" * 10)
+        backend.set_serialized("b", b"x" * 10)
+        backend.set_serialized("c", b"x" * 10)
+        # "a" becomes the most recently used value
+        assert backend.get_serialized("a") == b"x" * 10
+        backend.set_serialized("d", b"x" * 10)
+
+    assert backend.get_serialized_multi(["a", "b", "c", "d"]) == [
+        b"x" * 10,
+        NO_VALUE,
+        NO_VALUE,
+        b"x" * 10,
+    ]
+
+
+def test_sqlite_backend_delete_by_argument(tmp_path):
+    backend = SQLiteBackend({"filename": str(tmp_path / "cache.sqlite")})
+    backend.set_serialized_multi(
+        {
+            "freshmaker.kojiservice:get_build|foo-1-1": b"1",
+            "freshmaker.kojiservice:get_build|foo-1-10": b"2",
+            "freshmaker.kojiservice:get_task_request|1": b"3",
+        }
+    )
+
+    backend.delete_by_argument("foo-1-1")
+
+    assert backend.get_serialized_multi(
+        [
+            "freshmaker.kojiservice:get_build|foo-1-1",
+            "freshmaker.kojiservice:get_build|foo-1-10",
+            "freshmaker.kojiservice:get_task_request|1",
+        ]
+    ) == [NO_VALUE, b"2", b"3"]
+
+    backend.clear()
+    assert backend.get_serialized("freshmaker.kojiservice:get_build|foo-1-10") is NO_VALUE
+
+
+def test_invalidate_immutable_cache(tmp_path):
+    region = _make_region(tmp_path / "cache.sqlite")
+    get_build_key = "freshmaker.kojiservice:get_build|https://koji.example.com/kojihub|%s"
+    region.set(get_build_key % "foo-1-1", 1)
+    region.set(get_build_key % "bar-1-1", 2)
+
+    with mock.patch("freshmaker.cache.immutable_region", new=region):
+        invalidate_immutable_cache("foo-1-1")
+        assert region.get(get_build_key % "foo-1-1") is NO_VALUE
+        assert region.get(get_build_key % "bar-1-1") == 2
+
+        invalidate_immutable_cache()
+        assert region.get(get_build_key % "bar-1-1") is NO_VALUE
+
+
+def test_is_build_completed():
+    assert _is_build_completed({"state": koji.BUILD_STATES["COMPLETE"]})
+    assert not _is_build_completed({"state": koji.BUILD_STATES["BUILDING"]})
+    assert not _is_build_completed(None)
@@ -24,6 +24,7 @@
 
 import json
 
+from datetime import datetime, timedelta
 from unittest.mock import patch
 from requests.exceptions import HTTPError
 
@@ -36,6 +37,7 @@ from freshmaker.models import (
     ArtifactBuild,
     ArtifactBuildState,
     ArtifactBuildCompose,
+    BuildSubmission,
     Compose,
     Event,
     EVENT_TYPES,
@@ -333,6 +335,62 @@ class TestGetRepoURLs(helpers.ModelsTestCase):
 
         self.assertEqual(self.build_1.state, ArtifactBuildState.PLANNED.value)
 
+    @patch.object(freshmaker.conf, "build_submission_workers", new=4)
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_container")
+    def test_start_to_build_images_concurrently(self, build_container):
+        def mocked_odcs_get_compose(compose_id):
+            return {
+                "id": compose_id,
+                "result_repofile": "http://localhost/%d.repo" % compose_id,
+                "state": COMPOSE_STATES["generating" if compose_id == 5 else "done"],
+            }
+
+        self.odcs_get_compose.side_effect = mocked_odcs_get_compose
+
+        def mocked_build_container(scm_url, branch, target, **kwargs):
+            if kwargs["release"].startswith("3."):
+                raise HTTPError("500 Server Error")
+            return 10
+
+        build_container.side_effect = mocked_build_container
+
+        build_3 = ArtifactBuild.create(
+            db.session,
+            self.event,
+            "build-3",
+            ArtifactType.IMAGE,
+            state=ArtifactBuildState.PLANNED,
+            original_nvr="foo-3-3",
+        )
+        build_3.build_args = self.build_2.build_args
+        build_4 = ArtifactBuild.create(
+            db.session,
+            self.event,
+            "build-4",
+            ArtifactType.IMAGE,
+            state=ArtifactBuildState.PLANNED,
+            original_nvr="foo-4-4",
+        )
+        db.session.commit()
+
+        handler = MyHandler()
+        with self.assertLogs("freshmaker", "ERROR"):
+            handler.start_to_build_images([self.build_1, self.build_2, build_3, build_4])
+
+        # The ODCS compose of build_1 is not ready yet.
+        self.assertEqual(self.build_1.state, ArtifactBuildState.PLANNED.value)
+        self.assertIsNone(self.build_1.rebuilt_nvr)
+        self.assertEqual(self.build_2.state, ArtifactBuildState.BUILD.value)
+        self.assertEqual(self.build_2.build_id, 10)
+        self.assertEqual(build_3.state, ArtifactBuildState.FAILED.value)
+        self.assertIn("500 Server Error", build_3.state_reason)
+        self.assertIsNotNone(build_3.rebuilt_nvr)
+        self.assertEqual(build_4.state, ArtifactBuildState.FAILED.value)
+        self.assertEqual(
+            build_4.state_reason, "Container image does not have 'build_args' filled in."
+        )
+        self.assertEqual(build_container.call_count, 2)
+
 
 class TestAllowBuildBasedOnAllowlist(helpers.FreshmakerTestCase):
     """Test BaseHandler.allow_build"""
@@ -622,3 +680,162 @@ class TestStartToBuildImages(helpers.ModelsTestCase):
 
         self.assertEqual(build.state, ArtifactBuildState.FAILED.value)
         self.assertTrue("invalid openshift versions range" in build.state_reason)
+
+    @patch.object(freshmaker.conf, "critical_path_build_ordering", new=True)
+    @patch.object(freshmaker.conf, "build_duration_default", new=600)
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build")
+    def test_start_to_build_images_critical_path(self, build_artifact):
+        build_artifact.return_value = 1
+        db_event = Event.get_or_create(
+            db.session, "msg1", "current_event", ErrataRPMAdvisoryShippedEvent
+        )
+        past = ArtifactBuild.create(
+            db.session, db_event, "slow", "image", state="done", original_nvr="slow-1-1"
+        )
+        past.time_build_started = past.time_submitted
+        past.time_completed = past.time_build_started + timedelta(hours=2)
+        # short has a long chain of children, slow is long on its own.
+        short = ArtifactBuild.create(
+            db.session, db_event, "short", "image", state="planned", original_nvr="short-1-1"
+        )
+        slow = ArtifactBuild.create(
+            db.session, db_event, "slow", "image", state="planned", original_nvr="slow-1-2"
+        )
+        single = ArtifactBuild.create(
+            db.session, db_event, "single", "image", state="planned", original_nvr="single-1-1"
+        )
+        dep_on = short
+        for i in range(3):
+            dep_on = ArtifactBuild.create(
+                db.session, db_event, "child%d" % i, "image", state="planned", dep_on=dep_on
+            )
+        db.session.commit()
+        handler = MyHandler()
+
+        with patch("freshmaker.handlers.datetime") as datetime_patch:
+            datetime_patch.utcnow.return_value = datetime(2026, 1, 1, 10, 0)
+            handler.start_to_build_images([single, short, slow])
+
+        self.assertEqual(
+            [call.args[0] for call in build_artifact.call_args_list], [slow, short, single]
+        )
+        self.assertEqual(db_event.predicted_time_done, datetime(2026, 1, 1, 12, 0))
+        self.assertEqual(db_event.json()["predicted_time_done"], "2026-01-01T12:00:00Z")
+
+    @patch.object(freshmaker.conf, "build_submission_max_in_flight", new=2)
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build")
+    def test_start_to_build_images_queued(self, build_artifact):
+        build_artifact.side_effect = [101, 102]
+        routine_event = Event.get_or_create(
+            db.session, "msg1", "current_event", ErrataRPMAdvisoryShippedEvent
+        )
+        in_flight = ArtifactBuild.create(
+            db.session, routine_event, "running-1-1", "image", state=ArtifactBuildState.BUILD
+        )
+        routine_builds = [
+            ArtifactBuild.create(
+                db.session, routine_event, "routine-1-%d" % i, "image", state="planned"
+            )
+            for i in range(2)
+        ]
+        urgent_event = Event.create(
+            db.session, "msg2", "urgent_event", ErrataRPMAdvisoryShippedEvent, priority=2
+        )
+        urgent_build = ArtifactBuild.create(
+            db.session, urgent_event, "urgent-1-1", "image", state="planned"
+        )
+        db.session.commit()
+        handler = MyHandler()
+
+        handler.start_to_build_images(routine_builds)
+
+        # One build is running already, so only one routine build is submitted.
+        self.assertEqual(build_artifact.call_count, 1)
+        self.assertEqual(routine_builds[0].state, ArtifactBuildState.BUILD.value)
+        self.assertEqual(routine_builds[1].state, ArtifactBuildState.PLANNED.value)
+
+        handler.start_to_build_images([urgent_build])
+        self.assertEqual(build_artifact.call_count, 1)
+
+        # The urgent build goes first once there is room for another build.
+        in_flight.transition(ArtifactBuildState.DONE.value, "Built successfully.")
+        db.session.commit()
+        handler.submit_queued_builds()
+
+        self.assertEqual(build_artifact.call_count, 2)
+        self.assertEqual(urgent_build.state, ArtifactBuildState.BUILD.value)
+        self.assertEqual(urgent_build.build_id, 102)
+        self.assertEqual(routine_builds[1].state, ArtifactBuildState.PLANNED.value)
+        self.assertEqual(
+            [submission.build for submission in db.session.query(BuildSubmission)],
+            [routine_builds[1]],
+        )
+
+    @patch.object(freshmaker.conf, "build_submission_max_in_flight", new=1)
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build")
+    def test_submit_queued_builds_stale_events(self, build_artifact):
+        build_artifact.return_value = 101
+        stale_event = Event.create(db.session, "msg1", "stale_event", ErrataRPMAdvisoryShippedEvent)
+        stale_event.time_created = datetime.utcnow() - timedelta(days=8)
+        ArtifactBuild.create(
+            db.session, stale_event, "abandoned-1-1", "image", state=ArtifactBuildState.BUILD
+        )
+        event = Event.create(db.session, "msg2", "current_event", ErrataRPMAdvisoryShippedEvent)
+        build = ArtifactBuild.create(db.session, event, "foo-1-1", "image", state="planned")
+        db.session.commit()
+
+        MyHandler().start_to_build_images([build])
+
+        # The build of the stale event does not hold up the queued build.
+        self.assertEqual(build.state, ArtifactBuildState.BUILD.value)
+        self.assertEqual(db.session.query(BuildSubmission).count(), 0)
+
+    @patch.object(freshmaker.conf, "build_submission_max_in_flight", new=2)
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build")
+    def test_submit_queued_builds_counts_claimed(self, build_artifact):
+        build_artifact.return_value = 101
+        event = Event.create(db.session, "msg1", "current_event", ErrataRPMAdvisoryShippedEvent)
+        builds = [
+            ArtifactBuild.create(db.session, event, "foo-1-%d" % i, "image", state="planned")
+            for i in range(3)
+        ]
+        for build in builds:
+            BuildSubmission.enqueue(db.session, build)
+        db.session.commit()
+        # Another process claimed a build and did not submit it yet.
+        BuildSubmission.claim_next(db.session, 1, freshmaker.conf.build_submission_claim_timeout)
+        db.session.commit()
+
+        MyHandler().submit_queued_builds()
+
+        # The claimed build counts as in flight, so only one build is submitted.
+        self.assertEqual(build_artifact.call_count, 1)
+        self.assertEqual(
+            [build.state for build in builds],
+            [ArtifactBuildState.PLANNED.value, ArtifactBuildState.BUILD.value]
+            + [ArtifactBuildState.PLANNED.value],
+        )
+
+    @patch.object(freshmaker.conf, "build_submission_max_in_flight", new=1)
+    @patch("freshmaker.handlers.ContainerBuildHandler._submit_image_builds")
+    def test_submit_queued_builds_interrupted(self, submit_image_builds):
+        submit_image_builds.side_effect = RuntimeError("Interrupted")
+        event = Event.create(db.session, "msg1", "current_event", ErrataRPMAdvisoryShippedEvent)
+        build = ArtifactBuild.create(db.session, event, "foo-1-1", "image", state="planned")
+        db.session.commit()
+        handler = MyHandler()
+
+        with self.assertRaises(RuntimeError):
+            handler.start_to_build_images([build])
+
+        # The build stays queued and is picked again once its claim expires.
+        (submission,) = db.session.query(BuildSubmission).all()
+        self.assertEqual(submission.build, build)
+        self.assertIsNotNone(submission.time_claimed)
+        submit_image_builds.reset_mock(side_effect=True)
+        handler.submit_queued_builds()
+        submit_image_builds.assert_not_called()
+
+        with patch.object(freshmaker.conf, "build_submission_claim_timeout", new=-1):
+            handler.submit_queued_builds()
+        submit_image_builds.assert_any_call([build])
@@ -22,9 +22,10 @@
 
 import copy
 import pytest
+import threading
 
 from unittest import mock
-from unittest.mock import patch, Mock
+from unittest.mock import call, patch, Mock
 
 import freshmaker
 
@@ -33,9 +34,15 @@ from freshmaker.image import (
     ContainerRepository,
     ExtraRepoNotConfiguredError,
     ImageGroup,
+    ImagesToRebuildDeduplicator,
     PyxisAPI,
 )
-from freshmaker.utils import sorted_by_nvr
+from freshmaker.pyxis_gql import (
+    IMAGE_PROJECTION_FULL,
+    IMAGE_PROJECTION_REPOS,
+    PyxisGQLRequestTimeout,
+)
+from freshmaker.utils import freeze, sorted_by_nvr
 from tests.test_handler import MyHandler
 from tests import helpers
 
@@ -170,6 +177,27 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
         image.log_error("bar")
         self.assertEqual(image["error"], "foo; bar")
 
+    def test_get_parsed_rpms(self):
+        parsed_rpms = self.dummy_image.get_parsed_rpms(["openssl", "httpd"])
+        self.assertEqual(parsed_rpms, {"openssl": [(("0", "1.2.3", "1"), False)]})
+
+        # The parsed RPMs are cached ...
+        with patch("freshmaker.image.parse_rpm_nvra") as parse_rpm_nvra:
+            self.assertEqual(self.dummy_image.get_parsed_rpms(["openssl"]), parsed_rpms)
+            parse_rpm_nvra.assert_not_called()
+
+        # ... until the RPM manifest changes.
+        self.dummy_image["rpm_manifest"] = [
+            {"rpms": [{"name": "openssl", "nvra": "openssl-1.2.4-1.amd64"}]}
+        ]
+        self.assertEqual(
+            self.dummy_image.get_parsed_rpms(["openssl"]),
+            {"openssl": [(("0", "1.2.4", "1"), False)]},
+        )
+
+        self.dummy_image["rpm_manifest"] = []
+        self.assertIsNone(self.dummy_image.get_parsed_rpms(["openssl"]))
+
     @patch("freshmaker.kojiservice.KojiService.get_build")
     @patch("freshmaker.kojiservice.KojiService.get_task_request")
     def test_resolve_commit_koji_fallback(self, get_task_request, get_build):
@@ -297,6 +325,40 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
             self.dummy_image["error"].find("Cannot find valid source of Koji build") != -1
         )
 
+    @patch("freshmaker.kojiservice.KojiService.get_container_builds")
+    def test_get_additional_data_from_koji_by_nvrs(self, get_container_builds):
+        get_container_builds.return_value = {
+            "foo-1-1": {
+                "build": {"build_id": 1, "task_id": 11},
+                "task_request": ["git://example.com/rpms/foo#commit_hash1", "target1", {}],
+                "arches": None,
+            },
+            "bar-1-1": {
+                "build": {"build_id": 2, "task_id": 12},
+                "task_request": ["git://example.com/rpms/bar#origin/master", "target1", {}],
+                "arches": None,
+            },
+            "baz-1-1": {"build": None, "task_request": None, "arches": None},
+        }
+
+        data = ContainerImage.get_additional_data_from_koji_by_nvrs(
+            ["foo-1-1", "bar-1-1", "baz-1-1"]
+        )
+
+        # The builds with lookup errors are left to the per-image lookup.
+        self.assertEqual(list(data.keys()), ["foo-1-1"])
+        self.assertEqual(data["foo-1-1"]["repository"], "rpms/foo")
+        self.assertEqual(data["foo-1-1"]["commit"], "commit_hash1")
+        self.assertEqual(data["foo-1-1"]["target"], "target1")
+        get_container_builds.assert_called_once_with(
+            ["foo-1-1", "bar-1-1", "baz-1-1"], with_arches=False
+        )
+
+        with patch.object(ContainerImage, "get_additional_data_from_koji") as get_data:
+            self.dummy_image.resolve_commit(data["foo-1-1"])
+            get_data.assert_not_called()
+        self.assertEqual(self.dummy_image["commit"], "commit_hash1")
+
     @patch("freshmaker.image.ContainerImage.resolve_commit")
     def test_resolve_commit_exception(self, resolve_commit):
         resolve_commit.side_effect = ValueError("Expected exception.")
@@ -415,7 +477,9 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
         pyxis.find_images_by_nvr.return_value = [image]
         image.resolve_published(pyxis)
         self.assertEqual(image["published"], True)
-        pyxis.find_images_by_nvr.assert_called_once_with("package-name-1-4-12.10")
+        pyxis.find_images_by_nvr.assert_called_once_with(
+            "package-name-1-4-12.10", IMAGE_PROJECTION_REPOS
+        )
 
     def test_resolve_published_unpublished(self):
         image = ContainerImage.create(
@@ -433,7 +497,14 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
         pyxis.find_images_by_nvr.return_value = [image]
         image.resolve_published(pyxis)
         self.assertEqual(image["published"], False)
-        pyxis.find_images_by_nvr.assert_called_once_with("package-name-1-4-12.10")
+        # The complete RPM manifest is fetched only for the unpublished image
+        self.assertEqual(
+            pyxis.find_images_by_nvr.call_args_list,
+            [
+                call("package-name-1-4-12.10", IMAGE_PROJECTION_REPOS),
+                call("package-name-1-4-12.10", IMAGE_PROJECTION_FULL),
+            ],
+        )
         self.assertEqual(image["rpm_manifest"][0], {"rpms": [{"name": "foobar"}]})
 
     def test_resolve_published_not_image_in_pyxis(self):
@@ -450,6 +521,28 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
         pyxis.find_images_by_nvr.return_value = []
         image.resolve_published(pyxis)
 
+    def test_resolve_published_prefetched(self):
+        image = ContainerImage.create(
+            {
+                "_id": "1233829",
+                "brew": {
+                    "build": "package-name-1-4-12.10",
+                },
+            }
+        )
+        pyxis_images = [
+            {
+                "repositories": [{"published": False}],
+                "edges": {"rpm_manifest": {"data": {"rpms": [{"name": "foobar"}]}}},
+            }
+        ]
+
+        pyxis = Mock()
+        image.resolve_published(pyxis, pyxis_images)
+        self.assertEqual(image["published"], False)
+        self.assertEqual(image["rpm_manifest"][0], {"rpms": [{"name": "foobar"}]})
+        pyxis.find_images_by_nvr.assert_not_called()
+
 
 class TestContainerRepository(helpers.FreshmakerTestCase):
     def test_create(self):
@@ -1477,6 +1570,84 @@ class TestQueryFromPyxis(helpers.FreshmakerTestCase):
         )
         self.assertEqual([], ret)
 
+    @staticmethod
+    def _rpm_index_image(nvr, published):
+        return {
+            "architecture": "amd64",
+            "brew": {"build": nvr},
+            "content_sets": ["dummy-content-set-1"],
+            "edges": {
+                "rpm_manifest": {
+                    "data": {"rpms": [{"name": "openssl", "nvra": "openssl-1.2.3-2.amd64"}]}
+                }
+            },
+            "parent_brew_build": None,
+            "parsed_data": {},
+            "repositories": [
+                {
+                    "published": published,
+                    "registry": "registry.example.com",
+                    "repository": "product/repo1",
+                    "tags": [{"name": "latest"}],
+                }
+            ],
+        }
+
+    @patch("freshmaker.image.get_rpm_index")
+    @patch("os.path.exists")
+    def test_images_with_included_rpms_from_rpm_index(self, exists, get_rpm_index):
+        exists.return_value = True
+        # The index is outdated, parent-1-3 has been unpublished since
+        get_rpm_index.return_value.find_image_nvrs.return_value = {"parent-1-2", "parent-1-3"}
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        pyxis.pyxis = Mock()
+        pyxis.pyxis.find_images_by_nvrs.return_value = [
+            self._rpm_index_image("parent-1-2", True),
+            self._rpm_index_image("parent-1-3", False),
+        ]
+        repositories = {
+            repo["repository"]: repo for repo in self.fake_repositories_with_content_sets
+        }
+
+        ret = pyxis.find_images_with_included_rpms(
+            ["dummy-content-set-1"], ["openssl-1.2.3-3"], repositories
+        )
+
+        self.assertEqual([x.nvr for x in ret], ["parent-1-2"])
+        pyxis.pyxis.find_images_by_nvrs.assert_called_once_with(
+            ["parent-1-2", "parent-1-3"], IMAGE_PROJECTION_FULL
+        )
+        pyxis.pyxis.find_images_by_installed_rpms.assert_not_called()
+
+    @patch.object(freshmaker.conf, "rpm_index_confirm_chunk_size", new=1)
+    @patch("freshmaker.image.get_rpm_index")
+    @patch("os.path.exists")
+    def test_iter_images_with_included_rpms_from_rpm_index(self, exists, get_rpm_index):
+        exists.return_value = True
+        get_rpm_index.return_value.find_image_nvrs.return_value = {"parent-1-2", "parent-1-3"}
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        pyxis.pyxis = Mock()
+        pyxis.pyxis.find_images_by_nvrs.side_effect = [
+            [self._rpm_index_image("parent-1-2", True)],
+            [self._rpm_index_image("parent-1-3", False)],
+        ]
+        repositories = {
+            repo["repository"]: repo for repo in self.fake_repositories_with_content_sets
+        }
+
+        images = pyxis.iter_images_with_included_rpms(
+            ["dummy-content-set-1"], ["openssl-1.2.3-3"], repositories
+        )
+
+        # The first chunk is yielded before the next one is confirmed
+        self.assertEqual(next(images).nvr, "parent-1-2")
+        pyxis.pyxis.find_images_by_nvrs.assert_called_once_with(
+            ["parent-1-2"], IMAGE_PROJECTION_FULL
+        )
+        self.assertEqual(list(images), [])
+        self.assertEqual(pyxis.pyxis.find_images_by_nvrs.call_count, 2)
+        pyxis.pyxis.iter_images_by_installed_rpms.assert_not_called()
+
     def _filter_fnc(self, image):
         return image.nvr.startswith("filtered_")
 
@@ -1527,6 +1698,157 @@ class TestQueryFromPyxis(helpers.FreshmakerTestCase):
         self.assertTrue("package-name-2-4-12.10" in ret_nvrs)
         self.assertTrue("filtered_x-1-23" not in ret_nvrs)
 
+    @patch.object(freshmaker.conf, "pyxis_stream_images", new=True)
+    @patch("freshmaker.pyxis_gql.Client")
+    @patch("freshmaker.kojiservice.KojiService.get_build")
+    @patch("freshmaker.kojiservice.KojiService.get_task_request")
+    @patch("os.path.exists")
+    def test_images_with_content_set_packages_streamed(
+        self, exists, koji_task_request, koji_get_build, gql_client
+    ):
+        exists.return_value = True
+        gql_client.return_value.execute.return_value = self.fake_pyxis_find_repos
+
+        koji_task_request.side_effect = self.fake_koji_task_requests
+        koji_get_build.side_effect = self.fake_koji_builds
+
+        filtered_image = ContainerImage.create({"brew": {"build": "filtered_x-1-23"}})
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        pyxis.find_images_with_included_rpms = mock.Mock()
+        pyxis.iter_images_with_included_rpms = mock.Mock()
+        pyxis.iter_images_with_included_rpms.return_value = iter(
+            self.fake_container_images + [filtered_image]
+        )
+
+        ret = pyxis.find_images_with_packages_from_content_set(
+            set(["openssl-1.2.3-3"]), ["dummy-content-set-1"], filter_fnc=self._filter_fnc
+        )
+
+        pyxis.find_images_with_included_rpms.assert_not_called()
+        self.assertEqual([x.nvr for x in ret], ["package-name-1-4-12.10", "package-name-2-4-12.10"])
+        self.assertTrue(all(x["directly_affected"] for x in ret))
+
+    @patch.multiple(
+        freshmaker.conf,
+        pyxis_stream_images=True,
+        koji_multicall_batching=True,
+        koji_multicall_batch_size=2,
+    )
+    @patch("freshmaker.image.ContainerImage.resolve")
+    @patch("freshmaker.image.ContainerImage.get_additional_data_from_koji_by_nvrs")
+    @patch("freshmaker.pyxis_gql.Client")
+    @patch("os.path.exists")
+    def test_images_with_content_set_packages_streamed_koji_batches(
+        self, exists, gql_client, get_koji_data, resolve
+    ):
+        exists.return_value = True
+        gql_client.return_value.execute.return_value = self.fake_pyxis_find_repos
+        nvrs = ["foo-1-1", "bar-1-1", "baz-1-1"]
+        koji_threads = []
+
+        def fake_get_koji_data(batch_nvrs):
+            koji_threads.append(threading.current_thread())
+            return {nvr: {"commit": nvr} for nvr in batch_nvrs}
+
+        get_koji_data.side_effect = fake_get_koji_data
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        pyxis.iter_images_with_included_rpms = mock.Mock(
+            return_value=iter(ContainerImage.create({"brew": {"build": nvr}}) for nvr in nvrs)
+        )
+
+        ret = pyxis.find_images_with_packages_from_content_set(
+            set(["openssl-1.2.3-3"]), ["dummy-content-set-1"]
+        )
+
+        self.assertEqual([x.nvr for x in ret], nvrs)
+        self.assertEqual(get_koji_data.call_args_list, [call(nvrs[:2]), call(nvrs[2:])])
+        # The Koji data of the batches is fetched in the pool
+        self.assertNotIn(threading.current_thread(), koji_threads)
+        self.assertEqual(sorted(c.args[2]["commit"] for c in resolve.call_args_list), sorted(nvrs))
+
+    @patch("freshmaker.image.pyxis_gql_client")
+    def test_find_images_in_repository_chunks(self, gql_client):
+        repos = {f"product/repo{i}": {"repository": f"product/repo{i}"} for i in range(7)}
+        queried_chunks = []
+
+        def fake_find_images(content_sets, rpm_nvrs, repositories, published, **kwargs):
+            queried_chunks.append(list(repositories))
+            if len(repositories) > 2:
+                raise PyxisGQLRequestTimeout("Pyxis API was unable to fetch data from MongoDB")
+            return [ContainerImage.create({"brew": {"build": name}}) for name in repositories]
+
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        pyxis.find_images_with_included_rpms = mock.Mock(side_effect=fake_find_images)
+        with patch.multiple(
+            freshmaker.conf,
+            pyxis_repository_chunk_concurrency=1,
+            pyxis_repository_chunk_size=4,
+            pyxis_repository_max_chunk_size=8,
+            pyxis_repository_chunk_fast_time=60,
+        ):
+            ret = pyxis._find_images_in_repository_chunks(
+                ["content-set"], ["openssl-1.2.3-3"], repos, True
+            )
+
+        # The images are returned in the order of the repositories
+        self.assertEqual([image.nvr for image in ret], list(repos))
+        self.assertEqual(
+            [len(chunk) for chunk in queried_chunks],
+            # The timed out chunk is split and the chunk size grows again
+            [4, 2, 2, 3, 1, 2],
+        )
+
+    def test_iter_images_in_repository_chunks(self):
+        repos = {f"product/repo{i}": {"repository": f"product/repo{i}"} for i in range(7)}
+        queried_chunks = []
+
+        def fake_iter_images(content_sets, rpm_nvrs, repositories, published):
+            queried_chunks.append(list(repositories))
+            for name in repositories:
+                yield ContainerImage.create({"brew": {"build": name}})
+                # The query times out after the first page
+                if len(repositories) > 2:
+                    raise PyxisGQLRequestTimeout("Pyxis API was unable to fetch data from MongoDB")
+
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        pyxis.iter_images_with_included_rpms = mock.Mock(side_effect=fake_iter_images)
+        with patch.multiple(
+            freshmaker.conf,
+            pyxis_repository_chunk_size=4,
+            pyxis_repository_max_chunk_size=8,
+            pyxis_repository_chunk_fast_time=60,
+        ):
+            ret = list(
+                pyxis._iter_images_in_repository_chunks(
+                    ["content-set"], ["openssl-1.2.3-3"], repos, True
+                )
+            )
+
+        # The images yielded before the timeout are not yielded again
+        self.assertEqual([image.nvr for image in ret], list(repos))
+        self.assertEqual(
+            [len(chunk) for chunk in queried_chunks],
+            # The timed out chunk is split and the chunk size grows again
+            [4, 2, 2, 3, 1, 2],
+        )
+
+    def test_complete_nvr_pages(self):
+        def _image(nvr, arch):
+            return {"brew": {"build": nvr} if nvr else None, "architecture": arch}
+
+        pages = [
+            [_image(None, "amd64"), _image("a-1-1", "amd64"), _image("b-1-1", "amd64")],
+            [_image("b-1-1", "arm64"), _image("b-1-1", "s390x")],
+            [_image("b-1-1", "ppc64le"), _image("c-1-1", "amd64")],
+        ]
+
+        ret = list(PyxisAPI._complete_nvr_pages(iter(pages)))
+
+        self.assertEqual(
+            [[(x["brew"] or {}).get("build") for x in page] for page in ret],
+            [[None, "a-1-1"], ["b-1-1"] * 4, ["c-1-1"]],
+        )
+
     @patch("freshmaker.image.ContainerImage.resolve_published")
     @patch("freshmaker.pyxis_gql.Client")
     @patch("os.path.exists")
@@ -2009,6 +2331,106 @@ class TestQueryFromPyxis(helpers.FreshmakerTestCase):
             ),
         )
 
+    @staticmethod
+    def _pyxis_image_data(nvr, parent_brew_build=None, rpms=None):
+        return {
+            "architecture": "amd64",
+            "brew": {"build": nvr, "package": nvr.rsplit("-", 2)[0]},
+            "content_sets": ["dummy-content-set-1"],
+            "parent_brew_build": parent_brew_build,
+            "parsed_data": {"labels": []},
+            "repositories": [],
+            "edges": {"rpm_manifest": {"data": {"rpms": rpms or []}}},
+        }
+
+    @patch("freshmaker.image.ContainerImage.resolve")
+    @patch("freshmaker.image.PyxisAPI._query_images_by_nvrs")
+    @patch("os.path.exists")
+    def test_find_parent_image_chains(self, exists, query_images_by_nvrs, resolve):
+        exists.return_value = True
+        openssl = {"name": "openssl", "nvra": "openssl-1.2.3-1.x86_64"}
+        leaf_images = [
+            ContainerImage.create(
+                {
+                    "brew": {"build": nvr},
+                    "parent_brew_build": "parent-1-1",
+                    "rpm_manifest": [{"rpms": [openssl]}],
+                }
+            )
+            for nvr in ("child-a-1-1", "child-b-1-1")
+        ]
+        query_images_by_nvrs.side_effect = [
+            [self._pyxis_image_data("parent-1-1", "base-1-1", [openssl])],
+            [self._pyxis_image_data("base-1-1")],
+        ]
+
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        ret = pyxis.find_parent_image_chains(leaf_images, ["openssl", "bash"])
+
+        # The shared parents are fetched once per level of the hierarchy
+        query_images_by_nvrs.assert_has_calls([mock.call(["parent-1-1"]), mock.call(["base-1-1"])])
+        self.assertEqual(query_images_by_nvrs.call_count, 2)
+        self.assertEqual(len(ret), 2)
+        for leaf_image, rebuild_list in zip(leaf_images, ret):
+            self.assertEqual(list(rebuild_list.keys()), ["openssl"])
+            chain = rebuild_list["openssl"]
+            self.assertEqual([image.nvr for image in chain], [leaf_image.nvr, "parent-1-1"])
+            self.assertIs(leaf_image["parent"], chain[1])
+            # The base image doesn't have the package, but it's still the parent
+            self.assertEqual(chain[1]["parent"].nvr, "base-1-1")
+        # Each chain has its own parent image instance
+        self.assertIsNot(ret[0]["openssl"][1], ret[1]["openssl"][1])
+        # The parents are resolved from the data of the parent queries
+        self.assertEqual(
+            [c.args[3][0]["brew"]["build"] for c in resolve.call_args_list],
+            ["parent-1-1", "parent-1-1", "base-1-1", "base-1-1"],
+        )
+
+    @patch("freshmaker.image.ContainerImage.resolve")
+    @patch("freshmaker.image.PyxisAPI._query_images_by_nvrs")
+    @patch("os.path.exists")
+    def test_find_parent_image_chains_parent_without_package(
+        self, exists, query_images_by_nvrs, resolve
+    ):
+        exists.return_value = True
+        openssl = {"name": "openssl", "nvra": "openssl-1.2.3-1.x86_64"}
+        leaf_image = ContainerImage.create(
+            {
+                "brew": {"build": "child-1-1"},
+                "parent_brew_build": "base-1-1",
+                "rpm_manifest": [{"rpms": [openssl]}],
+            }
+        )
+        query_images_by_nvrs.return_value = [self._pyxis_image_data("base-1-1")]
+
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        ret = pyxis.find_parent_image_chains([leaf_image], ["openssl"])
+
+        self.assertEqual(ret, [{"openssl": [leaf_image]}])
+        self.assertEqual(leaf_image["parent"].nvr, "base-1-1")
+        # The parent is resolved from the data of the parent query
+        resolve.assert_called_once_with(
+            mock.ANY, [leaf_image], None, [self._pyxis_image_data("base-1-1")]
+        )
+
+    @patch("freshmaker.image.PyxisAPI._query_images_by_nvrs")
+    def test_get_images_by_nvrs_frozen_data(self, query_images_by_nvrs):
+        openssl = {"name": "openssl", "nvra": "openssl-1.2.3-1.x86_64"}
+        image_data = freeze(self._pyxis_image_data("parent-1-1", "base-1-1", [openssl]))
+        query_images_by_nvrs.return_value = [image_data]
+
+        pyxis = PyxisAPI(server_url=self.fake_server_url)
+        ret = pyxis.get_images_by_nvrs(["parent-1-1"], published=None, rpm_names=["openssl"])
+
+        self.assertEqual(len(ret), 1)
+        self.assertEqual(ret[0]["rpm_manifest"], [{"rpms": [openssl]}])
+        self.assertNotIn("edges", ret[0])
+        # The cached data is shared with the image instead of being copied
+        self.assertIn("edges", image_data)
+        self.assertIs(ret[0]["brew"], image_data["brew"])
+        ret[0]["content_sets"] = ["other-content-set"]
+        self.assertEqual(image_data["content_sets"], ["dummy-content-set-1"])
+
     @patch("freshmaker.image.PyxisAPI.get_images_by_nvrs")
     @patch("freshmaker.image.PyxisAPI.find_images_with_packages_from_content_set")
     @patch("freshmaker.image.PyxisAPI.find_parent_images_with_package")
@@ -2808,6 +3230,43 @@ class TestDeduplicateImagesToRebuild(helpers.FreshmakerTestCase):
                 else:
                     self.assertFalse(image.get("directly_affected"))
 
+    def test_batches_by_parent_depth(self):
+        httpd = self._create_imgs(
+            [
+                "httpd-2.4-12",
+                "s2i-base-1-10",
+                "s2i-core-1-11",
+                "rhel-server-docker-7.4-150",
+            ]
+        )
+        # The parent of httpd has been replaced by an image built directly
+        # from the base image, so httpd can be rebuilt right after it.
+        httpd[0]["parent"] = httpd[2]
+        batches = self.pyxis._images_to_rebuild_to_batches([httpd], set())
+        batches = [sorted_by_nvr(images) for images in batches]
+
+        expected = [[httpd[3]], [httpd[2]], [httpd[0], httpd[1]]]
+        self.assertEqual(batches, expected)
+
+    @patch("freshmaker.image.log")
+    def test_batches_with_dependency_cycle(self, log):
+        httpd = self._create_imgs(
+            [
+                "httpd-2.4-12",
+                "s2i-base-1-10",
+                "s2i-core-1-11",
+                "rhel-server-docker-7.4-150",
+            ]
+        )
+        # s2i-core and s2i-base depend on each other, httpd just depends on
+        # one of them.
+        httpd[2]["parent"] = httpd[1]
+        batches = self.pyxis._images_to_rebuild_to_batches([httpd], set())
+        batches = [sorted_by_nvr(images) for images in batches]
+
+        self.assertEqual(batches, [[httpd[3]], [httpd[0], httpd[1], httpd[2]]])
+        log.error.assert_called_once_with(mock.ANY, "s2i-base-1-10, s2i-core-1-11", 1)
+
     def test_parent_changed_in_latest_release(self):
         httpd = self._create_imgs(
             [
@@ -2851,6 +3310,76 @@ class TestDeduplicateImagesToRebuild(helpers.FreshmakerTestCase):
                 ret = self.pyxis._deduplicate_images_to_rebuild([httpd, perl])
                 self.assertEqual(ret, expected_images)
 
+    def test_deduplicator_add_incrementally(self):
+        httpd = self._create_imgs(["httpd-2.4-12", "s2i-base-1-10", "s2i-core-1-11"])
+        perl = self._create_imgs(["perl-5.7-1", "s2i-base-1-2", "s2i-core-1-2"])
+        python = self._create_imgs(["python-3.6-1", "s2i-base-1-12", "s2i-core-1-11"])
+
+        expected_images = [
+            self._create_imgs(["httpd-2.4-12", "s2i-base-1-12", "s2i-core-1-11"]),
+            self._create_imgs(["perl-5.7-1", "s2i-base-1-12", "s2i-core-1-11"]),
+            self._create_imgs(["python-3.6-1", "s2i-base-1-12", "s2i-core-1-11"]),
+        ]
+
+        deduplicator = ImagesToRebuildDeduplicator(self.pyxis)
+        deduplicator.add(httpd)
+        deduplicator.add(perl)
+        deduplicator.deduplicate()
+        self.assertIs(perl[1], httpd[1])
+        deduplicator.add(python)
+        ret = deduplicator.deduplicate()
+
+        self.assertEqual(ret, expected_images)
+        self.assertEqual(len(deduplicator), 3)
+        # The older releases of images are not referenced anymore.
+        self.assertEqual(
+            deduplicator._image_group_to_nvrs,
+            {
+                "httpd-2.4-['product/repo1']": ["httpd-2.4-12"],
+                "perl-5.7-['product/repo1']": ["perl-5.7-1"],
+                "python-3.6-['product/repo1']": ["python-3.6-1"],
+                "s2i-base-1-['product/repo1']": ["s2i-base-1-12"],
+                "s2i-core-1-['product/repo1']": ["s2i-core-1-11"],
+            },
+        )
+
+    def test_deduplicator_copies_content_sets_periodically(self):
+        httpd = self._create_imgs(["httpd-2.4-12", "s2i-base-1-10"])
+        del httpd[1]["content_sets_source"]
+        perl = self._create_imgs(["perl-5.7-1", ["s2i-base-1-2", {"content_sets": ["foo"]}]])
+        python = self._create_imgs(["python-3.6-1", "s2i-core-1-11"])
+
+        deduplicator = ImagesToRebuildDeduplicator(self.pyxis)
+        deduplicator.add(httpd)
+        deduplicator.add(perl)
+        deduplicator.deduplicate()
+        # s2i-base-1-10 has no content sets, they are copied from s2i-base-1-2
+        self.assertEqual(httpd[1]["content_sets"], ["foo"])
+        deduplicator.add(python)
+        ret = deduplicator.deduplicate()
+
+        # s2i-base-1-2 has been replaced by s2i-base-1-10, so its content sets
+        # are not copied anymore, even though the s2i-base image group did not
+        # change since the last deduplication.
+        self.assertEqual([image.nvr for image in ret[1]], ["perl-5.7-1", "s2i-base-1-10"])
+        self.assertEqual(ret[1][1]["content_sets"], [])
+
+    @patch("freshmaker.image.ImagesToRebuildDeduplicator._update_to_latest")
+    def test_deduplicator_handles_changed_image_groups(self, update_to_latest):
+        deduplicator = ImagesToRebuildDeduplicator(self.pyxis)
+        deduplicator.add(self._create_imgs(["httpd-2.4-12", "s2i-base-1-10"]))
+        deduplicator.deduplicate()
+        deduplicator.add(self._create_imgs(["perl-5.7-1", "s2i-base-1-2"]))
+        deduplicator.deduplicate()
+
+        self.assertEqual(
+            update_to_latest.call_args_list,
+            [
+                call(["httpd-2.4-['product/repo1']", "s2i-base-1-['product/repo1']"]),
+                call(["s2i-base-1-['product/repo1']", "perl-5.7-['product/repo1']"]),
+            ],
+        )
+
 
 @patch("os.path.exists", return_value=True)
 @patch("freshmaker.image.PyxisAPI.get_fixed_published_image")
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from freshmaker import conf
+from freshmaker.image import ContainerImage
+from freshmaker.image_async import PyxisAsyncAPI
+
+
+def _pyxis_image(nvr, parent_brew_build=None, rpms=None):
+    return {
+        "architecture": "amd64",
+        "brew": {"build": nvr, "package": nvr.rsplit("-", 2)[0]},
+        "content_sets": ["dummy-content-set-1"],
+        "parent_brew_build": parent_brew_build,
+        "parsed_data": {"labels": []},
+        "repositories": [
+            {
+                "registry": "registry.example.com",
+                "repository": "product/repo1",
+                "published": True,
+                "tags": [{"name": "latest"}],
+            }
+        ],
+        "edges": {"rpm_manifest": {"data": {"rpms": rpms or []}}},
+    }
+
+
+@pytest.fixture()
+def pyxis_async_api():
+    with patch("freshmaker.image.PyxisGQL"), patch(
+        "freshmaker.image_async.PyxisAsyncGQL"
+    ) as pyxis_async_gql:
+        pyxis_async_gql.return_value.timeout = 10
+        yield PyxisAsyncAPI(server_url="pyxis.localhost")
+
+
+def test_find_images_with_packages_from_content_set_queries_all_chunks(pyxis_async_api):
+    repos = {
+        f"product/repo{i}": {
+            "repository": f"product/repo{i}",
+            "auto_rebuild_tags": ["latest"],
+            "release_categories": ["Generally Available"],
+        }
+        for i in range(25)
+    }
+    pyxis_async_api.find_repositories = lambda *args, **kwargs: repos
+    pyxis_async_api.async_pyxis.find_images_by_installed_rpms = AsyncMock(return_value=[])
+
+    async def run():
+        pyxis_async_api._semaphore = asyncio.Semaphore(2)
+        return await pyxis_async_api._find_images_with_packages_from_content_set(
+            ["openssl-1.2.3-3"], ["dummy-content-set-1"]
+        )
+
+    assert asyncio.run(run()) == []
+    # 25 repositories are split into two chunks
+    assert pyxis_async_api.async_pyxis.find_images_by_installed_rpms.await_count == 2
+
+
+def test_find_images_with_packages_from_content_set_splits_timed_out_chunks(pyxis_async_api):
+    repos = {
+        f"product/repo{i}": {
+            "repository": f"product/repo{i}",
+            "auto_rebuild_tags": ["latest"],
+            "release_categories": ["Generally Available"],
+        }
+        for i in range(3)
+    }
+    pyxis_async_api.find_repositories = lambda *args, **kwargs: repos
+
+    async def _find_images_by_installed_rpms(rpm_names, content_sets, repositories, *args):
+        if len(repositories) > 2:
+            raise TimeoutError()
+        return []
+
+    pyxis_async_api.async_pyxis.find_images_by_installed_rpms = AsyncMock(
+        side_effect=_find_images_by_installed_rpms
+    )
+
+    async def run():
+        pyxis_async_api._semaphore = asyncio.Semaphore(2)
+        return await pyxis_async_api._find_images_with_packages_from_content_set(
+            ["openssl-1.2.3-3"], ["dummy-content-set-1"]
+        )
+
+    assert asyncio.run(run()) == []
+    # The chunk which timed out is queried again in halves
+    queried = [
+        call.args[2]
+        for call in pyxis_async_api.async_pyxis.find_images_by_installed_rpms.call_args_list
+    ]
+    assert queried == [
+        ["product/repo0", "product/repo1", "product/repo2"],
+        ["product/repo0"],
+        ["product/repo1", "product/repo2"],
+    ]
+
+
+@patch("freshmaker.image.ContainerImage.resolve")
+def test_find_parent_image_chains(resolve, pyxis_async_api):
+    child = ContainerImage.create(
+        {
+            "brew": {"build": "child-1-1"},
+            "parent_brew_build": "parent-1-1",
+            "rpm_manifest": [{"rpms": [{"name": "openssl", "nvra": "openssl-1.2.3-1.x86_64"}]}],
+        }
+    )
+    openssl = {"name": "openssl", "nvra": "openssl-1.2.3-1.x86_64"}
+    pyxis_async_api.async_pyxis.find_images_by_nvr = AsyncMock(
+        side_effect=[
+            [_pyxis_image("parent-1-1", parent_brew_build="base-1-1", rpms=[openssl])],
+            [_pyxis_image("base-1-1", rpms=[])],
+        ]
+    )
+
+    @contextmanager
+    def _pyxis_gql_client(url, cert):
+        yield Mock()
+
+    async def run():
+        pyxis_async_api._semaphore = asyncio.Semaphore(2)
+        return await pyxis_async_api._find_parent_image_chains([child], ["openssl"])
+
+    with patch("freshmaker.image_async.pyxis_gql_client", _pyxis_gql_client):
+        ret = asyncio.run(run())
+
+    assert [image.nvr for image in ret[0]["openssl"]] == ["child-1-1", "parent-1-1"]
+    assert child["parent"].nvr == "parent-1-1"
+    # The parent without the package is still set as parent of the last image
+    assert ret[0]["openssl"][1]["parent"].nvr == "base-1-1"
+    # The parents are queried once per level
+    assert pyxis_async_api.async_pyxis.find_images_by_nvr.await_count == 2
+
+
+@patch("freshmaker.image.get_rpm_index")
+def test_find_images_with_included_rpms_from_rpm_index(get_rpm_index, pyxis_async_api):
+    get_rpm_index.return_value.find_image_nvrs.return_value = {"image-1-1"}
+    openssl = {"name": "openssl", "nvra": "openssl-1.2.3-1.x86_64", "srpm_name": "openssl"}
+    pyxis = Mock()
+    pyxis.find_images_by_nvrs.return_value = [_pyxis_image("image-1-1", rpms=[openssl])]
+    pyxis_async_api.async_pyxis.find_images_by_installed_rpms = AsyncMock()
+    repositories = {
+        "product/repo1": {
+            "repository": "product/repo1",
+            "auto_rebuild_tags": ["latest"],
+            "release_categories": ["Generally Available"],
+        }
+    }
+
+    @contextmanager
+    def _pyxis_gql_client(url, cert):
+        yield pyxis
+
+    async def run():
+        pyxis_async_api._semaphore = asyncio.Semaphore(2)
+        return await pyxis_async_api._find_images_with_included_rpms(
+            ["dummy-content-set-1"], ["openssl-1.2.3-3"], repositories
+        )
+
+    with patch("freshmaker.image_async.pyxis_gql_client", _pyxis_gql_client):
+        ret = asyncio.run(run())
+
+    assert [image.nvr for image in ret] == ["image-1-1"]
+    # The candidates from the index are confirmed instead of scanning Pyxis
+    pyxis.find_images_by_nvrs.assert_called_once()
+    pyxis_async_api.async_pyxis.find_images_by_installed_rpms.assert_not_awaited()
+
+
+@patch.object(conf, "persist_image_lineage", new=True)
+@patch("freshmaker.image.ImageLineage")
+@patch("freshmaker.image_async.PyxisAsyncAPI._resolve_image", new_callable=AsyncMock)
+def test_find_parent_brew_build_nvr_from_child_lineage(
+    resolve_image, image_lineage, pyxis_async_api
+):
+    image_lineage.get_parent.side_effect = lambda nvr: (
+        (True, "parent-1-1") if nvr == "recorded-1-1" else (False, None)
+    )
+    recorded = ContainerImage.create({"brew": {"build": "recorded-1-1"}})
+    unknown = ContainerImage.create({"brew": {"build": "unknown-1-1"}})
+
+    async def _resolve(image, children=None):
+        image["parent_build_id"] = 2
+        image["parent_image_builds"] = {"parent:1": {"id": 2, "nvr": "base-1-1"}}
+
+    resolve_image.side_effect = _resolve
+
+    async def run():
+        pyxis_async_api._semaphore = asyncio.Semaphore(2)
+        return [
+            await pyxis_async_api._find_parent_brew_build_nvr_from_child(image)
+            for image in (recorded, unknown)
+        ]
+
+    assert asyncio.run(run()) == ["parent-1-1", "base-1-1"]
+    # The recorded parent is used without resolving the image
+    resolve_image.assert_awaited_once_with(unknown)
+    # The parent found by resolving the image is recorded
+    image_lineage.record.assert_called_once_with("unknown-1-1", "base-1-1")
+
+
+@patch("freshmaker.image_async.PyxisAsyncAPI._finalize_images_to_rebuild")
+@patch("freshmaker.image_async.PyxisAsyncAPI._find_rebuild_lists", new_callable=AsyncMock)
+def test_find_images_to_rebuild(find_rebuild_lists, finalize, pyxis_async_api):
+    image = ContainerImage.create({"brew": {"build": "child-1-1"}})
+    find_rebuild_lists.return_value = ([[image]], [image])
+    finalize.return_value = [[image]]
+
+    ret = pyxis_async_api.find_images_to_rebuild(["openssl-1.2.3-3"], ["dummy-content-set-1"])
+
+    assert ret == [[image]]
+    finalize.assert_called_once_with(
+        [[image]], [image], ["openssl-1.2.3-3"], ["dummy-content-set-1"]
+    )
@@ -20,6 +20,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import dogpile.cache
+import koji
+from dogpile.cache.api import NO_VALUE
 from unittest import mock
 
 from freshmaker import kojiservice  # noqa E402
@@ -214,3 +217,184 @@ def test_get_modulemd(mock_koji):
     module_stream = mmd.get_stream_name()
     assert module_name == "ghc"
     assert module_stream == "9.2"
+
+
+class _VirtualCall:
+    """Result of a call in a fake Koji multicall"""
+
+    def __init__(self, result):
+        self._result = result
+
+    @property
+    def result(self):
+        if isinstance(self._result, Exception):
+            raise self._result
+        return self._result
+
+
+@mock.patch("freshmaker.kojiservice.conf")
+@mock.patch("freshmaker.kojiservice.koji")
+def test_get_container_builds(mock_koji, mock_conf):
+    mock_conf.koji_multicall_batch_size = 10
+    mock_koji.GenericError = koji.GenericError
+    mock_koji.Fault = koji.Fault
+    builds = {
+        "foo-1-1": {"build_id": 1, "task_id": 11},
+        "bar-1-1": {"build_id": 2, "task_id": None, "extra": {"container_koji_task_id": 12}},
+        "baz-1-1": None,
+        "qux-1-1": koji.GenericError("Internal error"),
+    }
+    task_requests = {11: ["git://foo#1", "target", {}], 12: koji.GenericError("No such task")}
+    archives = {
+        1: [
+            {"btype": "image", "extra": {"image": {"arch": "x86_64"}}},
+            {"btype": "image", "extra": {"image": {"arch": "aarch64"}}},
+        ],
+        2: [{"btype": "log", "extra": {}}],
+    }
+    multicall = mock.MagicMock()
+    multicall.getBuild.side_effect = lambda nvr: _VirtualCall(builds[nvr])
+    multicall.getTaskRequest.side_effect = lambda task_id: _VirtualCall(task_requests[task_id])
+    multicall.listArchives.side_effect = lambda build_id: _VirtualCall(archives[build_id])
+    mock_session = mock.MagicMock()
+    mock_session.multicall.return_value.__enter__.return_value = multicall
+    mock_koji.ClientSession.return_value = mock_session
+
+    svc = kojiservice.KojiService()
+    result = svc.get_container_builds(["foo-1-1", "bar-1-1", "baz-1-1", "qux-1-1"], True)
+
+    assert result == {
+        "foo-1-1": {
+            "build": builds["foo-1-1"],
+            "task_request": ["git://foo#1", "target", {}],
+            "arches": "aarch64 x86_64",
+        },
+        "bar-1-1": {"build": builds["bar-1-1"], "task_request": None, "arches": ""},
+        "baz-1-1": {"build": None, "task_request": None, "arches": None},
+        "qux-1-1": {"build": None, "task_request": None, "arches": None},
+    }
+    # One multicall request for each kind of data
+    assert mock_session.multicall.call_count == 3
+    mock_session.multicall.assert_called_with(strict=False, batch=10)
+
+
+@mock.patch("freshmaker.kojiservice.conf")
+@mock.patch("freshmaker.kojiservice.koji")
+def test_get_container_builds_cached(mock_koji, mock_conf):
+    mock_conf.koji_multicall_batch_size = 10
+    mock_koji.GenericError = koji.GenericError
+    mock_koji.Fault = koji.Fault
+    mock_koji.BUILD_STATES = koji.BUILD_STATES
+    complete = koji.BUILD_STATES["COMPLETE"]
+    builds = {
+        "foo-1-1": {"build_id": 1, "task_id": 11, "state": complete},
+        "bar-1-1": {"build_id": 2, "task_id": 12, "state": complete},
+        "baz-1-1": {"build_id": 3, "task_id": 13, "state": koji.BUILD_STATES["BUILDING"]},
+    }
+    task_requests = {11: ["git://foo#1"], 12: ["git://bar#1"], 13: ["git://baz#1"]}
+    multicall = mock.MagicMock()
+    multicall.getBuild.side_effect = lambda nvr: _VirtualCall(builds[nvr])
+    multicall.getTaskRequest.side_effect = lambda task_id: _VirtualCall(task_requests[task_id])
+    mock_session = mock.MagicMock()
+    mock_session.multicall.return_value.__enter__.return_value = multicall
+    mock_koji.ClientSession.return_value = mock_session
+    mock_koji.read_config.return_value = {"server": "https://koji.example.com/kojihub"}
+    get_build_key = "freshmaker.kojiservice:get_build|https://koji.example.com/kojihub|%s"
+    get_task_request_key = (
+        "freshmaker.kojiservice:get_task_request|https://koji.example.com/kojihub|%s"
+    )
+
+    region = dogpile.cache.make_region().configure("dogpile.cache.memory")
+    immutable_region = dogpile.cache.make_region().configure("dogpile.cache.memory")
+    # The data cached by get_build and get_task_request is not fetched again
+    region.set(get_build_key % "foo-1-1", builds["foo-1-1"])
+    immutable_region.set(get_build_key % "bar-1-1", builds["bar-1-1"])
+    immutable_region.set(get_task_request_key % 11, task_requests[11])
+
+    with mock.patch.object(kojiservice.KojiService, "region", new=region), mock.patch.object(
+        kojiservice, "immutable_region", new=immutable_region
+    ):
+        svc = kojiservice.KojiService()
+        result = svc.get_container_builds(["foo-1-1", "bar-1-1", "baz-1-1"])
+
+    assert {nvr: data["build"] for nvr, data in result.items()} == builds
+    assert [data["task_request"] for data in result.values()] == list(task_requests.values())
+    multicall.getBuild.assert_called_once_with("baz-1-1")
+    assert multicall.getTaskRequest.call_args_list == [mock.call(12), mock.call(13)]
+    # The fetched data is cached for get_build and get_task_request, only
+    # the completed builds in the immutable cache
+    for nvr in builds:
+        assert region.get(get_build_key % nvr) == builds[nvr]
+    assert immutable_region.get(get_build_key % "baz-1-1") is NO_VALUE
+    for task_id, task_request in task_requests.items():
+        assert immutable_region.get(get_task_request_key % task_id) == task_request
+
+
+def test_server_key_generator():
+    generate_key = kojiservice._server_key_generator(None, kojiservice.KojiService.get_build)
+    koji_service = mock.Mock(server="https://koji.example.com/kojihub")
+    stage_koji_service = mock.Mock(server="https://koji.stage.example.com/kojihub")
+
+    # The builds of different Koji instances with the same NVR don't mix
+    assert generate_key(koji_service, "foo-1-1") == (
+        "freshmaker.kojiservice:get_build|https://koji.example.com/kojihub|foo-1-1"
+    )
+    assert generate_key(stage_koji_service, "foo-1-1") == (
+        "freshmaker.kojiservice:get_build|https://koji.stage.example.com/kojihub|foo-1-1"
+    )
+
+
+@mock.patch("freshmaker.kojiservice.time.monotonic")
+@mock.patch("freshmaker.kojiservice.conf")
+@mock.patch("freshmaker.kojiservice.koji")
+def test_koji_session_pool(mock_koji, mock_conf, monotonic):
+    mock_koji.AuthError = koji.AuthError
+    mock_conf.koji_session_pool_size = 1
+    mock_conf.koji_session_max_age = 3600
+    mock_conf.koji_session_health_check_interval = 300
+    mock_conf.krb_auth_principal = "freshmaker"
+    mock_session = mock.Mock()
+    mock_session.logged_in = True
+    mock_session.getLoggedInUser.return_value = {"name": "freshmaker"}
+    mock_koji.ClientSession.return_value = mock_session
+    monotonic.return_value = 0
+
+    with mock.patch.dict(kojiservice._session_pools, clear=True):
+        # The session is logged in once and reused
+        for _ in range(2):
+            with kojiservice.koji_service("koji") as service:
+                service.cancel_build(1)
+        mock_koji.ClientSession.assert_called_once()
+        assert mock_session.gssapi_login.call_count == 1
+        mock_session.logout.assert_not_called()
+        mock_session.getLoggedInUser.assert_not_called()
+
+        # The login of idle sessions is checked
+        monotonic.return_value = 600
+        mock_session.getLoggedInUser.return_value = None
+        with kojiservice.koji_service("koji"):
+            pass
+        mock_session.getLoggedInUser.assert_called_once()
+        assert mock_session.gssapi_login.call_count == 2
+
+        # Old sessions are logged in again
+        monotonic.return_value = 4800
+        with kojiservice.koji_service("koji"):
+            pass
+        assert mock_session.gssapi_login.call_count == 3
+
+        # Sessions with authentication errors are discarded
+        mock_session.logout.reset_mock()
+        try:
+            with kojiservice.koji_service("koji"):
+                raise koji.AuthError("expired")
+        except koji.AuthError:
+            pass
+        mock_session.logout.assert_called_once()
+        assert mock_koji.ClientSession.call_count == 1
+        with kojiservice.koji_service("koji"):
+            pass
+        assert mock_koji.ClientSession.call_count == 2
+
+        kojiservice._session_pools[("koji", False)].close()
+        assert mock_session.logout.call_count == 2
@@ -21,13 +21,14 @@
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
 import datetime
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from freshmaker import db, events
 from freshmaker.models import ArtifactBuild, ArtifactType
 from freshmaker.models import Event, EventState, EVENT_TYPES, EventDependency
-from freshmaker.models import Compose, ArtifactBuildCompose
+from freshmaker.models import Compose, ArtifactBuildCompose, ImageLineage, BuildSubmission
 from freshmaker.types import ArtifactBuildState, RebuildReason
+from freshmaker.errata import ErrataAdvisory
 from freshmaker.events import ErrataRPMAdvisoryShippedEvent
 from tests import helpers
 
@@ -222,6 +223,7 @@ class TestModels(helpers.ModelsTestCase):
                 "state_reason": None,
                 "time_created": "2017-08-21T13:42:20Z",
                 "time_done": None,
+                "predicted_time_done": None,
                 "url": "http://localhost:5001/api/1/events/1",
                 "requested_rebuilds": [],
                 "requester_metadata": {},
@@ -494,3 +496,212 @@ class TestEventDependency(helpers.ModelsTestCase):
 
         self.assertEqual(event.id, dep_rel.event_id)
         self.assertEqual(event1.id, dep_rel.event_dependency_id)
+
+
+class TestImageLineage(helpers.ModelsTestCase):
+    def test_record_and_get_parent(self):
+        self.assertEqual(ImageLineage.get_parent("foo-1-1"), (False, None))
+
+        ImageLineage.record("foo-1-1", "parent-1-1")
+        ImageLineage.record("base-1-1", None)
+
+        self.assertEqual(ImageLineage.get_parent("foo-1-1"), (True, "parent-1-1"))
+        self.assertEqual(ImageLineage.get_parent("base-1-1"), (True, None))
+
+        ImageLineage.record("foo-1-1", "parent-1-2")
+        self.assertEqual(ImageLineage.get_parent("foo-1-1"), (True, "parent-1-2"))
+
+    def test_get_ancestors(self):
+        ImageLineage.record("child-1-1", "parent-1-1")
+        ImageLineage.record("parent-1-1", "base-1-1")
+        ImageLineage.record("base-1-1", None)
+        ImageLineage.record("other-1-1", "unknown-1-1")
+
+        ancestors = ImageLineage.get_ancestors(["child-1-1", "other-1-1", "missing-1-1"])
+
+        self.assertEqual(
+            ancestors,
+            {
+                "child-1-1": ["parent-1-1", "base-1-1", None],
+                "other-1-1": ["unknown-1-1"],
+            },
+        )
+        self.assertEqual(
+            ImageLineage.get_ancestors(["child-1-1"], max_depth=2),
+            {"child-1-1": ["parent-1-1", "base-1-1"]},
+        )
+        self.assertEqual(ImageLineage.get_ancestors([]), {})
+
+
+class TestBuildSubmission(helpers.ModelsTestCase):
+    def _create_builds(self, message_id, count, priority=0):
+        event = Event.create(
+            db.session, message_id, "RHSA-1", ErrataRPMAdvisoryShippedEvent, priority=priority
+        )
+        builds = [
+            ArtifactBuild.create(
+                db.session,
+                event,
+                "%s-%d" % (message_id, i),
+                "image",
+                state=ArtifactBuildState.PLANNED.value,
+            )
+            for i in range(count)
+        ]
+        db.session.commit()
+        return builds
+
+    def test_get_or_create_from_event_priority(self):
+        advisory = ErrataAdvisory(123, "RHSA-1", "SHIPPED_LIVE", ["rpm"], is_major_incident=True)
+        event = ErrataRPMAdvisoryShippedEvent("msg-1", advisory)
+        db_event = Event.get_or_create_from_event(db.session, event)
+        self.assertEqual(db_event.priority, 2)
+
+    def test_enqueue(self):
+        (build,) = self._create_builds("msg-1", 1, priority=1)
+
+        submission = BuildSubmission.enqueue(db.session, build)
+        db.session.commit()
+        self.assertEqual(submission.priority, 1)
+        self.assertEqual(submission.event_id, build.event_id)
+
+        self.assertEqual(BuildSubmission.enqueue(db.session, build), submission)
+        db.session.commit()
+        self.assertEqual(db.session.query(BuildSubmission).count(), 1)
+
+    def test_claim_next(self):
+        routine = self._create_builds("routine", 4)
+        other = self._create_builds("other", 2)
+        urgent = self._create_builds("urgent", 2, priority=2)
+        for build in routine + other + urgent:
+            BuildSubmission.enqueue(db.session, build)
+        db.session.commit()
+
+        submissions = BuildSubmission.claim_next(db.session, 5, 600)
+        db.session.commit()
+
+        self.assertEqual(
+            [submission.build for submission in submissions],
+            [urgent[0], urgent[1], routine[0], other[0], routine[1]],
+        )
+        # The claimed submissions are not claimed again, until the claim expires.
+        self.assertEqual(
+            [submission.build for submission in BuildSubmission.claim_next(db.session, 100, 600)],
+            [routine[2], other[1], routine[3]],
+        )
+        self.assertEqual(BuildSubmission.claim_next(db.session, 100, 600), [])
+        self.assertEqual(len(BuildSubmission.claim_next(db.session, 100, -1)), 8)
+
+    def test_enqueue_releases_claim(self):
+        (build,) = self._create_builds("msg-1", 1)
+        BuildSubmission.enqueue(db.session, build)
+        db.session.commit()
+        (submission,) = BuildSubmission.claim_next(db.session, 1, 600)
+        db.session.commit()
+        self.assertIsNotNone(submission.time_claimed)
+
+        BuildSubmission.enqueue(db.session, build)
+        db.session.commit()
+
+        self.assertEqual(BuildSubmission.claim_next(db.session, 1, 600), [submission])
+
+    def test_count_claimed(self):
+        builds = self._create_builds("msg-1", 3)
+        for build in builds:
+            BuildSubmission.enqueue(db.session, build)
+        db.session.commit()
+        BuildSubmission.claim_next(db.session, 2, 600)
+        builds[0].state = ArtifactBuildState.BUILD.value
+        db.session.commit()
+
+        # Only the claimed builds which are not submitted yet are counted.
+        self.assertEqual(BuildSubmission.count_claimed(db.session, 600), 1)
+        self.assertEqual(BuildSubmission.count_claimed(db.session, -1), 0)
+
+    def test_lock_queue(self):
+        session = Mock()
+        session.bind.dialect.name = "sqlite"
+        BuildSubmission.lock_queue(session)
+        session.execute.assert_not_called()
+
+        session.bind.dialect.name = "postgresql"
+        BuildSubmission.lock_queue(session)
+        (statement,) = session.execute.call_args.args
+        self.assertIn("pg_advisory_xact_lock", str(statement))
+
+
+class TestExpectedDurations(helpers.ModelsTestCase):
+    def _create_done_build(self, event, name, original_nvr, minutes):
+        build = ArtifactBuild.create(
+            db.session,
+            event,
+            name,
+            "image",
+            state=ArtifactBuildState.DONE.value,
+            original_nvr=original_nvr,
+        )
+        build.time_build_started = datetime.datetime(2026, 1, 1, 10, 0)
+        build.time_completed = build.time_build_started + datetime.timedelta(minutes=minutes)
+        return build
+
+    def test_get_expected_durations(self):
+        event = Event.create(db.session, "msg-1", "RHSA-1", ErrataRPMAdvisoryShippedEvent)
+        self._create_done_build(event, "foo", "foo-1.0-1", 10)
+        self._create_done_build(event, "foo", "foo-1.0-2", 20)
+        self._create_done_build(event, "foo", "foo-1.0-3", 60)
+        self._create_done_build(event, "foo", "foo-2.0-1", 100)
+        # The name-version of foo-1.0-beta-1 is foo-1.0-beta.
+        self._create_done_build(event, "foo", "foo-1.0-beta-1", 1000)
+        failed = ArtifactBuild.create(
+            db.session, event, "bar", "image", state="failed", original_nvr="bar-1.0-1"
+        )
+        failed.time_build_started = failed.time_submitted
+        failed.time_completed = failed.time_build_started + datetime.timedelta(minutes=5)
+        # The builds submitted before the submission time was recorded.
+        unknown = self._create_done_build(event, "baz", "baz-1.0-1", 5)
+        unknown.time_build_started = None
+
+        planned = [
+            ArtifactBuild.create(
+                db.session, event, name, "image", state="planned", original_nvr=nvr
+            )
+            for name, nvr in (
+                ("foo", "foo-1.0-4"),
+                ("foo", "foo-3.0-1"),
+                ("bar", "bar-1.0-2"),
+                ("baz", "baz-1.0-2"),
+            )
+        ]
+        db.session.commit()
+
+        durations = ArtifactBuild.get_expected_durations(db.session, planned, 3600)
+
+        self.assertEqual(
+            durations,
+            {
+                # Median of the builds of the same name-version.
+                planned[0].id: 20 * 60,
+                # Median of the builds of the same name.
+                planned[1].id: 60 * 60,
+                # Only the successful builds are taken into account.
+                planned[2].id: 3600,
+                # Only the builds with known submission time are.
+                planned[3].id: 3600,
+            },
+        )
+        # The last builds are counted per name-version.
+        self.assertEqual(
+            ArtifactBuild.get_expected_durations(db.session, planned[:2], 3600, history_size=1),
+            {planned[0].id: 60 * 60, planned[1].id: 1000 * 60},
+        )
+
+    def test_transition_to_build_sets_time_build_started(self):
+        event = Event.create(db.session, "msg-1", "RHSA-1", ErrataRPMAdvisoryShippedEvent)
+        build = ArtifactBuild.create(db.session, event, "foo", "image", state="planned")
+        time_submitted = build.time_submitted
+        db.session.commit()
+
+        build.transition(ArtifactBuildState.BUILD.value, "Building container image in Koji.")
+
+        self.assertEqual(build.time_submitted, time_submitted)
+        self.assertIsNotNone(build.time_build_started)
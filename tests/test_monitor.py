@@ -30,7 +30,25 @@ from unittest import mock
 from freshmaker import app, db, events, models, login_manager
 from tests import helpers
 
-num_of_metrics = 44
+num_of_metrics = 57
+# The "_created" gauges of the metrics with labels are exported only once a
+# value is recorded for some labels, which depends on the tests run before.
+labelled_metrics_created = (
+    "singleflight_coalesced_created",
+    "pyxis_query_latency_created",
+    "pyxis_query_response_size_created",
+    "build_submission_queue_wait_time_created",
+)
+
+
+def count_metrics(text):
+    return len(
+        [
+            line
+            for line in text.splitlines()
+            if line.startswith("# TYPE") and line.split()[2] not in labelled_metrics_created
+        ]
+    )
 
 
 @login_manager.user_loader
@@ -66,16 +84,7 @@ class TestViews(helpers.ModelsTestCase):
 
     def test_monitor_api_structure(self):
         resp = self.client.get("/api/1/monitor/metrics")
-        self.assertEqual(
-            len(
-                [
-                    line
-                    for line in resp.get_data(as_text=True).splitlines()
-                    if line.startswith("# TYPE")
-                ]
-            ),
-            num_of_metrics,
-        )
+        self.assertEqual(count_metrics(resp.get_data(as_text=True)), num_of_metrics)
 
 
 class ConsumerTest(helpers.ConsumerBaseTest):
@@ -149,6 +158,4 @@ def test_standalone_metrics_server():
 
     r = requests.get("http://127.0.0.1:10040/metrics")
 
-    assert (
-        len([line for line in r.text.splitlines() if line.startswith("# TYPE")]) == num_of_metrics
-    )
+    assert count_metrics(r.text) == num_of_metrics
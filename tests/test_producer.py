@@ -27,7 +27,7 @@ import koji
 from unittest.mock import patch, MagicMock
 import queue
 
-from freshmaker import db
+from freshmaker import conf, db
 from freshmaker.events import ErrataRPMAdvisoryShippedEvent
 from freshmaker.models import ArtifactBuild, Event
 from freshmaker.types import EventState, ArtifactBuildState
@@ -114,6 +114,58 @@ class TestCheckUnfinishedKojiTasks(helpers.ModelsTestCase):
         producer.check_unfinished_koji_tasks(db.session)
         self.assertRaises(queue.Empty, consumer.incoming.get, block=False)
 
+    @patch("freshmaker.kojiservice.KojiService.get_tasks_info")
+    @patch("freshmaker.consumer.get_global_consumer")
+    def test_koji_tasks_multicall(self, global_consumer, get_tasks_info):
+        build = ArtifactBuild.create(db.session, self.build.event, "parent2-1-4", "image")
+        build.state = ArtifactBuildState.BUILD
+        build.build_id = 11
+        done_build = ArtifactBuild.create(db.session, self.build.event, "parent3-1-4", "image")
+        done_build.state = ArtifactBuildState.DONE
+        done_build.build_id = 12
+        db.session.commit()
+        consumer = self.create_consumer()
+        global_consumer.return_value = consumer
+
+        get_tasks_info.return_value = {
+            10: {"state": koji.TASK_STATES["OPEN"]},
+            11: {"state": koji.TASK_STATES["CLOSED"]},
+        }
+
+        hub = MagicMock()
+        producer = FreshmakerProducer(hub)
+        with patch.object(conf, "koji_multicall_batching", new=True):
+            producer.check_unfinished_koji_tasks(db.session)
+        get_tasks_info.assert_called_once_with([10, 11])
+        event = consumer.incoming.get()
+        self.assertEqual(event.task_id, 11)
+        self.assertEqual(event.new_state, "CLOSED")
+        self.assertRaises(queue.Empty, consumer.incoming.get, block=False)
+
+    @patch("freshmaker.producer.time.monotonic")
+    @patch("freshmaker.kojiservice.KojiService.get_task_info")
+    @patch("freshmaker.consumer.get_global_consumer")
+    def test_koji_task_poll_backoff(self, global_consumer, get_task_info, monotonic):
+        consumer = self.create_consumer()
+        global_consumer.return_value = consumer
+        get_task_info.return_value = {"state": koji.TASK_STATES["OPEN"]}
+
+        hub = MagicMock()
+        producer = FreshmakerProducer(hub)
+        checked = []
+        with patch.object(conf, "polling_interval", new=60), patch.object(
+            conf, "koji_task_poll_max_interval", new=240
+        ):
+            for poll in range(12):
+                monotonic.return_value = poll * 60
+                get_task_info.reset_mock()
+                producer.check_unfinished_koji_tasks(db.session)
+                if get_task_info.called:
+                    checked.append(poll)
+
+        # The task is checked after 1, 2, 4 and then at most 4 polls.
+        self.assertEqual(checked, [0, 1, 3, 7, 11])
+
     @patch("freshmaker.kojiservice.KojiService.get_task_info")
     @patch("freshmaker.consumer.get_global_consumer")
     def test_koji_invalid_request(self, global_consumer, get_task_info):
@@ -147,3 +199,16 @@ class TestCheckUnfinishedKojiTasks(helpers.ModelsTestCase):
         # Check if connection to db is established again
         my_session.connection().scalar(select([1]))
         self.assertFalse(my_session.connection().invalidated)
+
+    @patch("freshmaker.producer.RebuildImagesOnParentImageBuild.submit_queued_builds")
+    @patch("freshmaker.kojiservice.KojiService.get_task_info")
+    def test_poll_submits_queued_builds(self, get_task_info, submit_queued_builds):
+        get_task_info.return_value = {"state": koji.TASK_STATES["OPEN"]}
+
+        producer = FreshmakerProducer(MagicMock())
+        producer.poll()
+        submit_queued_builds.assert_not_called()
+
+        with patch.object(conf, "build_submission_max_in_flight", new=2):
+            producer.poll()
+        submit_queued_builds.assert_called_once_with()
@@ -22,14 +22,33 @@
 
 import copy
 import os
-from unittest.mock import patch
+import threading
+import time
+from unittest.mock import Mock, patch
 
+import pytest
 from flexmock import flexmock
 from gql import Client
 from gql.dsl import DSLSchema
-from graphql import build_ast_schema, parse
+from graphql import build_ast_schema, parse, print_ast
 
-from freshmaker.pyxis_gql import PyxisGQL, PyxisGQLRequestError
+from freshmaker.pyxis_gql import (
+    IMAGE_PROJECTION_FULL,
+    IMAGE_PROJECTION_MINIMAL,
+    IMAGE_PROJECTION_REPOS,
+    IMAGE_PROJECTION_RPM_NAMES,
+    PyxisGQL,
+    PyxisGQLPool,
+    PyxisNVRBatcher,
+    PyxisPageSizeController,
+    PyxisRepositoryCatalog,
+    PyxisGQLRequestError,
+    PyxisGQLRequestTimeout,
+    get_pyxis_gql_pool,
+    get_repository_catalog,
+    pyxis_gql_client,
+    timeout_retries,
+)
 
 
 def test_pyxis_graphql_find_repositories():
@@ -406,7 +425,7 @@ def test_pyxis_graphql_find_images_by_nvrs():
     flexmock(Client).should_receive("execute").and_return(copy.deepcopy(result))
 
     nvrs = ["foobar-container-v0.13.0-12.1582340001"]
-    images = pyxis_gql.find_images_by_nvrs(nvrs, include_rpms=True)
+    images = pyxis_gql.find_images_by_nvrs(nvrs, projection=IMAGE_PROJECTION_FULL)
     expected = copy.deepcopy(result["find_images"]["data"])
 
     assert images == expected
@@ -609,3 +628,586 @@ def test_log_trace_id(mock_client, mock_transport):
     except PyxisGQLRequestError as e:
         assert e.error == str(result["find_images"]["error"])
         assert e.trace_id == mock_transport.return_value.response_headers["trace_id"]
+
+
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_keep_alive_reuses_session(mock_client, mock_transport):
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert", keep_alive=True)
+    session = mock_client.return_value.connect_sync.return_value
+
+    pyxis_gql._execute("query1")
+    pyxis_gql._execute("query2")
+
+    mock_client.return_value.connect_sync.assert_called_once()
+    mock_client.return_value.execute.assert_not_called()
+    assert session.execute.call_count == 2
+
+    pyxis_gql.close()
+    mock_client.return_value.close_sync.assert_called_once()
+
+
+@patch("freshmaker.pyxis_gql.PyxisGQL")
+def test_pool_reuses_clients(mock_pyxis_gql):
+    mock_pyxis_gql.side_effect = lambda **kwargs: object()
+    pool = PyxisGQLPool("graphql.pyxis.local", ("cert", "key"), 2)
+
+    with pool.client() as client1:
+        with pool.client() as client2:
+            assert client1 is not client2
+    with pool.client() as client3:
+        assert client3 in (client1, client2)
+
+    assert mock_pyxis_gql.call_count == 2
+    mock_pyxis_gql.assert_called_with(
+        url="graphql.pyxis.local", cert=("cert", "key"), keep_alive=True
+    )
+
+
+@patch("freshmaker.pyxis_gql.PyxisGQL")
+def test_pool_waits_for_client(mock_pyxis_gql):
+    pool = PyxisGQLPool("graphql.pyxis.local", ("cert", "key"), 1)
+    borrowed = []
+
+    def borrow():
+        with pool.client() as client:
+            borrowed.append(client)
+
+    with pool.client() as client:
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        thread.join(0.1)
+        # The only client is in use, so the thread waits for it
+        assert thread.is_alive()
+    thread.join()
+
+    assert borrowed == [client]
+    assert mock_pyxis_gql.call_count == 1
+
+
+@patch("freshmaker.pyxis_gql._pools", new={})
+@patch("freshmaker.pyxis_gql.conf")
+def test_get_pyxis_gql_pool(mock_conf):
+    mock_conf.pyxis_gql_pool_size = 0
+    mock_conf.max_thread_workers = 5
+
+    pool = get_pyxis_gql_pool("graphql.pyxis.local", ("cert", "key"))
+
+    assert pool.size == 5
+    assert get_pyxis_gql_pool("graphql.pyxis.local", ("cert", "key")) is pool
+    assert get_pyxis_gql_pool("graphql2.pyxis.local", ("cert", "key")) is not pool
+
+
+@patch("freshmaker.pyxis_gql.get_pyxis_gql_pool")
+@patch("freshmaker.pyxis_gql.PyxisGQL")
+@patch("freshmaker.pyxis_gql.conf")
+def test_pyxis_gql_client_pool_disabled(mock_conf, mock_pyxis_gql, get_pool):
+    mock_conf.pyxis_gql_pool_enabled = False
+
+    with pyxis_gql_client("graphql.pyxis.local", ("cert", "key")) as client:
+        assert client is mock_pyxis_gql.return_value
+
+    get_pool.assert_not_called()
+
+
+def _fake_pages(items, page_size, total=None):
+    """Returns function responding to a page number like the find_images query"""
+
+    def query(self, page_num, projection=""):
+        data = items[page_num * page_size : (page_num + 1) * page_size]
+        response = {"data": data, "error": None, "page": page_num, "page_size": page_size}
+        response["total"] = len(items) if total is None else total
+        return {"find_images": response}
+
+    return query
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_paginate_fetches_pages_concurrently(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_page_fetch_concurrency = 3
+    mock_conf.pyxis_adaptive_page_size = False
+    mock_conf.pyxis_gql_pool_enabled = False
+    items = list(range(11))
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    with patch.object(PyxisGQL, "query", autospec=True, side_effect=_fake_pages(items, 2)) as query:
+        ret = pyxis_gql._paginate("find_images", lambda page_num, page_size: page_num)
+
+    assert ret == items
+    assert sorted(call.args[1] for call in query.call_args_list) == list(range(6))
+    # The first page is fetched by the original client, other pages by new ones
+    assert query.call_args_list[0].args[0] is pyxis_gql
+    assert all(call.args[0] is not pyxis_gql for call in query.call_args_list[1:])
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_paginate_sequentially(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_page_fetch_concurrency = 1
+    mock_conf.pyxis_adaptive_page_size = False
+    items = list(range(6))
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    with patch.object(PyxisGQL, "query", autospec=True, side_effect=_fake_pages(items, 2)) as query:
+        ret = pyxis_gql._paginate("find_images", lambda page_num, page_size: page_num)
+
+    assert ret == items
+    # The last page is full, so one more page is fetched to find out it's the end
+    assert [call.args[1] for call in query.call_args_list] == [0, 1, 2, 3]
+    assert all(call.args[0] is pyxis_gql for call in query.call_args_list)
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_paginate_more_results_than_total(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_page_fetch_concurrency = 2
+    mock_conf.pyxis_adaptive_page_size = False
+    mock_conf.pyxis_gql_pool_enabled = False
+    items = list(range(7))
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+    # Results were added after the first page was fetched
+    fake_pages = _fake_pages(items, 2, total=4)
+
+    with patch.object(PyxisGQL, "query", autospec=True, side_effect=fake_pages):
+        ret = pyxis_gql._paginate("find_images", lambda page_num, page_size: page_num)
+
+    assert ret == items
+
+
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_paginate_process_page(mock_client, mock_transport):
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    def process_page(data):
+        data[:] = [item * 10 for item in data]
+
+    with patch.object(PyxisGQL, "query", autospec=True, side_effect=_fake_pages([1, 2, 3], 2)):
+        ret = pyxis_gql._paginate("find_images", lambda page_num, page_size: page_num, process_page)
+
+    assert ret == [10, 20, 30]
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_iter_pages(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_page_fetch_concurrency = 1
+    mock_conf.pyxis_adaptive_page_size = False
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    fake_pages = _fake_pages([1, 2, 3], 2)
+
+    with patch.object(PyxisGQL, "query", autospec=True, side_effect=fake_pages) as query:
+        pages = pyxis_gql._iter_pages("find_images", lambda page_num, page_size: page_num)
+        # The pages are fetched only when they are consumed
+        assert next(pages) == [1, 2]
+        assert query.call_count == 1
+        assert list(pages) == [[3]]
+
+
+@patch("freshmaker.pyxis_gql.dsl_gql")
+@patch("freshmaker.pyxis_gql.DSLQuery")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_query_timeout_without_retries(mock_client, mock_transport, dsl_query, dsl_gql):
+    error = {"status": 500, "detail": "Pyxis API was unable to fetch data from MongoDB in time"}
+    mock_client.return_value.execute.return_value = {"find_images": {"error": error}}
+    mock_client.return_value.transport.response_headers = {}
+    query_dsl = Mock()
+    query_dsl.name = "find_images"
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    with timeout_retries(False):
+        with pytest.raises(PyxisGQLRequestTimeout):
+            pyxis_gql.query(query_dsl)
+
+    # The timed out query is not retried
+    assert mock_client.return_value.execute.call_count == 1
+
+
+@patch("freshmaker.pyxis_gql.conf")
+def test_page_size_controller(mock_conf, tmp_path):
+    mock_conf.pyxis_adaptive_page_size = True
+    mock_conf.pyxis_min_page_size = 10
+    mock_conf.pyxis_max_page_size = 120
+    mock_conf.pyxis_page_size_target_latency = 5
+    state_file = str(tmp_path / "page_sizes.json")
+    controller = PyxisPageSizeController(state_file)
+
+    assert controller.get("find_images_by_nvr", 100) == 100
+    # Slow or partial pages do not change the page size
+    controller.record_page("find_images_by_nvr", 100, 10, 100)
+    controller.record_page("find_images_by_nvr", 100, 1, 50)
+    assert controller.get("find_images_by_nvr", 100) == 100
+    # Fast full pages grow it, up to the maximum
+    controller.record_page("find_images_by_nvr", 100, 1, 100)
+    assert controller.get("find_images_by_nvr", 100) == 120
+    # Concurrent timeouts of the pages with the same page size shrink it once
+    controller.record_timeout("find_images_by_nvr", 120)
+    controller.record_timeout("find_images_by_nvr", 120)
+    assert controller.get("find_images_by_nvr", 100) == 60
+    # Pages fetched with an outdated page size are ignored
+    controller.record_page("find_images_by_nvr", 120, 1, 120)
+    assert controller.get("find_images_by_nvr", 100) == 60
+
+    # The learned page sizes survive restarts
+    assert PyxisPageSizeController(state_file).get("find_images_by_nvr", 100) == 60
+    assert PyxisPageSizeController(state_file).get("find_images_by_names", 100) == 100
+
+    mock_conf.pyxis_adaptive_page_size = False
+    assert controller.get("find_images_by_nvr", 100) == 100
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_iter_pages_shrinks_timed_out_first_page(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_adaptive_page_size = True
+    mock_conf.pyxis_min_page_size = 2
+    mock_conf.pyxis_max_page_size = 10
+    # Do not grow the page size
+    mock_conf.pyxis_page_size_target_latency = 0
+    mock_conf.pyxis_page_fetch_concurrency = 1
+    controller = PyxisPageSizeController()
+    items = list(range(5))
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+    page_sizes = []
+
+    def build_query(page_num, page_size):
+        page_sizes.append(page_size)
+        return page_num, page_size
+
+    def query(self, query_dsl, projection=""):
+        page_num, page_size = query_dsl
+        if page_size > 4:
+            raise PyxisGQLRequestTimeout("Pyxis API was unable to fetch data from MongoDB")
+        return _fake_pages(items, page_size)(self, page_num)
+
+    with (
+        patch("freshmaker.pyxis_gql.page_size_controller", new=controller),
+        patch.object(PyxisGQL, "query", autospec=True, side_effect=query) as mock_query,
+    ):
+        ret = pyxis_gql._paginate("find_images", build_query, default_page_size=8)
+
+    assert ret == items
+    # The timed out first page is not retried with the same page size
+    assert page_sizes == [8, 4, 4]
+    assert mock_query.call_count == 3
+    assert controller.get("find_images", 8) == 4
+
+
+def _mock_batch_pyxis(images):
+    def _query(nvr, page_num, page_size, projection):
+        field = Mock()
+        field.alias.side_effect = lambda alias: (alias, nvr)
+        return field
+
+    def _query_batch(fields, query_name):
+        response = {}
+        for alias, nvr in fields:
+            data = images[nvr]
+            # More baz images than one page, they need to be paginated separately
+            total = 3 if nvr == "baz-1-1" else len(data)
+            response[alias] = {"error": None, "page_size": 2, "total": total, "data": data}
+        return response
+
+    pyxis_gql = Mock()
+    pyxis_gql._find_images_by_nvr_query.side_effect = _query
+    pyxis_gql.query_batch.side_effect = _query_batch
+    return pyxis_gql
+
+
+@patch("freshmaker.pyxis_gql.conf")
+def test_nvr_batcher(mock_conf):
+    mock_conf.pyxis_adaptive_page_size = False
+    mock_conf.pyxis_default_page_size = 2
+    mock_conf.pyxis_nvr_batch_size = 10
+    mock_conf.pyxis_nvr_batch_window = 60000
+    images = {
+        "first-1-1": [],
+        "foo-1-1": [{"brew": {"build": "foo-1-1"}}],
+        "bar-1-1": [],
+        "baz-1-1": [{"brew": {"build": "baz-1-1"}}] * 2,
+    }
+    pyxis_gql = _mock_batch_pyxis(images)
+    query_batch = pyxis_gql.query_batch.side_effect
+    release = threading.Event()
+
+    def _query_batch(fields, query_name):
+        # Keep the first batch in flight until the other lookups are collected
+        release.wait(10)
+        return query_batch(fields, query_name)
+
+    pyxis_gql.query_batch.side_effect = _query_batch
+    batcher = PyxisNVRBatcher()
+    results = {}
+
+    def lookup(nvr):
+        results[nvr] = batcher.find_images_by_nvr(pyxis_gql, nvr)
+
+    threads = [threading.Thread(target=lookup, args=(nvr,)) for nvr in images]
+    threads[0].start()
+    while not pyxis_gql.query_batch.called:
+        threading.Event().wait(0.01)
+    for thread in threads[1:]:
+        thread.start()
+    while not batcher._batch or len(batcher._batch.lookups) < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    # The lookups done while the first one is in flight are sent in one batch
+    assert [len(call.args[0]) for call in pyxis_gql.query_batch.call_args_list] == [1, 3]
+    assert results == {
+        "first-1-1": [],
+        "foo-1-1": images["foo-1-1"],
+        "bar-1-1": [],
+        "baz-1-1": None,
+    }
+
+
+@patch("freshmaker.pyxis_gql.conf")
+def test_nvr_batcher_sends_lone_lookup_right_away(mock_conf):
+    mock_conf.pyxis_adaptive_page_size = False
+    mock_conf.pyxis_default_page_size = 2
+    mock_conf.pyxis_nvr_batch_size = 10
+    mock_conf.pyxis_nvr_batch_window = 60000
+    images = {"foo-1-1": [{"brew": {"build": "foo-1-1"}}], "bar-1-1": []}
+    pyxis_gql = _mock_batch_pyxis(images)
+    batcher = PyxisNVRBatcher()
+
+    start = time.monotonic()
+    assert batcher.find_images_by_nvr(pyxis_gql, "foo-1-1") == images["foo-1-1"]
+    assert batcher.find_images_by_nvr(pyxis_gql, "bar-1-1") == []
+
+    assert time.monotonic() - start < 10
+    assert pyxis_gql.query_batch.call_count == 2
+
+
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_query_batch(mock_client, mock_transport):
+    pyxis_schema_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "fixtures",
+        "pyxis.graphql",
+    )
+    with open(pyxis_schema_path) as source:
+        document = parse(source.read())
+    schema = build_ast_schema(document)
+    flexmock(PyxisGQL).should_receive("dsl_schema").and_return(DSLSchema(schema))
+
+    ok = {"data": [], "error": None, "page": 0, "page_size": 2, "total": 0}
+    failed = {"data": None, "error": {"status": 500, "detail": "error"}, "page": 0}
+    mock_transport.return_value.response_headers = {"Content-Length": "100"}
+    mock_client.return_value.transport = mock_transport.return_value
+    mock_client.return_value.execute.return_value = {"nvr0": ok, "nvr1": failed}
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+    fields = [
+        pyxis_gql._find_images_by_nvr_query(nvr, 0, 2).alias(f"nvr{i}")
+        for i, nvr in enumerate(["foo-1-1", "bar-1-1"])
+    ]
+
+    with patch("freshmaker.pyxis_gql.pyxis_query_latency") as latency:
+        assert pyxis_gql.query_batch(fields, "find_images_by_nvr_batch") == {"nvr0": ok}
+
+    mock_client.return_value.execute.assert_called_once()
+    latency.labels.assert_called_once_with("find_images_by_nvr_batch", "")
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_query_metrics_projection(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_nvr_batching = False
+    mock_conf.pyxis_adaptive_page_size = False
+    mock_conf.pyxis_default_page_size = 250
+    pyxis_schema_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "fixtures",
+        "pyxis.graphql",
+    )
+    with open(pyxis_schema_path) as source:
+        document = parse(source.read())
+    schema = build_ast_schema(document)
+    flexmock(PyxisGQL).should_receive("dsl_schema").and_return(DSLSchema(schema))
+
+    page = {"data": [], "error": None, "page": 0, "page_size": 250, "total": 0}
+    mock_transport.return_value.response_headers = {"Content-Length": "100"}
+    mock_client.return_value.transport = mock_transport.return_value
+    mock_client.return_value.execute.return_value = {"find_images_by_nvr": page}
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    with (
+        patch("freshmaker.pyxis_gql.pyxis_query_latency") as latency,
+        patch("freshmaker.pyxis_gql.pyxis_query_response_size") as response_size,
+    ):
+        pyxis_gql.find_images_by_nvr("foo-1-1", IMAGE_PROJECTION_REPOS)
+
+    # The response sizes and latencies of the projection profiles are
+    # recorded separately, so they can be compared.
+    latency.labels.assert_called_once_with("find_images_by_nvr", IMAGE_PROJECTION_REPOS)
+    response_size.labels.assert_called_once_with("find_images_by_nvr", IMAGE_PROJECTION_REPOS)
+    response_size.labels.return_value.observe.assert_called_once_with(100)
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.RequestsHTTPTransport")
+@patch("freshmaker.pyxis_gql.Client")
+def test_iter_images_for_rpm_index(mock_client, mock_transport, mock_conf):
+    mock_conf.pyxis_adaptive_page_size = False
+    mock_conf.pyxis_small_page_size = 2
+    pyxis_schema_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "fixtures",
+        "pyxis.graphql",
+    )
+    with open(pyxis_schema_path) as source:
+        document = parse(source.read())
+    schema = build_ast_schema(document)
+    flexmock(PyxisGQL).should_receive("dsl_schema").and_return(DSLSchema(schema))
+
+    def _image(image_id, date):
+        return {"_id": image_id, "last_update_date": date}
+
+    def _response(*images):
+        return {
+            "find_images": {
+                "data": list(images),
+                "error": None,
+                "page": 0,
+                "page_size": 2,
+                "total": None,
+            }
+        }
+
+    mock_transport.return_value.response_headers = {}
+    mock_client.return_value.transport = mock_transport.return_value
+    mock_client.return_value.execute.side_effect = [
+        _response(_image("2", "2026-01-01"), _image("3", "2026-01-02")),
+        # The image "3" is returned again, the cursor filter includes its date
+        _response(_image("3", "2026-01-02"), _image("4", "2026-01-02")),
+        _response(_image("5", "2026-01-03")),
+    ]
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    pages = list(pyxis_gql.iter_images_for_rpm_index("2026-01-01", "1"))
+
+    assert [[image["_id"] for image in page] for page in pages] == [["2", "3"], ["4"], ["5"]]
+    queries = [
+        "".join(call.args[0].payload["query"].split())
+        for call in mock_client.return_value.execute.call_args_list
+    ]
+    # Every page is the first one, after the cursor of the last image
+    assert all("page:0" in query for query in queries)
+    assert '_id:{gt:"1"}' in queries[0]
+    assert 'last_update_date:{gt:"2026-01-02"}' in queries[1]
+    assert '_id:{gt:"3"}' in queries[1]
+    assert '_id:{gt:"4"}' in queries[2]
+    assert '{field:"_id",order:ASC}' in queries[0]
+
+
+def test_get_image_projection():
+    pyxis_schema_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "fixtures",
+        "pyxis.graphql",
+    )
+    with open(pyxis_schema_path) as source:
+        document = parse(source.read())
+    schema = build_ast_schema(document)
+
+    flexmock(PyxisGQL).should_receive("dsl_schema").and_return(DSLSchema(schema))
+    pyxis_gql = PyxisGQL(url="graphql.pyxis.local", cert="/path/to/cert")
+
+    def _projection(profile):
+        return "\n".join(print_ast(f.ast_field) for f in pyxis_gql._get_image_projection(profile))
+
+    minimal = _projection(IMAGE_PROJECTION_MINIMAL)
+    assert "brew" in minimal
+    assert "repositories" not in minimal
+    repos = _projection(IMAGE_PROJECTION_REPOS)
+    assert "repositories" in repos
+    assert "rpm_manifest" not in repos
+    rpm_names = _projection(IMAGE_PROJECTION_RPM_NAMES)
+    assert "nvra" in rpm_names
+    assert "srpm_nevra" not in rpm_names
+    assert "srpm_nevra" in _projection(IMAGE_PROJECTION_FULL)
+
+    with pytest.raises(ValueError, match="Unknown image projection profile"):
+        pyxis_gql._get_image_projection("everything")
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql.PyxisGQL._find_repositories_by_filter")
+@patch("freshmaker.pyxis_gql.PyxisRepositoryCatalog._start_refresher")
+def test_repository_catalog(start_refresher, find_repositories, mock_conf, tmp_path):
+    mock_conf.repository_catalog_refresh_interval = 600
+    mock_conf.repository_catalog_max_age = 3600
+    find_repositories.return_value = [
+        {
+            "registry": "registry.example.com",
+            "repository": "product/repo1",
+            "published": True,
+            "release_categories": ["Generally Available"],
+            "auto_rebuild_tags": ["latest"],
+        },
+        {
+            "registry": "registry.example.com",
+            "repository": "product/repo2",
+            "published": False,
+            "release_categories": ["Beta"],
+            "auto_rebuild_tags": [],
+        },
+    ]
+    catalog_file = str(tmp_path / "repositories.json")
+    catalog = PyxisRepositoryCatalog("graphql.pyxis.local", "/path/to/cert", catalog_file)
+
+    # The callers query Pyxis until the catalog is fetched
+    assert catalog.find_repositories() is None
+    catalog.refresh_if_stale()
+    find_repositories.assert_called_once_with({"vendor_label": {"eq": "redhat"}})
+    # The catalog is fresh, it is not fetched again
+    catalog.refresh_if_stale()
+    assert find_repositories.call_count == 1
+
+    repos = catalog.find_repositories(published=True, release_categories=["Generally Available"])
+    assert [r["repository"] for r in repos] == ["product/repo1"]
+    assert catalog.find_repositories(auto_rebuild_tags=["latest"], names=["product/repo2"]) == []
+    assert catalog.find_repositories_by_repository_name("product/repo2")[0]["published"] is False
+    repo = catalog.get_repository_by_registry_path("registry.example.com", "product/repo2")
+    assert repo["repository"] == "product/repo2"
+    # Repositories missing in the catalog are queried from Pyxis
+    assert catalog.get_repository_by_registry_path("quay.io", "product/repo2") is None
+
+    # Other processes load the stored catalog
+    other_catalog = PyxisRepositoryCatalog("graphql.pyxis.local", "/path/to/cert", catalog_file)
+    assert len(other_catalog.find_repositories()) == 2
+    assert find_repositories.call_count == 1
+
+    # Outdated catalog is not used
+    mock_conf.repository_catalog_max_age = -1
+    assert other_catalog.find_repositories() is None
+
+
+@patch("freshmaker.pyxis_gql.conf")
+@patch("freshmaker.pyxis_gql._repository_catalogs", new_callable=dict)
+def test_get_repository_catalog_per_host(repository_catalogs, mock_conf, tmp_path):
+    mock_conf.repository_catalog_file = ""
+    assert get_repository_catalog("https://graphql.pyxis.local/graphql/", "/path/to/cert") is None
+
+    mock_conf.repository_catalog_file = str(tmp_path / "repositories.json")
+    catalog = get_repository_catalog("https://graphql.pyxis.local/graphql/", "/path/to/cert")
+    assert catalog.catalog_file == str(tmp_path / "repositories.graphql.pyxis.local.json")
+    assert (
+        get_repository_catalog("https://graphql.pyxis.local/graphql/", "/path/to/cert") is catalog
+    )
+
+    other = get_repository_catalog("graphql.pyxis.stage.local", "/path/to/cert")
+    assert other.catalog_file == str(tmp_path / "repositories.graphql.pyxis.stage.local.json")
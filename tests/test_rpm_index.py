@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from unittest.mock import patch
+
+from freshmaker.rpm_index import RPMImageIndex
+
+
+def _image(image_id, nvr, rpms, published=True, tags=("latest",), updated="2026-01-01"):
+    return {
+        "_id": image_id,
+        "last_update_date": updated,
+        "architecture": "amd64",
+        "brew": {"build": nvr},
+        "content_sets": ["rhel-8-for-x86_64-baseos-rpms"],
+        "repositories": [
+            {
+                "registry": "registry.example.com",
+                "repository": "product/repo1",
+                "published": published,
+                "tags": [{"name": tag} for tag in tags],
+            }
+        ],
+        "edges": {
+            "rpm_manifest": {
+                "data": {"rpms": [{"name": name, "nvra": f"{name}-1-1.x86_64"} for name in rpms]}
+            }
+        },
+    }
+
+
+@patch("freshmaker.rpm_index.conf")
+@patch("freshmaker.rpm_index.PyxisGQL.iter_images_for_rpm_index")
+@patch("freshmaker.rpm_index.RPMImageIndex._start_syncer")
+def test_rpm_index(start_syncer, iter_images, mock_conf, tmp_path):
+    mock_conf.rpm_index_sync_interval = 300
+    mock_conf.rpm_index_max_age = 3600
+    index = RPMImageIndex("graphql.pyxis.local", "/path/to/cert", str(tmp_path / "index.db"))
+
+    # The index is not used until it is synced
+    assert index.find_image_nvrs(["openssl"]) is None
+
+    iter_images.return_value = [
+        [_image("1", "foo-1-1", ["openssl", "bash"]), _image("2", "bar-1-1", ["bash"])],
+        [_image("3", "baz-1-1", ["openssl"], tags=["1.0"], updated="2026-01-02")],
+    ]
+    index.sync_if_stale()
+    iter_images.assert_called_once_with(None, None)
+
+    assert index.find_image_nvrs(["openssl"]) == {"foo-1-1", "baz-1-1"}
+    assert index.find_image_nvrs(["openssl"], tags=["latest"]) == {"foo-1-1"}
+    assert index.find_image_nvrs(["bash"], content_sets=["other-rpms"]) == set()
+    assert index.find_image_nvrs(["bash"], repositories=["product/repo1"], published=True) == {
+        "foo-1-1",
+        "bar-1-1",
+    }
+
+    # The next sync only fetches the images updated since the last one
+    iter_images.reset_mock()
+    iter_images.return_value = [
+        [_image("1", "foo-1-1", ["bash"], published=False, updated="2026-01-03")]
+    ]
+    index.sync()
+    iter_images.assert_called_once_with("2026-01-02", "3")
+    assert index.find_image_nvrs(["openssl"]) == {"baz-1-1"}
+    assert index.find_image_nvrs(["bash"], published=True) == {"bar-1-1"}
+
+    # Outdated index is not used
+    mock_conf.rpm_index_max_age = -1
+    assert index.find_image_nvrs(["openssl"]) is None
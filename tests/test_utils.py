@@ -20,6 +20,11 @@
 #
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
+import copy
+import functools
+import pickle
+import random
+import threading
 from unittest import TestCase
 from unittest.mock import patch
 
@@ -28,11 +33,24 @@ import pytest
 
 from freshmaker import conf
 from freshmaker.models import ArtifactType
+import kobo.rpmlib
+
 from freshmaker.utils import (
+    compare_parsed_rpms,
+    freeze,
+    FrozenDict,
+    FrozenList,
+    SingleFlight,
+    singleflight,
     get_rebuilt_nvr,
+    kahn_layers,
+    parse_rpm_nvra,
+    parse_rpm_nvrs,
     sorted_by_nvr,
     is_valid_ocp_versions_range,
     load_remote_yaml,
+    nvr_sort_key,
+    rpmvercmp_key,
 )
 from tests import helpers
 
@@ -57,6 +75,17 @@ def test_is_valid_ocp_versions_range():
     assert not is_valid_ocp_versions_range("v4.7,v4.8")
 
 
+def test_kahn_layers():
+    parents = {"app": "runtime", "runtime": "base", "tool": "base", "base": "external"}
+    nodes = ["app", "tool", "runtime", "base", "other"]
+    assert kahn_layers(nodes, parents.get) == [["base", "other"], ["tool", "runtime"], ["app"]]
+
+
+def test_kahn_layers_cycle():
+    parents = {"a": "b", "b": "a", "c": "c"}
+    assert kahn_layers(["a", "b", "c"], parents.get) == [["c"]]
+
+
 class TestSortedByNVR(helpers.FreshmakerTestCase):
     def test_simple_list(self):
         lst = ["foo-1-10", "foo-1-2", "foo-1-1"]
@@ -89,6 +118,215 @@ class TestSortedByNVR(helpers.FreshmakerTestCase):
         self.assertEqual(ret, list(reversed(expected)))
 
 
+@pytest.mark.parametrize(
+    "version1, version2, expected",
+    (
+        ("1.0", "1.0.1", -1),
+        ("1.0~rc1", "1.0", -1),
+        ("1.0~rc1", "1.0~rc2", -1),
+        ("1.0^git1", "1.0", 1),
+        ("1.0^git1", "1.0.1", -1),
+        ("1.0^git1", "1.0~rc1", 1),
+        ("1a", "1.a", 0),
+        ("1.010", "1.10", 0),
+        ("1.a", "1.1", -1),
+        ("", "0", -1),
+    ),
+)
+def test_rpmvercmp_key(version1, version2, expected):
+    key1, key2 = rpmvercmp_key(version1), rpmvercmp_key(version2)
+    assert (key1 > key2) - (key1 < key2) == expected
+
+
+def _random_nvr(rand):
+    def _random_version():
+        return rand.choice("0123456789") + "".join(
+            rand.choice("00123456789aAbz.~^_+") for _ in range(rand.randint(0, 8))
+        )
+
+    epoch = rand.choice(["", "0:", "1:", "10:"])
+    name = rand.choice(["foo", "bar", "foo-bar"])
+    return f"{name}-{epoch}{_random_version()}-{_random_version()}"
+
+
+def test_nvr_sort_key_equals_compare_nvr():
+    rand = random.Random(0)
+    nvrs = [_random_nvr(rand) for _ in range(500)]
+
+    for nvr1, nvr2 in zip(nvrs, rand.sample(nvrs, len(nvrs))):
+        parsed1, parsed2 = kobo.rpmlib.parse_nvr(nvr1), kobo.rpmlib.parse_nvr(nvr2)
+        if parsed1["name"] != parsed2["name"]:
+            continue
+        key1, key2 = nvr_sort_key(nvr1), nvr_sort_key(nvr2)
+        assert (key1 > key2) - (key1 < key2) == kobo.rpmlib.compare_nvr(
+            parsed1, parsed2
+        ), f"{nvr1} vs {nvr2}"
+
+    def _compare_nvrs(nvr1, nvr2):
+        parsed1, parsed2 = kobo.rpmlib.parse_nvr(nvr1), kobo.rpmlib.parse_nvr(nvr2)
+        if parsed1["name"] != parsed2["name"]:
+            return (parsed1["name"] > parsed2["name"]) - (parsed1["name"] < parsed2["name"])
+        return kobo.rpmlib.compare_nvr(parsed1, parsed2)
+
+    assert sorted_by_nvr(nvrs) == sorted(nvrs, key=functools.cmp_to_key(_compare_nvrs))
+
+
+@pytest.mark.parametrize(
+    "image_nvra, input_nvr",
+    (
+        ("openssl-1.2.3-1.el8.x86_64", "openssl-1.2.3-2.el8"),
+        ("openssl-1.2.3-2.el8.x86_64", "openssl-1.2.3-2.el8"),
+        ("openssl-1.2.10-1.el8.x86_64", "openssl-1.2.9-1.el8"),
+        ("openssl-1:1.2.3-1.el8.x86_64", "openssl-1.2.3-1.el8"),
+        ("perl-5.30-1.module+el8.1+123.x86_64", "perl-5.30-1.module+el8.2+456"),
+    ),
+)
+def test_compare_parsed_rpms(image_nvra, input_nvr):
+    image_rpm = parse_rpm_nvra(image_nvra)
+    input_rpm = parse_rpm_nvrs({"openssl": [input_nvr]})["openssl"][0]
+
+    expected = kobo.rpmlib.compare_nvr(
+        kobo.rpmlib.parse_nvra(image_nvra), kobo.rpmlib.parse_nvr(input_nvr), ignore_epoch=True
+    )
+    assert compare_parsed_rpms(image_rpm, input_rpm) == expected
+    assert image_rpm[1] == ("module+" in image_nvra)
+
+
+def test_parse_rpm_nvrs_single_nvr():
+    assert parse_rpm_nvrs({"openssl": "openssl-1.2.3-1.el8"}) == {
+        "openssl": [(("0", "1.2.3", "1.el8"), False)]
+    }
+
+
+def test_freeze():
+    data = {"brew": {"build": "foo-1-1"}, "repositories": [{"tags": [{"name": "latest"}]}]}
+    frozen = freeze(data)
+
+    assert frozen == data
+    assert isinstance(frozen, FrozenDict)
+    assert isinstance(frozen["repositories"], FrozenList)
+    assert isinstance(frozen["repositories"][0]["tags"][0], FrozenDict)
+    with pytest.raises(TypeError):
+        frozen["brew"]["build"] = "foo-1-2"
+    with pytest.raises(TypeError):
+        frozen["repositories"].append({})
+    with pytest.raises(TypeError):
+        del frozen["brew"]
+    # The frozen data is never copied and can be pickled by the cache.
+    assert copy.deepcopy(frozen) is frozen
+    unpickled = pickle.loads(pickle.dumps(frozen))
+    assert unpickled == data
+    assert isinstance(unpickled["repositories"], FrozenList)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    waiting = threading.Semaphore(0)
+    calls = []
+
+    def fetch(nvr):
+        calls.append(nvr)
+        started.set()
+        release.wait()
+        return {"nvr": nvr}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("foo-1-1", fetch, "foo-1-1")))
+        for _ in range(5)
+    ]
+    with patch("freshmaker.utils.singleflight_coalesced_counter") as counter:
+        counter.labels.return_value.inc.side_effect = waiting.release
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # Wait until all the other calls wait for the first one
+        for _ in threads[1:]:
+            assert waiting.acquire(timeout=10)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert calls == ["foo-1-1"]
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+    counter.labels.assert_called_with("test")
+    # The result is not kept once the call finishes
+    assert flight.do("foo-1-1", lambda: "new") == "new"
+
+
+def test_single_flight_shares_exception():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        flight.do("key", fail)
+    assert not flight._flights
+
+
+def test_single_flight_do_multi():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    waiting = threading.Semaphore(0)
+    batches = []
+
+    def fetch(keys):
+        batches.append(keys)
+        if len(batches) == 1:
+            started.set()
+            release.wait()
+        return {key: ValueError(key) if key == "bar-1-1" else key.upper() for key in keys}
+
+    leader = threading.Thread(target=flight.do_multi, args=(["foo-1-1", "bar-1-1"], fetch))
+    results = []
+    with patch("freshmaker.utils.singleflight_coalesced_counter") as counter:
+        counter.labels.return_value.inc.side_effect = waiting.release
+        leader.start()
+        started.wait()
+        follower = threading.Thread(
+            target=lambda: results.append(
+                flight.do_multi(["foo-1-1", "bar-1-1", "baz-1-1", "baz-1-1"], fetch)
+            )
+        )
+        follower.start()
+        # The follower fetches only the key not in flight, then waits for
+        # the keys in flight
+        assert waiting.acquire(timeout=10)
+        release.set()
+        leader.join()
+        follower.join()
+
+    assert batches == [["foo-1-1", "bar-1-1"], ["baz-1-1"]]
+    assert results[0]["foo-1-1"] == "FOO-1-1"
+    assert results[0]["baz-1-1"] == "BAZ-1-1"
+    assert isinstance(results[0]["bar-1-1"], ValueError)
+    assert not flight._flights
+
+
+def test_singleflight_decorator_instance_key():
+    class Client:
+        def __init__(self, url):
+            self.url = url
+
+        @singleflight(instance_key=lambda self: self.url)
+        def find(self, nvrs):
+            return list(nvrs)
+
+    client = Client("https://pyxis.example.com")
+    with patch.object(SingleFlight, "do", autospec=True, return_value=[]) as do:
+        client.find(["foo-1-1"])
+        Client("https://pyxis.example.com").find(["foo-1-1"])
+
+    keys = [call.args[1] for call in do.call_args_list]
+    assert keys[0] == keys[1] == ("https://pyxis.example.com", (("foo-1-1",),), ())
+
+
 class TestLoadRemoteYaml(TestCase):
     @patch("requests.get")
     def test_simple_yaml(self, mock_get):
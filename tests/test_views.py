@@ -850,6 +850,7 @@ class TestManualTriggerRebuild(ViewBaseTest):
                 "state_reason": None,
                 "time_created": "2017-08-21T13:42:20Z",
                 "time_done": None,
+                "predicted_time_done": None,
                 "url": "/api/1/events/1",
                 "dry_run": False,
                 "requester": "root",
@@ -909,6 +910,7 @@ class TestManualTriggerRebuild(ViewBaseTest):
                 "state_reason": None,
                 "time_created": "2000-01-02T03:04:05Z",
                 "time_done": None,
+                "predicted_time_done": None,
                 "url": "/api/1/events/2",
             },
         )
@@ -1279,6 +1281,7 @@ class TestAsyncBuild(ViewBaseTest):
                 "state_reason": None,
                 "time_created": "2017-08-21T13:42:20Z",
                 "time_done": None,
+                "predicted_time_done": None,
                 "url": "/api/1/events/1",
             },
         )